@@ -0,0 +1,213 @@
+# -*- coding: utf-8 -*-
+"""
+Throughput and latency benchmark of the pipeline package.
+
+Every configuration runs source -> N stages -> SwitchStage -> W sinks for a fixed time, the stages in the middle and
+the switch use the executor under test. The results are printed as a table and can be saved as JSON, a previous
+JSON file can be given as baseline to compare the two runs:
+
+    python dev/bench_pipeline.py --output results.json
+    python dev/bench_pipeline.py --baseline results.json
+"""
+
+import argparse
+import itertools
+import json
+import os
+import platform
+import subprocess
+import time
+
+import numpy as np
+
+from computer_vision_design_patterns.pipeline import Payload, Pipeline, Stage
+from computer_vision_design_patterns.pipeline.sample_stage import SwitchStage, SyntheticStreamStage
+from computer_vision_design_patterns.pipeline.stage import StageExecutor, StageType
+
+EXECUTORS = ["thread", "process"]
+RESOLUTIONS = ["320x240", "1280x720", "1920x1080"]
+MAXSIZES = [4, 16]
+FANOUTS = [1, 4]
+STAGE_COUNTS = [1, 4]
+
+DURATION = 2.0
+WARMUP = 0.5
+KEY = "stream"
+
+
+class ForwardStage(Stage):
+    def __init__(self, stage_executor: StageExecutor, output_maxsize: int):
+        Stage.__init__(self, stage_type=StageType.One2One, stage_executor=stage_executor, output_maxsize=output_maxsize)
+
+    def pre_run(self):
+        pass
+
+    def post_run(self):
+        pass
+
+    def process(self, key: str, payload: Payload | None) -> Payload | None:
+        return payload
+
+
+class BenchSink(Stage):
+    """Count the frames and their latency from the source while measuring."""
+
+    def __init__(self):
+        Stage.__init__(self, stage_type=StageType.One2One, stage_executor=StageExecutor.THREAD)
+        self.measuring = False
+        self.frames = 0
+        self.latencies: list[float] = []
+
+    def pre_run(self):
+        pass
+
+    def post_run(self):
+        pass
+
+    def process(self, key: str, payload: Payload | None) -> Payload | None:
+        if payload is None or not self.measuring:
+            return None
+
+        self.frames += 1
+        if payload.trace is not None:
+            self.latencies.append(time.monotonic() - payload.trace.origin)
+        return None
+
+
+def cpu_time() -> float:
+    """CPU time of this process and of its joined children."""
+    times = os.times()
+    return times.user + times.system + times.children_user + times.children_system
+
+
+def run(executor: str, resolution: str, maxsize: int, fanout: int, stages: int, duration: float) -> dict:
+    width, height = (int(size) for size in resolution.split("x"))
+    stage_executor = StageExecutor[executor.upper()]
+
+    source = SyntheticStreamStage(
+        StageExecutor.THREAD, resolution=(width, height), pattern="noise", output_maxsize=maxsize, tracing=True
+    )
+    middle = [ForwardStage(stage_executor, maxsize) for _ in range(stages)]
+    switch = SwitchStage(stage_executor, output_maxsize=maxsize, queue_timeout=0.1)
+    sinks = [BenchSink() for _ in range(fanout)]
+
+    pipeline = Pipeline()
+    chain = [source, *middle, switch]
+    for stage in [*chain, *sinks]:
+        pipeline.add_stage(stage)
+    for from_stage, to_stage in zip(chain, chain[1:]):
+        pipeline.link_stages(from_stage, to_stage, KEY)
+    for sink in sinks:
+        pipeline.link_stages(switch, sink, KEY)
+
+    cpu_start = cpu_time()
+    pipeline.start()
+    time.sleep(WARMUP)
+
+    for sink in sinks:
+        sink.measuring = True
+    start = time.perf_counter()
+    time.sleep(duration)
+    for sink in sinks:
+        sink.measuring = False
+    elapsed = time.perf_counter() - start
+
+    produced = source.stats()["outputs"][KEY]
+    # A frame dropped before the switch is lost for every sink, one dropped by the switch for a single sink
+    dropped = sum(sum(stage.dropped().values()) for stage in chain[:-1]) * fanout + sum(switch.dropped().values())
+    pipeline.stop(timeout=1.0)
+    cpu = cpu_time() - cpu_start
+
+    frames = sum(sink.frames for sink in sinks) / fanout
+    latencies = np.array([latency for sink in sinks for latency in sink.latencies])
+
+    return {
+        "config": {
+            "executor": executor,
+            "resolution": resolution,
+            "maxsize": maxsize,
+            "fanout": fanout,
+            "stages": stages,
+        },
+        "frames": int(frames),
+        "fps": frames / elapsed,
+        "latency_p50": float(np.percentile(latencies, 50)) if latencies.size else None,
+        "latency_p99": float(np.percentile(latencies, 99)) if latencies.size else None,
+        "cpu_per_frame": cpu / produced if produced else None,
+        "drop_rate": dropped / (produced * fanout) if produced else 0.0,
+    }
+
+
+def metadata() -> dict:
+    try:
+        commit = subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True).stdout.strip()
+    except OSError:
+        commit = None
+
+    return {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "numpy": np.__version__,
+        "commit": commit or None,
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+    }
+
+
+def config_key(result: dict) -> tuple:
+    return tuple(sorted(result["config"].items()))
+
+
+def format_ms(seconds: float | None) -> str:
+    return f"{seconds * 1e3:.2f}" if seconds is not None else "-"
+
+
+def print_result(result: dict, baseline: dict | None):
+    config = result["config"]
+    line = (
+        f"{config['executor']:<8} {config['resolution']:<10} {config['maxsize']:>7} {config['fanout']:>6} "
+        f"{config['stages']:>6} {result['fps']:>9.1f} {format_ms(result['latency_p50']):>8} "
+        f"{format_ms(result['latency_p99']):>8} {format_ms(result['cpu_per_frame']):>8} {result['drop_rate']:>6.1%}"
+    )
+    if baseline is not None and baseline["fps"]:
+        line += f" {result['fps'] / baseline['fps']:>8.2f}x"
+    print(line, flush=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--executors", nargs="+", default=EXECUTORS, choices=EXECUTORS)
+    parser.add_argument("--resolutions", nargs="+", default=RESOLUTIONS)
+    parser.add_argument("--maxsizes", nargs="+", type=int, default=MAXSIZES)
+    parser.add_argument("--fanouts", nargs="+", type=int, default=FANOUTS)
+    parser.add_argument("--stages", nargs="+", type=int, default=STAGE_COUNTS)
+    parser.add_argument("--duration", type=float, default=DURATION)
+    parser.add_argument("--output", help="save the results to this JSON file")
+    parser.add_argument("--baseline", help="JSON file of a previous run to compare with")
+    args = parser.parse_args()
+
+    baseline = {}
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = {config_key(result): result for result in json.load(f)["results"]}
+
+    print(
+        f"{'executor':<8} {'resolution':<10} {'maxsize':>7} {'fanout':>6} {'stages':>6} {'fps':>9} {'p50 ms':>8} "
+        f"{'p99 ms':>8} {'cpu ms':>8} {'drops':>6}" + (f" {'vs base':>9}" if baseline else "")
+    )
+
+    results = []
+    for executor, resolution, maxsize, fanout, stages in itertools.product(
+        args.executors, args.resolutions, args.maxsizes, args.fanouts, args.stages
+    ):
+        result = run(executor, resolution, maxsize, fanout, stages, args.duration)
+        results.append(result)
+        print_result(result, baseline.get(config_key(result)) if baseline else None)
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"metadata": metadata(), "results": results}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,71 @@
+# -*- coding: utf-8 -*-
+import time
+
+import numpy as np
+
+from computer_vision_design_patterns.pipeline import Payload, Stage
+from computer_vision_design_patterns.pipeline.sample_stage import RGB2GRAYStage, SwitchStage
+from computer_vision_design_patterns.pipeline.sample_stage.SimpleStreamStage import VideoStreamOutput
+from computer_vision_design_patterns.pipeline.stage import StageExecutor, StageType
+
+FRAMES = 512
+RESOLUTIONS = [(120, 160), (480, 640), (1080, 1920)]
+BATCH_SIZES = [1, 8, 32]
+
+
+class QueueStage(Stage):
+    """Stage used only to own the queues around the benchmarked stage."""
+
+    def __init__(self):
+        Stage.__init__(self, stage_type=StageType.One2One, stage_executor=StageExecutor.THREAD)
+
+    def pre_run(self):
+        pass
+
+    def post_run(self):
+        pass
+
+    def process(self, key: str, payload: Payload | None) -> Payload | None:
+        return payload
+
+
+def run(stage: Stage, frame: np.ndarray) -> float:
+    """Push FRAMES payloads through the stage and return its throughput in frames per second."""
+    source = QueueStage()
+    sink = QueueStage()
+    source.link(stage, "stream")
+    stage.link(sink, "stream")
+
+    for _ in range(FRAMES):
+        source.put_to_right("stream", VideoStreamOutput(frame=frame))
+
+    start = time.perf_counter()
+    while not stage.input_queues["stream"].empty():
+        stage._process_stage()
+    elapsed = time.perf_counter() - start
+
+    assert sink.input_queues["stream"].qsize() == FRAMES
+    return FRAMES / elapsed
+
+
+def main():
+    print(f"{'stage':<14} {'resolution':<12} {'batch':>5} {'fps':>10} {'speedup':>8}")
+
+    for stage_class in (RGB2GRAYStage, SwitchStage):
+        for height, width in RESOLUTIONS:
+            frame = np.random.randint(0, 256, (height, width, 3), dtype=np.uint8)
+            baseline = None
+
+            for batch_size in BATCH_SIZES:
+                stage = stage_class(StageExecutor.THREAD, batch_size=batch_size)
+                fps = run(stage, frame)
+                baseline = baseline or fps
+
+                print(
+                    f"{stage_class.__name__:<14} {f'{width}x{height}':<12} {batch_size:>5} {fps:>10.1f} "
+                    f"{fps / baseline:>7.2f}x"
+                )
+
+
+if __name__ == "__main__":
+    main()
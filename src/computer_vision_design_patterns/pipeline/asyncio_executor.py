@@ -0,0 +1,85 @@
+# -*- coding: utf-8 -*-
+from __future__ import annotations
+
+import asyncio
+import concurrent.futures
+import inspect
+import threading
+from typing import Any, Callable, Coroutine
+
+
+class EventLoopThread:
+    """Event loop running in its own thread, shared by the ASYNCIO stages."""
+
+    def __init__(self):
+        self.loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._run, name="EventLoopThread", daemon=True)
+        self._lock = threading.Lock()
+
+    def _run(self):
+        asyncio.set_event_loop(self.loop)
+        self.loop.run_forever()
+
+        self.loop.run_until_complete(self.loop.shutdown_asyncgens())
+        self.loop.close()
+
+    def start(self):
+        with self._lock:
+            if not self._thread.is_alive() and not self.loop.is_closed():
+                self._thread.start()
+
+    def is_running(self) -> bool:
+        return self._thread.is_alive()
+
+    def submit(self, coroutine: Coroutine) -> concurrent.futures.Future:
+        self.start()
+        return asyncio.run_coroutine_threadsafe(coroutine, self.loop)
+
+    def stop(self, timeout: float | None = None):
+        if self._thread.is_alive():
+            self.loop.call_soon_threadsafe(self.loop.stop)
+            self._thread.join(timeout)
+
+
+_default_event_loop: EventLoopThread | None = None
+_default_event_loop_lock = threading.Lock()
+
+
+def default_event_loop() -> EventLoopThread:
+    """Event loop used by the ASYNCIO stages started outside a Pipeline."""
+    global _default_event_loop
+
+    with _default_event_loop_lock:
+        if _default_event_loop is None or _default_event_loop.loop.is_closed():
+            _default_event_loop = EventLoopThread()
+        return _default_event_loop
+
+
+class AsyncioWorker:
+    """Worker with the interface of `threading.Thread` that runs a coroutine on an EventLoopThread."""
+
+    def __init__(self, target: Callable[[], Coroutine]):
+        self._target = target
+        self._future: concurrent.futures.Future | None = None
+        self.event_loop: EventLoopThread | None = None
+
+    def start(self):
+        if self._future is not None:
+            raise RuntimeError("Asyncio workers can only be started once")
+
+        event_loop = self.event_loop if self.event_loop is not None else default_event_loop()
+        self._future = event_loop.submit(self._target())
+
+    def is_alive(self) -> bool:
+        return self._future is not None and not self._future.done()
+
+    def join(self, timeout: float | None = None):
+        if self._future is not None:
+            concurrent.futures.wait([self._future], timeout)
+
+
+async def resolve(result: Any) -> Any:
+    """Await the result of a stage method when it has been defined with 'async def'."""
+    if inspect.isawaitable(result):
+        return await result
+    return result
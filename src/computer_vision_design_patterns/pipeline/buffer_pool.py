@@ -0,0 +1,83 @@
+# -*- coding: utf-8 -*-
+from __future__ import annotations
+
+import multiprocessing as mp
+import threading
+import weakref
+
+import numpy as np
+
+_HITS, _MISSES = 0, 1
+
+
+class BufferPool:
+    """
+    Arrays reused by a stage for its outputs, keyed by shape and dtype.
+
+    take() returns a free buffer of the shape and dtype, and allocates a new one only when there is none: pass it as
+    the 'dst' of the OpenCV functions. The buffer goes back to the pool by itself when the array and all the views on
+    it are garbage collected, that is once the linked stages are done with the payload. At most 'max_free' buffers
+    are kept for each shape and dtype.
+
+    The buffers belong to the worker process, the hit and miss counters are shared by all the workers of the stage.
+    """
+
+    def __init__(self, max_free: int = 8):
+        if max_free < 0:
+            raise ValueError(f"Invalid number of free buffers: {max_free}")
+
+        self.max_free = max_free
+        self._counters = mp.Array("q", 2)
+
+        self._init_local_state()
+
+    def _init_local_state(self):
+        # Process-local state, never shared with other processes
+        self._lock = threading.Lock()
+        self._free: dict[tuple, list[np.ndarray]] = {}
+
+    def __getstate__(self):
+        return {"max_free": self.max_free, "_counters": self._counters}
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._init_local_state()
+
+    def take(self, shape: tuple[int, ...], dtype=np.uint8) -> np.ndarray:
+        key = (tuple(shape), np.dtype(dtype))
+        with self._lock:
+            free = self._free.get(key)
+            storage = free.pop() if free else None
+
+        with self._counters.get_lock():
+            self._counters[_HITS if storage is not None else _MISSES] += 1
+
+        if storage is None:
+            storage = np.empty(key[0], dtype=key[1])
+
+        # The array does not own the memory, so the views taken on it refer to it and keep it alive: it is collected
+        # only when the last of them is
+        array = np.asarray(memoryview(storage))
+        weakref.finalize(array, self._give_back, key, storage)
+        return array
+
+    def _give_back(self, key: tuple, storage: np.ndarray):
+        with self._lock:
+            free = self._free.setdefault(key, [])
+            if len(free) < self.max_free:
+                free.append(storage)
+
+    def free_buffers(self) -> int:
+        with self._lock:
+            return sum(len(free) for free in self._free.values())
+
+    def stats(self) -> dict:
+        with self._counters.get_lock():
+            hits, misses = self._counters[_HITS], self._counters[_MISSES]
+
+        return {
+            "hits": hits,
+            "misses": misses,
+            "hit_rate": hits / (hits + misses) if hits + misses else 0.0,
+            "free": self.free_buffers(),
+        }
@@ -0,0 +1,53 @@
+# -*- coding: utf-8 -*-
+from __future__ import annotations
+
+import ctypes
+import multiprocessing as mp
+import threading
+
+
+class CreditGate:
+    """
+    Credits of a link, granted by the stage that consumes it.
+
+    The producer takes a credit before putting a payload to the queue and the consumer gives it back when it takes
+    the payload out, so at most 'credits' payloads are queued on the link. The semaphore and the counter live in shared
+    memory when the link crosses a process boundary.
+    """
+
+    def __init__(self, credits: int, shared: bool = False):
+        if credits < 1:
+            raise ValueError(f"Invalid number of credits: {credits}")
+
+        self.credits = credits
+        if shared:
+            self._semaphore = mp.Semaphore(credits)
+            self._lock = mp.Lock()
+            self._throttled = mp.RawValue(ctypes.c_int64, 0)
+        else:
+            self._semaphore = threading.Semaphore(credits)
+            self._lock = threading.Lock()
+            self._throttled = ctypes.c_int64(0)
+
+    @property
+    def throttled(self) -> int:
+        """Number of times a source skipped a payload for lack of credits."""
+        return self._throttled.value
+
+    def acquire(self, timeout: float | None) -> bool:
+        return self._semaphore.acquire(timeout=timeout)
+
+    def wait(self, timeout: float | None, running: threading.Event) -> bool:
+        """Take a credit as long as the stage is running, return False if it stopped first."""
+        while not self._semaphore.acquire(timeout=timeout):
+            if not running.is_set():
+                return False
+        return True
+
+    def release(self, count: int = 1) -> None:
+        for _ in range(count):
+            self._semaphore.release()
+
+    def throttle(self) -> None:
+        with self._lock:
+            self._throttled.value += 1
@@ -0,0 +1,210 @@
+# -*- coding: utf-8 -*-
+from __future__ import annotations
+
+import importlib
+from dataclasses import dataclass
+from enum import Enum
+
+from computer_vision_design_patterns.pipeline import sample_stage
+from computer_vision_design_patterns.pipeline.overflow import OverflowAction, OverflowPolicy
+from computer_vision_design_patterns.pipeline.pipeline import Pipeline, topological_order
+from computer_vision_design_patterns.pipeline.registry import StreamLink
+from computer_vision_design_patterns.pipeline.stage import Stage, StageExecutor, StageTransport, StageType
+
+# Stage arguments given by name in the specs
+_ENUM_ARGUMENTS: dict[str, type[Enum]] = {"stage_executor": StageExecutor, "transport": StageTransport}
+
+
+@dataclass(frozen=True, slots=True)
+class GraphLink:
+    from_stage: str
+    to_stage: str
+    key: str
+    overflow_policy: OverflowPolicy | None = None
+
+
+class PipelineGraph:
+    """
+    Stages and links of a pipeline, described by a spec and checked before anything is linked.
+
+    The spec has a "stages" table of stage names, each with the "type" of the stage and its arguments (or a Stage
+    instance), a "links" list of {"from", "to", "key"} with an optional "overflow_policy", and an optional "pipeline"
+    table with the arguments of the Pipeline. For example in TOML:
+
+        [stages.camera]
+        type = "SyntheticStreamStage"
+        stage_executor = "PROCESS"
+
+        [stages.gray]
+        type = "RGB2GRAYStage"
+        stage_executor = "THREAD"
+
+        [[links]]
+        from = "camera"
+        to = "gray"
+        key = "stream1"
+
+    "type" is the name of a sample stage, or the import path of a stage class ("package.module.Class").
+    """
+
+    def __init__(self, stages: dict[str, Stage], links: list[GraphLink], pipeline_options: dict | None = None):
+        self.stages = stages
+        self.links = links
+        self.pipeline_options = pipeline_options or {}
+
+    @classmethod
+    def from_dict(cls, spec: dict) -> PipelineGraph:
+        stages = {}
+        for name, stage_spec in spec.get("stages", {}).items():
+            stages[name] = stage_spec if isinstance(stage_spec, Stage) else _create_stage(name, stage_spec)
+
+        links = []
+        for link_spec in spec.get("links", []):
+            missing = [field for field in ("from", "to", "key") if field not in link_spec]
+            if missing:
+                raise ValueError(f"Link {link_spec} has no {', '.join(missing)}")
+
+            overflow_policy = link_spec.get("overflow_policy")
+            links.append(
+                GraphLink(
+                    link_spec["from"],
+                    link_spec["to"],
+                    link_spec["key"],
+                    _overflow_policy(overflow_policy) if overflow_policy is not None else None,
+                )
+            )
+
+        return cls(stages, links, spec.get("pipeline"))
+
+    @classmethod
+    def from_toml(cls, path: str) -> PipelineGraph:
+        try:
+            import tomllib
+        except ImportError:
+            # Python < 3.11
+            try:
+                import tomli as tomllib
+            except ImportError as e:
+                raise ImportError("Reading TOML graphs needs Python 3.11 or the tomli package") from e
+
+        with open(path, "rb") as f:
+            return cls.from_dict(tomllib.load(f))
+
+    @classmethod
+    def from_yaml(cls, path: str) -> PipelineGraph:
+        try:
+            import yaml
+        except ImportError as e:
+            raise ImportError("Reading YAML graphs needs the PyYAML package") from e
+
+        with open(path) as f:
+            return cls.from_dict(yaml.safe_load(f))
+
+    def validate(self) -> None:
+        """Raise a ValueError listing all the problems of the graph."""
+        errors = []
+
+        unknown = {name for link in self.links for name in (link.from_stage, link.to_stage)} - self.stages.keys()
+        if unknown:
+            errors.append(f"Unknown stages: {', '.join(sorted(unknown))}")
+
+        inputs: dict[str, list[str]] = {name: [] for name in self.stages}
+        outputs: dict[str, list[str]] = {name: [] for name in self.stages}
+        for link in self.links:
+            if link.from_stage in outputs and link.to_stage in inputs:
+                outputs[link.from_stage].append(link.key)
+                inputs[link.to_stage].append(link.key)
+
+        for name, stage in self.stages.items():
+            stage_type = stage._stage_type
+            stage_inputs, stage_outputs = inputs[name], outputs[name]
+
+            if not stage_inputs and not stage_outputs:
+                errors.append(f"{name} is not linked")
+
+            # Same rules as Stage.link()
+            if stage_type in (StageType.One2One, StageType.One2Many) and len(stage_inputs) > 1:
+                errors.append(f"{name} is {stage_type.name} and has {len(stage_inputs)} inputs")
+            if stage_type in (StageType.One2One, StageType.Many2One) and len(stage_outputs) > 1:
+                errors.append(f"{name} is {stage_type.name} and has {len(stage_outputs)} outputs")
+
+            for key in sorted({key for key in stage_inputs if stage_inputs.count(key) > 1}):
+                errors.append(f"{name} has more than one input on {key}")
+
+            if stage_type == StageType.One2Many:
+                continue
+
+            for key in sorted({key for key in stage_outputs if stage_outputs.count(key) > 1}):
+                errors.append(f"{name} has more than one output on {key}, copy the stream with a SwitchStage")
+
+            if stage_outputs:
+                # The stage puts each payload to the output with the key of its input, the others are lost
+                for key in sorted(set(stage_inputs) - set(stage_outputs)):
+                    errors.append(f"{name} has no output for {key}, its frames are dropped")
+
+        if not unknown:
+            try:
+                self.topological_order()
+            except ValueError as e:
+                errors.append(str(e))
+
+        if errors:
+            raise ValueError("Invalid pipeline graph:\n  " + "\n  ".join(errors))
+
+    def topological_order(self) -> list[str]:
+        """Names of the stages, each after the ones linked to its inputs."""
+        upstream: dict[str, list[str]] = {name: [] for name in self.stages}
+        for link in self.links:
+            if link.to_stage in upstream:
+                upstream[link.to_stage].append(link.from_stage)
+
+        return topological_order(list(self.stages), lambda name: upstream[name], strict=True)
+
+    def build(self) -> Pipeline:
+        """Validate the graph, then create the pipeline with its stages in topological order and link them."""
+        self.validate()
+
+        pipeline = Pipeline(**self.pipeline_options)
+        for name in self.topological_order():
+            pipeline.add_stage(self.stages[name])
+
+        for link in self.links:
+            from_stage, to_stage = self.stages[link.from_stage], self.stages[link.to_stage]
+            output_key = from_stage.link(to_stage, link.key, overflow_policy=link.overflow_policy)
+            pipeline.streams.add(StreamLink(link.key, from_stage, to_stage, output_key, link.key))
+
+        return pipeline
+
+
+def _create_stage(name: str, spec: dict) -> Stage:
+    spec = dict(spec)
+    type_name = spec.pop("type", None)
+    if type_name is None:
+        raise ValueError(f"Stage {name} has no type")
+
+    if "." in type_name:
+        module_name, class_name = type_name.rsplit(".", 1)
+        stage_class = getattr(importlib.import_module(module_name), class_name, None)
+    else:
+        stage_class = getattr(sample_stage, type_name, None)
+
+    if not isinstance(stage_class, type) or not issubclass(stage_class, Stage):
+        raise ValueError(f"Stage {name} has an unknown type: {type_name}")
+
+    for argument, enum in _ENUM_ARGUMENTS.items():
+        if isinstance(spec.get(argument), str):
+            spec[argument] = enum[spec[argument].upper()]
+    if "overflow_policy" in spec:
+        spec["overflow_policy"] = _overflow_policy(spec["overflow_policy"])
+
+    return stage_class(**spec)
+
+
+def _overflow_policy(spec: str | dict | OverflowPolicy) -> OverflowPolicy:
+    if isinstance(spec, OverflowPolicy):
+        return spec
+    if isinstance(spec, str):
+        return OverflowPolicy(OverflowAction[spec.upper()])
+
+    spec = dict(spec)
+    return OverflowPolicy(OverflowAction[spec.pop("action").upper()], **spec)
@@ -0,0 +1,172 @@
+# -*- coding: utf-8 -*-
+from __future__ import annotations
+
+import ctypes
+import multiprocessing as mp
+import time
+
+# process() latencies are counted in power of two buckets of microseconds, bucket i holds [2^(i-1), 2^i) us
+LATENCY_BUCKETS = 32
+
+_CALLS = 0
+_ERRORS = 1
+_BUSY = 2
+_IDLE = 3
+_HISTOGRAM = 4
+
+
+class StageMetrics:
+    """
+    Counters of a stage, written by its workers and read by the pipeline.
+
+    Every worker has its own row, so they are updated without locks. The rows live in shared memory when the workers
+    are processes. Input and output keys are the ones linked when the stage is started, with_keys() adds the ones
+    linked later.
+    """
+
+    def __init__(self, replicas: int, input_keys: list[str], output_keys: list[str], shared: bool = False):
+        self._input_index = {key: _HISTOGRAM + LATENCY_BUCKETS + i for i, key in enumerate(input_keys)}
+        self._output_index = {
+            key: _HISTOGRAM + LATENCY_BUCKETS + len(input_keys) + i for i, key in enumerate(output_keys)
+        }
+        # Queue wait and source to stage latency histograms of the traced payloads, for each input key
+        traces = _HISTOGRAM + LATENCY_BUCKETS + len(input_keys) + len(output_keys)
+        self._trace_index = {key: traces + 2 * LATENCY_BUCKETS * i for i, key in enumerate(input_keys)}
+        self._row_size = traces + 2 * LATENCY_BUCKETS * len(input_keys)
+        self._replicas = replicas
+        self._shared = shared
+
+        size = self._row_size * replicas
+        self._array = mp.RawArray(ctypes.c_int64, size) if shared else (ctypes.c_int64 * size)()
+        self._data = memoryview(self._array).cast("B").cast("q")
+        self._started = time.monotonic()
+
+    def __getstate__(self):
+        # Memory views cannot be pickled, the worker processes recreate it on the shared array
+        state = self.__dict__.copy()
+        del state["_data"]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._data = memoryview(self._array).cast("B").cast("q")
+
+    def with_keys(self, input_keys: list[str], output_keys: list[str]) -> StageMetrics:
+        """
+        Copy of the metrics counting the keys too, for the streams linked to a running stage.
+
+        The workers keep writing to these metrics until they read the new ones, the counts of that instant are lost.
+        """
+        input_keys = list(self._input_index) + [key for key in input_keys if key not in self._input_index]
+        output_keys = list(self._output_index) + [key for key in output_keys if key not in self._output_index]
+        metrics = StageMetrics(self._replicas, input_keys, output_keys, shared=self._shared)
+        metrics._started = self._started
+
+        for row in range(self._replicas):
+            old, new = row * self._row_size, row * metrics._row_size
+            metrics._data[new : new + _HISTOGRAM + LATENCY_BUCKETS] = self._data[
+                old : old + _HISTOGRAM + LATENCY_BUCKETS
+            ]
+            for key, index in self._input_index.items():
+                metrics._data[new + metrics._input_index[key]] = self._data[old + index]
+            for key, index in self._output_index.items():
+                metrics._data[new + metrics._output_index[key]] = self._data[old + index]
+            for key, index in self._trace_index.items():
+                start = new + metrics._trace_index[key]
+                metrics._data[start : start + 2 * LATENCY_BUCKETS] = self._data[
+                    old + index : old + index + 2 * LATENCY_BUCKETS
+                ]
+
+        return metrics
+
+    def record_call(self, row: int, elapsed_ns: int) -> None:
+        base = row * self._row_size
+        self._data[base + _CALLS] += 1
+        self._data[base + _BUSY] += elapsed_ns
+        self._data[base + _HISTOGRAM + _bucket(elapsed_ns)] += 1
+
+    def record_error(self, row: int) -> None:
+        self._data[row * self._row_size + _ERRORS] += 1
+
+    def record_idle(self, row: int, elapsed_ns: int) -> None:
+        self._data[row * self._row_size + _IDLE] += elapsed_ns
+
+    def record_input(self, row: int, key: str, count: int = 1) -> None:
+        index = self._input_index.get(key)
+        if index is not None:
+            self._data[row * self._row_size + index] += count
+
+    def record_output(self, row: int, key: str) -> None:
+        index = self._output_index.get(key)
+        if index is not None:
+            self._data[row * self._row_size + index] += 1
+
+    def record_trace(self, row: int, key: str, queue_wait: float, end_to_end: float) -> None:
+        index = self._trace_index.get(key)
+        if index is not None:
+            base = row * self._row_size + index
+            self._data[base + _bucket(int(queue_wait * 1e9))] += 1
+            self._data[base + LATENCY_BUCKETS + _bucket(int(end_to_end * 1e9))] += 1
+
+    def snapshot(self) -> dict:
+        """Sum the rows of the workers."""
+        totals = [0] * self._row_size
+        for row in range(self._replicas):
+            base = row * self._row_size
+            for i, value in enumerate(self._data[base : base + self._row_size].tolist()):
+                totals[i] += value
+
+        elapsed = max(time.monotonic() - self._started, 1e-9)
+        busy = totals[_BUSY] / 1e9
+        idle = totals[_IDLE] / 1e9
+        histogram = totals[_HISTOGRAM : _HISTOGRAM + LATENCY_BUCKETS]
+        inputs = {key: totals[index] for key, index in self._input_index.items()}
+        outputs = {key: totals[index] for key, index in self._output_index.items()}
+
+        traces = {}
+        for key, index in self._trace_index.items():
+            queue_wait = totals[index : index + LATENCY_BUCKETS]
+            end_to_end = totals[index + LATENCY_BUCKETS : index + 2 * LATENCY_BUCKETS]
+            if any(end_to_end):
+                traces[key] = {"queue_wait": _latency(queue_wait), "end_to_end": _latency(end_to_end)}
+
+        return {
+            "calls": totals[_CALLS],
+            "errors": totals[_ERRORS],
+            "busy_time": busy,
+            "idle_time": idle,
+            "utilization": busy / (busy + idle) if busy + idle > 0 else 0.0,
+            "latency": _latency(histogram),
+            "inputs": inputs,
+            "outputs": outputs,
+            "input_rate": sum(inputs.values()) / elapsed,
+            "output_rate": sum(outputs.values()) / elapsed,
+            "trace": traces,
+        }
+
+
+def _bucket(elapsed_ns: int) -> int:
+    return min((max(elapsed_ns, 0) // 1000).bit_length(), LATENCY_BUCKETS - 1)
+
+
+def _latency(histogram: list[int]) -> dict:
+    return {
+        "p50": _percentile(histogram, 0.5),
+        "p90": _percentile(histogram, 0.9),
+        "p99": _percentile(histogram, 0.99),
+        "histogram": histogram,
+    }
+
+
+def _percentile(histogram: list[int], quantile: float) -> float:
+    """Upper bound in seconds of the bucket holding the quantile."""
+    total = sum(histogram)
+    if total == 0:
+        return 0.0
+
+    count = 0
+    for bucket, value in enumerate(histogram):
+        count += value
+        if count >= quantile * total:
+            return (1 << bucket) / 1e6
+    return (1 << (len(histogram) - 1)) / 1e6
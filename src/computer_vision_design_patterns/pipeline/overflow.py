@@ -0,0 +1,123 @@
+# -*- coding: utf-8 -*-
+from __future__ import annotations
+
+import ctypes
+import multiprocessing as mp
+import threading
+from dataclasses import dataclass
+from enum import Enum
+from queue import Empty, Full
+
+
+class OverflowAction(Enum):
+    BLOCK = 1
+    DROP_NEWEST = 2
+    DROP_OLDEST = 3
+    LATEST_ONLY = 4
+    KEEP_EVERY_NTH = 5
+
+
+@dataclass(frozen=True, slots=True)
+class OverflowPolicy:
+    """
+    What a stage does when the output queue of a link is full.
+
+    BLOCK waits for room as long as the stage is running. DROP_NEWEST and DROP_OLDEST wait queue_timeout, then drop
+    the new payload or replace the oldest queued one. LATEST_ONLY turns the link into a single slot mailbox that always
+    holds the latest payload. KEEP_EVERY_NTH drops the new payloads while the queue is full, except one every 'nth'
+    that replaces the oldest queued one.
+    """
+
+    action: OverflowAction = OverflowAction.DROP_OLDEST
+    nth: int = 2
+
+    def __post_init__(self):
+        if self.nth < 1:
+            raise ValueError(f"Invalid nth: {self.nth}")
+
+
+class OverflowGuard:
+    """
+    Apply the overflow policy of a link.
+
+    The guard is shared by all the workers that put to the link, the drops and the evictions are done under its lock
+    and counted in shared memory when the link crosses a process boundary.
+    """
+
+    def __init__(self, policy: OverflowPolicy | None = None, shared: bool = False):
+        self._policy = policy if policy is not None else OverflowPolicy()
+
+        if shared:
+            self._lock = mp.Lock()
+            self._dropped = mp.RawValue(ctypes.c_int64, 0)
+            self._overflows = mp.RawValue(ctypes.c_int64, 0)
+        else:
+            self._lock = threading.Lock()
+            self._dropped = ctypes.c_int64(0)
+            self._overflows = ctypes.c_int64(0)
+
+    @property
+    def policy(self) -> OverflowPolicy:
+        return self._policy
+
+    @property
+    def dropped(self) -> int:
+        return self._dropped.value
+
+    def put(self, queue, payload, timeout: float | None, running: threading.Event | None = None) -> None:
+        """Put the payload to the queue, with timeout=0 it never blocks and with None it waits for room."""
+        action = self._policy.action
+
+        if action == OverflowAction.LATEST_ONLY:
+            with self._lock:
+                try:
+                    queue.put_nowait(payload)
+                except Full:
+                    self._replace_oldest(queue, payload, timeout)
+            return
+
+        while True:
+            try:
+                if timeout is None or timeout > 0:
+                    queue.put(payload, timeout=timeout)
+                else:
+                    queue.put_nowait(payload)
+                return
+
+            except Full:
+                if action != OverflowAction.BLOCK or timeout is not None and timeout <= 0:
+                    break
+
+                if running is None or not running.is_set():
+                    # The stage is stopping, nobody is going to make room
+                    with self._lock:
+                        self._dropped.value += 1
+                    return
+
+        with self._lock:
+            if action == OverflowAction.KEEP_EVERY_NTH:
+                self._overflows.value += 1
+                if self._overflows.value % self._policy.nth == 0:
+                    self._replace_oldest(queue, payload, timeout)
+                else:
+                    self._dropped.value += 1
+
+            elif action == OverflowAction.DROP_OLDEST:
+                self._replace_oldest(queue, payload, timeout)
+
+            else:
+                self._dropped.value += 1
+
+    def _replace_oldest(self, queue, payload, timeout: float | None) -> None:
+        try:
+            # The oldest payload can still be in the feeder thread of a process queue, so give it time to arrive
+            queue.get_nowait() if timeout == 0 else queue.get(timeout=timeout or 0.1)
+            self._dropped.value += 1
+        except Empty:
+            # Taken by the consumer in the meantime
+            pass
+
+        try:
+            queue.put_nowait(payload)
+        except Full:
+            self._dropped.value += 1
@@ -1,7 +1,11 @@
 # -*- coding: utf-8 -*-
+from __future__ import annotations
+
 import time
 from dataclasses import dataclass, field
 
+from computer_vision_design_patterns.pipeline.trace import Trace
+
 
 @dataclass(frozen=True, eq=False, slots=True)
 class Payload:
@@ -11,6 +15,14 @@ class Payload:
     'frozen=True' makes the payload immutable, so it can't be changed by mistake after its creation.
     'eq=False' disables the default equality check, which is not needed for this class.
     'slots=True' reduces memory usage and access time by not creating a __dict__ attribute for each instance.
+
+    'sequence' is the per-stream frame number, it is assigned by the source stage and carried forward by the stages,
+    so the outputs of a replicated stage can be put back in order.
+
+    'trace' holds the per hop timestamps of the payload when its source stage has tracing enabled, it is carried
+    forward by the stages like 'sequence'.
     """
 
     timestamp: float = field(default_factory=time.time)
+    sequence: int | None = None
+    trace: Trace | None = None
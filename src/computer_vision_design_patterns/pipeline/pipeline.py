@@ -1,51 +1,338 @@
 # -*- coding: utf-8 -*-
+import os
 import time
-from venv import logger
+import warnings
+from collections.abc import Callable, Iterable
+from queue import Full
+from typing import Any
 
-from computer_vision_design_patterns.pipeline.stage import PoisonPill, Stage
+from loguru import logger
+
+from computer_vision_design_patterns.pipeline.asyncio_executor import EventLoopThread
+from computer_vision_design_patterns.pipeline.placement import assign_cores
+from computer_vision_design_patterns.pipeline.registry import StreamLink, StreamRegistry
+from computer_vision_design_patterns.pipeline.stage import PoisonPill, Stage, StageExecutor
+from computer_vision_design_patterns.pipeline.supervisor import RestartPolicy, Supervisor
+
+# Time given to the stages to leave after being stopped, before their workers are terminated
+STOP_GRACE = 0.5
+
+
+def topological_order(items: list, predecessors: Callable[[Any], Iterable], strict: bool = False) -> list:
+    """
+    Sort the items so that every item comes after its predecessors, the ones that are not in the list are ignored.
+
+    Items are compared by identity. On a cycle a ValueError is raised with strict=True, otherwise its items keep the
+    order they have in the list.
+    """
+    order = []
+    remaining = list(items)
+
+    while remaining:
+        pending = {id(item) for item in remaining}
+        ready = [
+            item
+            for item in remaining
+            if not any(id(previous) in pending and previous is not item for previous in predecessors(item))
+        ]
+        if not ready:
+            if strict:
+                raise ValueError(f"Cycle in the graph, cannot order {', '.join(str(item) for item in remaining)}")
+            ready = remaining[:1]
+
+        order.extend(ready)
+        remaining = [item for item in remaining if all(item is not other for other in ready)]
+
+    return order
 
 
 class Pipeline:
-    def __init__(self, start_sleep_time: float = 1.0):
+    """
+    Set of linked stages started and stopped together.
+
+    start() launches the workers of all the stages at once and waits at most start_timeout seconds for their
+    pre_run(). stop() lets the queued payloads drain through the stages for at most stop_timeout seconds. With
+    fuse=True the linear chains of One2One THREAD stages run in a single worker, which skips the queue hop and the
+    thread switch between them.
+
+    The streams linked with add_stream() are indexed in 'streams', so they can be added and removed while the
+    pipeline runs without touching the other streams. Stages running in PROCESS workers keep the links they had when
+    they started, linking them raises a RuntimeError.
+
+    With a restart_policy a Supervisor restarts the workers that crash or hang while the pipeline runs, see
+    RestartPolicy. With assign_cores=True the PROCESS stages get disjoint sets of cores and thread pools of their size
+    when the pipeline starts, see placement.assign_cores().
+    """
+
+    def __init__(
+        self,
+        start_sleep_time: float | None = None,
+        *,
+        start_timeout: float = 30.0,
+        stop_timeout: float = 5.0,
+        fuse: bool = False,
+        restart_policy: RestartPolicy | None = None,
+        assign_cores: bool = False,
+    ):
+        if start_sleep_time is not None:
+            warnings.warn(
+                "start_sleep_time is deprecated and ignored, start() waits for the stages to be ready",
+                DeprecationWarning,
+                stacklevel=2,
+            )
+
         self.stages: list[Stage] = []
-        self._start_sleep_time = start_sleep_time
+        self._start_timeout = start_timeout
+        self._stop_timeout = stop_timeout
+        self._fuse = fuse
+        self._assign_cores = assign_cores
+        self._event_loop: EventLoopThread | None = None
+        self._started = False
+        self.streams = StreamRegistry()
+        self.supervisor = Supervisor(self, restart_policy) if restart_policy is not None else None
 
     def add_stage(self, stage: Stage):
         self.stages.append(stage)
 
     @staticmethod
-    def link_stages(from_stage: Stage, to_stage: Stage, key: str):
-        from_stage.link(to_stage, key)
+    def link_stages(from_stage: Stage, to_stage: Stage, key: str, **link_options):
+        from_stage.link(to_stage, key, **link_options)
 
     def unlink(self, key: str):
+        if key in self.streams:
+            self.remove_stream(key)
+            return
+
         for stage in self.stages:
             stage.unlink(key)
 
         # Remove not alive stages
         self.stages = [stage for stage in self.stages if stage.is_alive()]
 
+    def add_stream(self, stream_id: str, links: list[tuple[Stage, Stage]], **link_options):
+        """
+        Link the stages of a stream, each (from_stage, to_stage) on the stream id, and register the links.
+
+        The stages that are not in the pipeline yet are added, and started if the pipeline is running. The PROCESS
+        stages already running cannot be linked, RuntimeError is raised before any link is made.
+        """
+        if stream_id in self.streams:
+            raise ValueError(f"Stream {stream_id} already exists")
+
+        for from_stage, to_stage in links:
+            from_stage.check_linkable()
+            to_stage.check_linkable()
+
+        new_stages = []
+        for from_stage, to_stage in links:
+            for stage in (from_stage, to_stage):
+                if stage not in self.stages:
+                    self.stages.append(stage)
+                    new_stages.append(stage)
+
+            output_key = from_stage.link(to_stage, stream_id, **link_options)
+            self.streams.add(StreamLink(stream_id, from_stage, to_stage, output_key, stream_id))
+
+        if self._started and new_stages:
+            self._start_stages(self._topological_order(new_stages))
+
+    def remove_stream(self, stream_id: str):
+        """Remove the links of a stream and stop the stages that are left without any queue."""
+        stages = self.streams.stages(stream_id)
+        for link in self.streams.remove(stream_id):
+            # The producer lets go of the queue before the consumer closes it
+            if link.output_key in link.from_stage._output_queues:
+                link.from_stage.unlink_output(link.output_key)
+            if link.input_key in link.to_stage.input_queues:
+                link.to_stage.unlink_input(link.input_key)
+
+        idle = [
+            stage
+            for stage in stages
+            if not self.streams.streams_of(stage) and not stage.input_queues and not stage._output_queues
+        ]
+        if idle:
+            self._join_stages(idle)
+            self.stages = [stage for stage in self.stages if all(stage is not other for other in idle)]
+
     def start(self):
-        for stage in self.stages:
+        self._start_event_loop()
+        if self._fuse:
+            self._fuse_stages()
+        if self._assign_cores:
+            self._assign_stage_cores()
+
+        self._start_stages(self._topological_order())
+        self._started = True
+
+        if self.supervisor is not None:
+            self.supervisor.start()
+
+    def _start_stages(self, order: list[Stage]):
+        started = []
+
+        # Sinks first, all the workers run pre_run() at the same time and are held until every stage is ready
+        for stage in reversed(order):
             try:
                 if not stage.is_alive():
-                    stage.start()
-                    time.sleep(self._start_sleep_time)
+                    stage.start(hold=True)
+                    started.append(stage)
             except RuntimeError as e:
                 logger.warning(e)
 
-    def stop(self):
-        for stage in reversed(self.stages):
-            stage.stop()
+        try:
+            self._wait_ready(started)
+        except (RuntimeError, TimeoutError):
+            self._join_stages(started)
+            raise
+
+        for stage in order:
+            stage.release()
 
-        for stage in reversed(self.stages):
-            stage.join()
+    def _assign_stage_cores(self):
+        cpus = os.sched_getaffinity(0) if hasattr(os, "sched_getaffinity") else set(range(os.cpu_count() or 1))
+        assign_cores([stage for stage in self.stages if stage.executor == StageExecutor.PROCESS], cpus)
+
+    def _wait_ready(self, stages: list[Stage]):
+        deadline = time.monotonic() + self._start_timeout
+        pending = stages
+
+        while True:
+            pending = [stage for stage in pending if not stage.is_ready()]
+            if not pending:
+                return
+
+            failed = [stage.name for stage in pending if not stage.is_alive()]
+            if failed:
+                raise RuntimeError(f"Stages stopped before being ready: {', '.join(failed)}")
+
+            if time.monotonic() > deadline:
+                names = ", ".join(stage.name for stage in pending)
+                raise TimeoutError(f"Stages not ready after {self._start_timeout} s: {names}")
+
+            time.sleep(0.005)
+
+    def _topological_order(self, stages: list[Stage] | None = None) -> list[Stage]:
+        """Stages sorted so that every stage comes after the ones linked to its inputs."""
+        return topological_order(self.stages if stages is None else stages, lambda stage: stage.upstream_stages())
+
+    def stop(self, timeout: float | None = None):
+        """
+        Stop the first stages of the graph and let the end of stream flow through the others in topological order.
+
+        Each stage processes what is queued before its end of stream, then leaves and forwards it. The stages still
+        running after timeout are stopped without draining, so the whole stop takes a bounded time.
+        """
+        timeout = self._stop_timeout if timeout is None else timeout
+        deadline = time.monotonic() + timeout
+        self._stop_supervisor()
+
+        for stage in self.stages:
+            stage.drain_until(deadline)
+
+        for stage in self._topological_order():
+            if not any(upstream in self.stages for upstream in stage.upstream_stages()):
+                stage.stop()
+
+        self._wait_stopped(self.stages, deadline)
+        self._join_stages(self.stages)
+        self._stop_event_loop()
+        self._started = False
 
     def stop_all_stages(self):
+        """Stop all the stages at once, without draining the queued payloads."""
+        self._stop_supervisor()
         for stage in self.stages:
             for queue in stage._output_queues.values():
-                queue.put(PoisonPill())
+                try:
+                    queue.put(PoisonPill(), timeout=0.1)
+                except Full:
+                    pass
             stage.stop()
-            stage.join()
+
+        self._join_stages(self.stages)
+        self._stop_event_loop()
+        self._started = False
+
+    def _stop_supervisor(self):
+        # The stages that leave must not be taken for crashed ones
+        if self.supervisor is not None:
+            self.supervisor.stop()
+
+    def _wait_stopped(self, stages: list[Stage], deadline: float):
+        pending = stages
+        while pending and time.monotonic() < deadline:
+            pending = [stage for stage in pending if stage.is_alive()]
+            time.sleep(0.005)
+
+    def _join_stages(self, stages: list[Stage]):
+        """Stop the stages still running and join them in parallel."""
+        for stage in stages:
+            if stage.is_alive():
+                stage.stop()
+
+        # Every stage gets the same grace period before its workers are terminated
+        self._wait_stopped(stages, time.monotonic() + STOP_GRACE)
+        for stage in stages:
+            stage.join(timeout=0)
+
+    def stats(self) -> dict[str, dict]:
+        """Runtime metrics of each stage, see Stage.stats()."""
+        stats = {}
+        for stage in self.stages:
+            name = stage.name if stage.name not in stats else f"{stage.name}-{len(stats)}"
+            stats[name] = stage.stats()
+        return stats
+
+    def _fuse_stages(self):
+        """Fuse the linear chains of stages that can run in the same worker."""
+        for stage in self.stages:
+            if not stage.fusable:
+                continue
+
+            upstream = stage.upstream_stages()
+            if len(upstream) == 1 and self._can_follow(upstream[0], stage):
+                # Not the head of a chain
+                continue
+
+            chain = [stage]
+            while True:
+                downstream = chain[-1].downstream_stages()
+                if len(downstream) != 1 or not self._can_follow(chain[-1], downstream[0]):
+                    break
+                chain.append(downstream[0])
+
+            if len(chain) > 1:
+                logger.info(f"Fusing {' -> '.join(fused.__class__.__name__ for fused in chain)}")
+                stage.fuse(chain[1:])
+
+    def _can_follow(self, previous: Stage, stage: Stage) -> bool:
+        return (
+            previous in self.stages
+            and stage in self.stages
+            and previous.fusable
+            and stage.fusable
+            and len(previous.downstream_stages()) == 1
+            and len(stage.upstream_stages()) == 1
+        )
+
+    def _start_event_loop(self):
+        """Start the event loop shared by the ASYNCIO stages, if there are any."""
+        asyncio_stages = [stage for stage in self.stages if stage.executor == StageExecutor.ASYNCIO]
+        if not asyncio_stages:
+            return
+
+        if self._event_loop is None:
+            self._event_loop = EventLoopThread()
+            self._event_loop.start()
+
+        for stage in asyncio_stages:
+            stage.bind_event_loop(self._event_loop)
+
+    def _stop_event_loop(self):
+        if self._event_loop is not None:
+            self._event_loop.stop()
+            self._event_loop = None
 
     # def chain_poison_pill(self, source_stage_type):
     #     for stage in self.stages:
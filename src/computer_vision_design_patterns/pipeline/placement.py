@@ -0,0 +1,140 @@
+# -*- coding: utf-8 -*-
+from __future__ import annotations
+
+import dataclasses
+import os
+from dataclasses import dataclass
+from typing import TYPE_CHECKING
+
+from loguru import logger
+
+if TYPE_CHECKING:
+    from computer_vision_design_patterns.pipeline.stage import Stage
+
+# Read by the BLAS and OpenMP libraries when they create their thread pools
+_THREAD_VARIABLES = (
+    "OMP_NUM_THREADS",
+    "OPENBLAS_NUM_THREADS",
+    "MKL_NUM_THREADS",
+    "BLIS_NUM_THREADS",
+    "VECLIB_MAXIMUM_THREADS",
+    "NUMEXPR_NUM_THREADS",
+)
+
+
+@dataclass(frozen=True, slots=True)
+class Placement:
+    """
+    Where and how the workers of a stage run, applied by each worker before its pre_run().
+
+    'cpus' is the set of cores the worker can run on, 'nice' its scheduling priority (raising it above the current one
+    needs privileges). With 'replica_cpus' each replica of the stage runs on its own set instead, the replica i on
+    replica_cpus[i % len(replica_cpus)]. 'cv2_threads' and 'blas_threads' limit the thread pools of OpenCV and of the
+    BLAS and OpenMP libraries. The libraries already loaded, as the BLAS of numpy always is, are limited through
+    threadpoolctl, which is not a dependency of the package: without it 'blas_threads' only applies to the libraries
+    loaded afterwards, and a warning says so.
+
+    The thread pools belong to the process: for THREAD stages they are shared with the other stages of the process,
+    and only 'cpus' and 'nice' are set for the worker thread alone (on Linux). ASYNCIO stages run in the thread of the
+    shared event loop and ignore their placement.
+    """
+
+    cpus: frozenset[int] | None = None
+    nice: int | None = None
+    cv2_threads: int | None = None
+    blas_threads: int | None = None
+    replica_cpus: tuple[frozenset[int], ...] | None = None
+
+    def __post_init__(self):
+        if self.cpus is not None:
+            if not self.cpus:
+                raise ValueError("Empty set of cpus")
+            object.__setattr__(self, "cpus", frozenset(self.cpus))
+
+        if self.replica_cpus is not None:
+            if not self.replica_cpus or not all(self.replica_cpus):
+                raise ValueError("Empty set of replica cpus")
+            object.__setattr__(self, "replica_cpus", tuple(frozenset(cpus) for cpus in self.replica_cpus))
+
+        for name in ("cv2_threads", "blas_threads"):
+            threads = getattr(self, name)
+            if threads is not None and threads < 1:
+                raise ValueError(f"Invalid number of {name.replace('_', ' ')}: {threads}")
+
+    def apply(self, replica: int = 0) -> None:
+        """Apply the placement of a replica to the calling thread and its process."""
+        cpus = self.replica_cpus[replica % len(self.replica_cpus)] if self.replica_cpus is not None else self.cpus
+        if cpus is not None:
+            if hasattr(os, "sched_setaffinity"):
+                os.sched_setaffinity(0, cpus)
+            else:
+                logger.warning("CPU affinity is not supported on this platform")
+
+        if self.nice is not None:
+            try:
+                os.setpriority(os.PRIO_PROCESS, 0, self.nice)
+            except (AttributeError, OSError) as e:
+                logger.warning(f"Cannot set the priority to {self.nice}: {e}")
+
+        if self.cv2_threads is not None:
+            try:
+                import cv2
+            except ImportError as e:
+                raise ImportError("Limiting the OpenCV threads needs the opencv-python package") from e
+
+            cv2.setNumThreads(self.cv2_threads)
+
+        if self.blas_threads is not None:
+            _limit_blas_threads(self.blas_threads)
+
+
+def _limit_blas_threads(threads: int) -> None:
+    # The libraries loaded from now on read the variables
+    for variable in _THREAD_VARIABLES:
+        os.environ[variable] = str(threads)
+
+    try:
+        from threadpoolctl import threadpool_limits
+    except ImportError:
+        logger.warning(
+            f"threadpoolctl is not installed, blas_threads={threads} only limits the libraries loaded from now on, "
+            "the ones already loaded (as numpy) keep their thread pools"
+        )
+        return
+
+    threadpool_limits(limits=threads)
+
+
+def assign_cores(stages: list[Stage], cpus: set[int]) -> None:
+    """
+    Give the stages disjoint sets of cores, each worker as many as the cpus allow, and thread pools of that size.
+
+    The replicas of a stage get disjoint slices of its cores in 'replica_cpus', 'cpus' holds them all. Only the fields
+    of the stage placements that are not set are filled, and the cores already in a placement are not given to the
+    other stages. When there are more workers than cores they share them, one core each.
+    """
+    reserved = {cpu for stage in stages if stage.placement is not None for cpu in stage.placement.cpus or ()}
+    free = sorted(set(cpus) - reserved)
+    stages = [stage for stage in stages if stage.placement is None or stage.placement.cpus is None]
+
+    workers = sum(stage._replicas for stage in stages)
+    if not stages or not free:
+        return
+
+    if workers > len(free):
+        logger.warning(f"{workers} workers for {len(free)} cores, the cores are shared")
+
+    cores_per_worker = max(1, len(free) // workers)
+    position = 0
+    for stage in stages:
+        replica_cpus = []
+        for _ in range(stage._replicas):
+            replica_cpus.append(frozenset(free[(position + i) % len(free)] for i in range(cores_per_worker)))
+            position += cores_per_worker
+
+        placement = stage.placement if stage.placement is not None else Placement()
+        threads = {"cv2_threads": cores_per_worker, "blas_threads": cores_per_worker}
+        threads = {name: value for name, value in threads.items() if getattr(placement, name) is None}
+        stage.placement = dataclasses.replace(
+            placement, cpus=frozenset().union(*replica_cpus), replica_cpus=tuple(replica_cpus), **threads
+        )
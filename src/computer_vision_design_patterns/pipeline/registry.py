@@ -0,0 +1,72 @@
+# -*- coding: utf-8 -*-
+from __future__ import annotations
+
+from dataclasses import dataclass
+
+from computer_vision_design_patterns.pipeline.stage import Stage
+
+
+@dataclass(frozen=True, eq=False, slots=True)
+class StreamLink:
+    """Queue carrying a stream from an output of a stage to an input of another."""
+
+    stream_id: str
+    from_stage: Stage
+    to_stage: Stage
+    output_key: str
+    input_key: str
+
+
+class StreamRegistry:
+    """
+    Index of the links of each stream and of the streams going through each stage.
+
+    Looking up or removing a stream only touches its own links, whatever the number of stages and streams.
+    """
+
+    def __init__(self):
+        self._links: dict[str, list[StreamLink]] = {}
+        self._stage_streams: dict[Stage, dict[str, int]] = {}
+
+    def __contains__(self, stream_id: str) -> bool:
+        return stream_id in self._links
+
+    def __len__(self) -> int:
+        return len(self._links)
+
+    def streams(self) -> list[str]:
+        return list(self._links)
+
+    def add(self, link: StreamLink) -> None:
+        self._links.setdefault(link.stream_id, []).append(link)
+        for stage in (link.from_stage, link.to_stage):
+            # Number of links of the stream on the stage
+            streams = self._stage_streams.setdefault(stage, {})
+            streams[link.stream_id] = streams.get(link.stream_id, 0) + 1
+
+    def remove(self, stream_id: str) -> list[StreamLink]:
+        """Forget a stream and return its links."""
+        links = self._links.pop(stream_id, [])
+        for link in links:
+            for stage in (link.from_stage, link.to_stage):
+                streams = self._stage_streams[stage]
+                streams[stream_id] -= 1
+                if streams[stream_id] == 0:
+                    del streams[stream_id]
+                if not streams:
+                    del self._stage_streams[stage]
+        return links
+
+    def links(self, stream_id: str) -> list[StreamLink]:
+        return list(self._links.get(stream_id, []))
+
+    def stages(self, stream_id: str) -> list[Stage]:
+        """Stages the stream goes through, in the order they have been linked."""
+        stages = {}
+        for link in self._links.get(stream_id, []):
+            stages[link.from_stage] = None
+            stages[link.to_stage] = None
+        return list(stages)
+
+    def streams_of(self, stage: Stage) -> list[str]:
+        return list(self._stage_streams.get(stage, {}))
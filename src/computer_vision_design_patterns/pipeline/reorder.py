@@ -0,0 +1,102 @@
+# -*- coding: utf-8 -*-
+from __future__ import annotations
+
+import heapq
+import itertools
+import time
+from dataclasses import dataclass
+from enum import Enum
+
+from computer_vision_design_patterns.pipeline.payload import Payload
+
+
+class LatePolicy(Enum):
+    DROP = 1
+    FORWARD = 2
+
+
+@dataclass(frozen=True, slots=True)
+class ReorderPolicy:
+    """
+    How the outputs of a replicated stage are put back in order.
+
+    'window' is the maximum number of payloads held while waiting for a missing one, 'max_delay' the maximum time in
+    seconds a payload can wait for it. When either is exceeded the missing payloads are skipped. 'late_policy' decides
+    what happens to a payload that arrives after it has been skipped.
+    """
+
+    window: int = 64
+    max_delay: float = 0.5
+    late_policy: LatePolicy = LatePolicy.DROP
+
+
+class ReorderBuffer:
+    """Re-emit payloads in the order of their sequence number."""
+
+    def __init__(self, policy: ReorderPolicy | None = None):
+        self._policy = policy if policy is not None else ReorderPolicy()
+
+        self._heap: list[tuple[int, int, float, Payload]] = []
+        self._counter = itertools.count()
+        self._next_sequence: int | None = None
+
+        self.skipped = 0
+        self.late = 0
+
+    def __len__(self) -> int:
+        return len(self._heap)
+
+    def push(self, payload: Payload) -> list[Payload]:
+        """Add a payload and return the ones that can be emitted in order."""
+        sequence = payload.sequence
+        if sequence is None:
+            return [payload]
+
+        if self._next_sequence is None and sequence == 0:
+            self._next_sequence = 0
+
+        if self._next_sequence is not None and sequence < self._next_sequence:
+            self.late += 1
+            return [payload] if self._policy.late_policy == LatePolicy.FORWARD else []
+
+        heapq.heappush(self._heap, (sequence, next(self._counter), time.monotonic(), payload))
+
+        ready = self._pop_ready()
+        if len(self._heap) > self._policy.window:
+            ready.extend(self._skip())
+
+        return ready
+
+    def expire(self) -> list[Payload]:
+        """Skip the missing payloads that kept the buffered ones waiting more than max_delay."""
+        if not self._heap:
+            return []
+
+        oldest = min(arrival for _, _, arrival, _ in self._heap)
+        if time.monotonic() - oldest < self._policy.max_delay:
+            return []
+
+        return self._skip()
+
+    def _skip(self) -> list[Payload]:
+        sequence = self._heap[0][0]
+        if self._next_sequence is not None:
+            self.skipped += sequence - self._next_sequence
+        self._next_sequence = sequence
+        return self._pop_ready()
+
+    def _pop_ready(self) -> list[Payload]:
+        ready = []
+        if self._next_sequence is None:
+            # The stream started before this buffer, the first sequence is known only once the buffer skips
+            return ready
+
+        while self._heap and self._heap[0][0] <= self._next_sequence:
+            sequence, _, _, payload = heapq.heappop(self._heap)
+            if sequence == self._next_sequence:
+                self._next_sequence += 1
+                ready.append(payload)
+            else:
+                # Duplicated sequence number
+                self.late += 1
+        return ready
@@ -0,0 +1,154 @@
+# -*- coding: utf-8 -*-
+from __future__ import annotations
+
+import time
+from abc import abstractmethod
+from dataclasses import dataclass, field
+from typing import Any, Sequence
+
+import numpy as np
+
+from computer_vision_design_patterns.pipeline import Payload, Stage
+from computer_vision_design_patterns.pipeline.sample_stage.SimpleStreamStage import VideoStreamOutput
+from computer_vision_design_patterns.pipeline.stage import PoisonPill, StageExecutor, StageType
+
+
+@dataclass(frozen=True, eq=False, slots=True, kw_only=True)
+class InferenceOutput(VideoStreamOutput):
+    result: Any = None
+
+
+@dataclass(slots=True)
+class _BatchState:
+    """Frames waiting for the batch of a worker, and the batch arrays it fills."""
+
+    pending: dict[str, Payload] = field(default_factory=dict)
+    pending_since: float | None = None
+    batches: dict[tuple, np.ndarray] = field(default_factory=dict)
+
+
+class MicroBatchStage(Stage):
+    """
+    Stage that runs one batched model behind many streams.
+
+    It keeps the latest frame received from each input key and copies them into a preallocated contiguous
+    (N, H, W, C) array. The batch is flushed to infer() when it holds max_batch_size frames or when the oldest frame
+    waited max_latency seconds, then each result is sent to the output with the same key of its frame.
+
+    Inputs are gathered like a Many2One stage, but the results go back to one output per stream, so the stage is
+    linked as Many2Many. Each replica batches the frames it takes on its own.
+    """
+
+    def __init__(
+        self,
+        stage_executor: StageExecutor,
+        max_batch_size: int,
+        max_latency: float,
+        output_maxsize: int | None = None,
+        queue_timeout: float = 0.1,
+        replicas: int = 1,
+    ):
+        Stage.__init__(
+            self,
+            stage_type=StageType.Many2Many,
+            stage_executor=stage_executor,
+            output_maxsize=output_maxsize,
+            queue_timeout=queue_timeout,
+            replicas=replicas,
+        )
+
+        if max_batch_size < 1:
+            raise ValueError(f"Invalid max batch size: {max_batch_size}")
+
+        self._max_batch_size = max_batch_size
+        self._max_latency = max_latency
+
+        # THREAD replicas share the stage, each one has its own batch state
+        self._batch_states: dict[int, _BatchState] = {}
+
+    @abstractmethod
+    def infer(self, batch: np.ndarray) -> Sequence[Any]:
+        """Run the model on a (N, H, W, C) batch and return one result for each frame."""
+
+    def process(self, key: str, payload: Payload | None) -> Payload | None:
+        if payload is None or payload.frame is None:
+            return None
+
+        result = self.infer(payload.frame[np.newaxis])[0]
+        return InferenceOutput(timestamp=payload.timestamp, frame=payload.frame, result=result)
+
+    def _process_stage(self):
+        output_keys = set(self._output_queues.keys())
+        state = self._batch_states.setdefault(self._replica_index(), _BatchState())
+
+        timeout = self._queue_timeout
+        if state.pending_since is not None:
+            # Wake up in time to honour the latency deadline of the pending frames
+            deadline_timeout = max(0.0, state.pending_since + self._max_latency - time.monotonic())
+            timeout = deadline_timeout if timeout is None else min(timeout, deadline_timeout)
+
+        for key in self._wait_for_inputs(timeout):
+            payload = self.get_from_left(key)
+            if isinstance(payload, PoisonPill):
+                self._end_of_stream(key)
+                continue
+
+            if payload is None or payload.frame is None:
+                continue
+
+            if self._metrics is not None:
+                self._metrics.record_input(self._metric_row(), key)
+
+            # Only the latest frame of each stream is worth the inference
+            state.pending[key] = payload
+            if state.pending_since is None:
+                state.pending_since = time.monotonic()
+
+        if not state.pending:
+            return
+
+        if (
+            len(state.pending) >= self._max_batch_size
+            or time.monotonic() - state.pending_since >= self._max_latency
+            or self._drained()
+        ):
+            self._flush(state, output_keys)
+
+    def _flush(self, state: _BatchState, output_keys: set[str]) -> None:
+        groups: dict[tuple, list[tuple[str, Payload]]] = {}
+        for key, payload in state.pending.items():
+            groups.setdefault((payload.frame.shape, payload.frame.dtype), []).append((key, payload))
+
+        state.pending = {}
+        state.pending_since = None
+
+        for (shape, dtype), items in groups.items():
+            for start in range(0, len(items), self._max_batch_size):
+                self._infer_batch(state, shape, dtype, items[start : start + self._max_batch_size], output_keys)
+
+    def _infer_batch(
+        self,
+        state: _BatchState,
+        shape: tuple,
+        dtype: np.dtype,
+        items: list[tuple[str, Payload]],
+        output_keys: set[str],
+    ):
+        batch = state.batches.get((shape, dtype))
+        if batch is None:
+            batch = np.empty((self._max_batch_size, *shape), dtype=dtype)
+            state.batches[(shape, dtype)] = batch
+
+        for i, (_, payload) in enumerate(items):
+            batch[i] = payload.frame
+
+        started = time.monotonic()
+        results = self._timed(self.infer, batch[: len(items)])
+        ended = time.monotonic()
+
+        if len(results) != len(items):
+            raise ValueError(f"infer() returned {len(results)} results for a batch of {len(items)} frames")
+
+        for (key, payload), result in zip(items, results):
+            output = InferenceOutput(timestamp=payload.timestamp, frame=payload.frame, result=result)
+            self._forward(key, output, output_keys, payload, self._trace_hop(key, payload, started, ended))
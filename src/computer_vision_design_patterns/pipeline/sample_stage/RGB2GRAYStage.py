@@ -4,13 +4,22 @@ from __future__ import annotations
 import cv2
 
 from computer_vision_design_patterns.pipeline import Payload, Stage
+from computer_vision_design_patterns.pipeline.buffer_pool import BufferPool
 from computer_vision_design_patterns.pipeline.sample_stage.SimpleStreamStage import VideoStreamOutput
 from computer_vision_design_patterns.pipeline.stage import StageExecutor, StageType
 
 
 class RGB2GRAYStage(Stage):
-    def __init__(self, stage_executor: StageExecutor):
-        Stage.__init__(self, stage_type=StageType.Many2Many, stage_executor=stage_executor)
+    def __init__(self, stage_executor: StageExecutor, batch_size: int = 1, batch_timeout: float = 0.0):
+        Stage.__init__(
+            self,
+            stage_type=StageType.Many2Many,
+            stage_executor=stage_executor,
+            batch_size=batch_size,
+            batch_timeout=batch_timeout,
+        )
+
+        self.buffer_pool = BufferPool()
 
     def pre_run(self):
         pass
@@ -27,5 +36,24 @@ class RGB2GRAYStage(Stage):
             return None
 
         # time.sleep(0.06)
-        gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+        gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY, dst=self.buffer_pool.take(frame.shape[:2], frame.dtype))
         return VideoStreamOutput(timestamp=payload.timestamp, frame=gray)
+
+    def process_batch(self, key: str, payloads: list[Payload]) -> list[Payload | None]:
+        frames = [payload.frame for payload in payloads]
+        first = frames[0]
+
+        if (
+            first is None
+            or first.ndim != 3
+            or any(frame is None or frame.shape != first.shape or frame.dtype != first.dtype for frame in frames)
+        ):
+            return Stage.process_batch(self, key, payloads)
+
+        # One stacked output for the whole batch, so there is a single buffer instead of one per frame. The frames
+        # are separate arrays, so cvtColor still runs once per frame, each converting into its own slice
+        gray = self.buffer_pool.take((len(frames), *first.shape[:2]), first.dtype)
+        for frame, destination in zip(frames, gray):
+            cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY, dst=destination)
+
+        return [VideoStreamOutput(timestamp=payload.timestamp, frame=gray[i]) for i, payload in enumerate(payloads)]
@@ -1,13 +1,17 @@
 # -*- coding: utf-8 -*-
 from __future__ import annotations
 
+import threading
+import time
 from dataclasses import dataclass
 
 import cv2
 import numpy as np
 
 from computer_vision_design_patterns.pipeline import Payload
-from computer_vision_design_patterns.pipeline.stage import Stage, StageExecutor, StageType
+from computer_vision_design_patterns.pipeline.buffer_pool import BufferPool
+from computer_vision_design_patterns.pipeline.sample_stage.pacing import FramePacer
+from computer_vision_design_patterns.pipeline.stage import Stage, StageExecutor, StageTransport, StageType
 
 
 @dataclass(frozen=True, eq=False, slots=True, kw_only=True)
@@ -16,33 +20,124 @@ class VideoStreamOutput(Payload):
 
 
 class SimpleStreamStage(Stage):
+    """
+    Source stage reading a cv2.VideoCapture.
+
+    By default the frames are read in the stage loop, so a slow pipeline leaves them waiting in the capture buffer.
+    With 'latest_frame' a grab thread keeps reading the capture and the stage emits only the newest frame, the ones
+    the pipeline was too slow for are dropped. The grab thread decodes into three preallocated buffers that it swaps
+    with the stage, and the emitted frame is a copy of the newest one. Either way the payload timestamp is the
+    capture time, and the emitted frames are taken from the buffer pool of the stage.
+
+    'fps' limits the rate of the emitted frames, None emits them as soon as they are read. When the linked stage grants
+    credits the frames are not read while there are none left, with 'latest_frame' the next one is then the newest.
+    """
+
     def __init__(
         self,
         source: int,
         stage_executor: StageExecutor,
         output_maxsize: int | None = None,
         queue_timeout: int | None = None,
+        transport: StageTransport = StageTransport.QUEUE,
+        tracing: bool = False,
+        latest_frame: bool = False,
+        fps: float | None = None,
     ):
+        if fps is not None and fps <= 0:
+            raise ValueError("fps must be positive")
+
         Stage.__init__(
             self,
             stage_type=StageType.One2One,
             stage_executor=stage_executor,
             output_maxsize=output_maxsize,
             queue_timeout=queue_timeout,
+            transport=transport,
+            tracing=tracing,
         )
 
         self.source = source
+        self.latest_frame = latest_frame
+        self.fps = fps
         self._cap = None
+        self._pacer = FramePacer(fps) if fps is not None else None
+        self.buffer_pool = BufferPool()
+        # Shape and dtype of the last frame read, the next one is read into a pool buffer of the same format
+        self._frame_format = None
+
+        # Grab thread state, created in the worker: it decodes into _back, publishes it as _newest and the stage takes
+        # it into _spare
+        self._grab_thread = None
+        self._grab_stop = None
+        self._frame_ready = None
+        self._back = None
+        self._newest = None
+        self._spare = None
+        self._newest_time = None
 
     def pre_run(self):
         self._cap = cv2.VideoCapture(self.source)
+        if self._pacer is not None:
+            self._pacer.reset()
+
+        if self.latest_frame:
+            # The grab thread empties the buffer anyway, a single frame avoids returning an old one
+            self._cap.set(cv2.CAP_PROP_BUFFERSIZE, 1)
+            self._grab_stop = threading.Event()
+            self._frame_ready = threading.Condition()
+            self._grab_thread = threading.Thread(target=self._grab, daemon=True)
+            self._grab_thread.start()
 
     def post_run(self):
+        if self._grab_thread is not None:
+            self._grab_stop.set()
+            self._grab_thread.join()
+            self._grab_thread = None
         self._cap.release()
 
     def process(self, key: str, payload: Payload | None) -> Payload | None:
-        ret, frame = self._cap.read()
+        if self._pacer is not None and not self._pacer.due(self._queue_timeout or 0.1):
+            return None
+
+        if self.latest_frame:
+            return self._take_newest()
+
+        image = self.buffer_pool.take(*self._frame_format) if self._frame_format is not None else None
+        ret, frame = self._cap.read(image=image)
         if not ret:
             return None
 
+        # A frame of another size is a new array, the next ones are read into buffers of its format
+        self._frame_format = (frame.shape, frame.dtype)
         return VideoStreamOutput(frame=frame)
+
+    def _grab(self):
+        while not self._grab_stop.is_set():
+            ret, frame = self._cap.read(image=self._back)
+            if not ret:
+                # Cameras can fail a read and recover, wait a little before the next one
+                self._grab_stop.wait(0.01)
+                continue
+
+            captured = time.time()
+            with self._frame_ready:
+                # A frame of another size is a new array, it replaces the buffer
+                self._back, self._newest = self._newest, frame
+                self._newest_time = captured
+                self._frame_ready.notify()
+
+    def _take_newest(self) -> Payload | None:
+        with self._frame_ready:
+            if self._newest_time is None:
+                self._frame_ready.wait(self._queue_timeout or 0.1)
+                if self._newest_time is None:
+                    return None
+
+            # The grab thread never writes to the spare buffer, it can be copied outside of the lock
+            self._spare, self._newest = self._newest, self._spare
+            captured, self._newest_time = self._newest_time, None
+
+        frame = self.buffer_pool.take(self._spare.shape, self._spare.dtype)
+        np.copyto(frame, self._spare)
+        return VideoStreamOutput(timestamp=captured, frame=frame)
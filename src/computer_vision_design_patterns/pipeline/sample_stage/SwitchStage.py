@@ -1,15 +1,22 @@
 # -*- coding: utf-8 -*-
 from __future__ import annotations
 
-import multiprocessing as mp
+import itertools
 
 from computer_vision_design_patterns.pipeline import Payload, Stage
-from computer_vision_design_patterns.pipeline.stage import StageExecutor, StageType
+from computer_vision_design_patterns.pipeline.overflow import OverflowPolicy
+from computer_vision_design_patterns.pipeline.stage import StageExecutor, StageTransport, StageType
 
 
 class SwitchStage(Stage):
     def __init__(
-        self, stage_executor: StageExecutor, output_maxsize: int | None = None, queue_timeout: int | None = None
+        self,
+        stage_executor: StageExecutor,
+        output_maxsize: int | None = None,
+        queue_timeout: int | None = None,
+        transport: StageTransport = StageTransport.QUEUE,
+        batch_size: int = 1,
+        batch_timeout: float = 0.0,
     ):
         Stage.__init__(
             self,
@@ -17,6 +24,9 @@ class SwitchStage(Stage):
             stage_executor=stage_executor,
             output_maxsize=output_maxsize,
             queue_timeout=queue_timeout,
+            transport=transport,
+            batch_size=batch_size,
+            batch_timeout=batch_timeout,
         )
 
     def pre_run(self):
@@ -31,12 +41,11 @@ class SwitchStage(Stage):
 
         return payload
 
-    def link(self, stage: Stage, key: str) -> None:
-        copy_key = f"{key}-{len(list(self._output_queues.keys()))}"
+    def process_batch(self, key: str, payloads: list[Payload]) -> list[Payload | None]:
+        return payloads
 
-        maxsize = self._output_maxsize if self._output_maxsize is not None else 0
+    def link(self, stage: Stage, key: str, overflow_policy: OverflowPolicy | None = None) -> str:
+        # First free copy number, outputs can have been unlinked in the meantime
+        copy_key = next(f"{key}-{i}" for i in itertools.count() if f"{key}-{i}" not in self._output_queues)
 
-        queue: mp.Queue = mp.Queue(maxsize=maxsize)
-
-        self._output_queues[copy_key] = queue
-        stage.input_queues[key] = queue
+        return self._connect(stage, copy_key, key, overflow_policy)
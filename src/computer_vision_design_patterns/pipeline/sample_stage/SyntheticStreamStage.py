@@ -0,0 +1,115 @@
+# -*- coding: utf-8 -*-
+from __future__ import annotations
+
+import numpy as np
+
+from computer_vision_design_patterns.pipeline import Payload, Stage
+from computer_vision_design_patterns.pipeline.sample_stage.pacing import FramePacer
+from computer_vision_design_patterns.pipeline.sample_stage.SimpleStreamStage import VideoStreamOutput
+from computer_vision_design_patterns.pipeline.stage import StageExecutor, StageTransport, StageType
+
+PATTERNS = ("moving", "noise")
+
+
+class SyntheticStreamStage(Stage):
+    """
+    Source of synthetic frames, for running pipelines without a camera.
+
+    The frames are generated once in pre_run and emitted in a loop, so producing a frame costs no more than creating
+    its payload. They are read only, as every frame of the pool is shared by all the payloads that carry it. The stage
+    is linked as Many2Many: each output key linked is a stream of its own, starting at a different frame of the pool
+    and paced on its own.
+
+    'pattern' is "moving" for a diagonal gradient that shifts at every frame, or "noise" for seeded random frames.
+    'fps' paces each stream, None produces frames as fast as the pipeline takes them.
+    """
+
+    def __init__(
+        self,
+        stage_executor: StageExecutor,
+        resolution: tuple[int, int] = (640, 480),
+        channels: int = 3,
+        dtype: np.dtype | type = np.uint8,
+        fps: float | None = None,
+        pattern: str = "moving",
+        pool_size: int = 16,
+        seed: int = 0,
+        output_maxsize: int | None = None,
+        queue_timeout: float = 0.1,
+        transport: StageTransport = StageTransport.QUEUE,
+        tracing: bool = False,
+    ):
+        if pattern not in PATTERNS:
+            raise ValueError(f"Unknown pattern {pattern!r}, expected one of {PATTERNS}")
+        if pool_size < 1:
+            raise ValueError("pool_size must be at least 1")
+        if fps is not None and fps <= 0:
+            raise ValueError("fps must be positive")
+
+        Stage.__init__(
+            self,
+            stage_type=StageType.Many2Many,
+            stage_executor=stage_executor,
+            output_maxsize=output_maxsize,
+            queue_timeout=queue_timeout,
+            transport=transport,
+            tracing=tracing,
+        )
+
+        width, height = resolution
+        self.shape = (height, width, channels) if channels > 1 else (height, width)
+        self.dtype = np.dtype(dtype)
+        self.fps = fps
+        self.pattern = pattern
+        self.pool_size = pool_size
+        self.seed = seed
+
+        self._pool: list[np.ndarray] = []
+        self._frame_index: dict[str, int] = {}
+        self._pacers: dict[str, FramePacer] = {}
+
+    def pre_run(self):
+        # Generated in the worker, a process executor does not have to pickle the pool
+        self._pool = self._generate_pool()
+        self._frame_index = {}
+        self._pacers = {}
+
+    def post_run(self):
+        self._pool = []
+
+    def process(self, key: str, payload: Payload | None) -> Payload | None:
+        if self.fps is not None and not self._pacers.setdefault(key, FramePacer(self.fps)).due(self._queue_timeout):
+            return None
+
+        index = self._frame_index.get(key)
+        if index is None:
+            # Streams start at evenly spread frames of the pool, so they differ from each other
+            index = len(self._frame_index) * 7
+        self._frame_index[key] = index + 1
+
+        return VideoStreamOutput(frame=self._pool[index % self.pool_size])
+
+    def _generate_pool(self) -> list[np.ndarray]:
+        integer = np.issubdtype(self.dtype, np.integer)
+        high = float(np.iinfo(self.dtype).max) if integer else 1.0
+        height, width = self.shape[:2]
+        rng = np.random.default_rng(self.seed)
+        gradient = (np.arange(height)[:, None] + np.arange(width)[None, :]) / max(height + width - 2, 1)
+
+        pool = []
+        for i in range(self.pool_size):
+            if self.pattern == "noise" and integer:
+                frame = rng.integers(0, np.iinfo(self.dtype).max, self.shape, dtype=self.dtype, endpoint=True)
+            elif self.pattern == "noise":
+                frame = rng.random(self.shape).astype(self.dtype)
+            else:
+                shifted = (gradient + i / self.pool_size) % 1.0
+                if len(self.shape) == 3:
+                    # Every channel is offset, so color conversions see different values per channel
+                    channels = self.shape[2]
+                    shifted = np.stack([(shifted + c / channels) % 1.0 for c in range(channels)], axis=-1)
+                frame = (shifted * high).astype(self.dtype)
+
+            frame.flags.writeable = False
+            pool.append(frame)
+        return pool
@@ -0,0 +1,180 @@
+# -*- coding: utf-8 -*-
+from __future__ import annotations
+
+import math
+import queue
+import threading
+from dataclasses import dataclass
+
+import cv2
+
+from computer_vision_design_patterns.pipeline import Payload, Stage
+from computer_vision_design_patterns.pipeline.reorder import LatePolicy, ReorderPolicy
+from computer_vision_design_patterns.pipeline.sample_stage.SimpleStreamStage import VideoStreamOutput
+from computer_vision_design_patterns.pipeline.stage import StageExecutor, StageTransport, StageType
+
+
+@dataclass(frozen=True, eq=False, slots=True, kw_only=True)
+class VideoFileOutput(VideoStreamOutput):
+    frame_index: int
+
+
+class VideoFileStage(Stage):
+    """
+    Source stage decoding a video file, from frame 'start' to frame 'stop' (excluded) taking one frame every 'stride'.
+
+    A decoder thread reads ahead up to 'prefetch' frames, so decoding overlaps with the processing of the pipeline.
+    The payload sequence is the position of the frame in the range and 'frame_index' its index in the file. At the
+    end of the range the stage stops and the linked stages receive the end of stream.
+
+    With replicas > 1 the range is split in as many chunks, each decoded by its own worker. Use PROCESS workers to
+    decode the chunks on different cores. The chunks are produced at the same time, so the linked stage receives
+    their frames interleaved: by default it forwards the frames that missed their turn instead of dropping them.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        stage_executor: StageExecutor,
+        start: int = 0,
+        stop: int | None = None,
+        stride: int = 1,
+        prefetch: int = 16,
+        replicas: int = 1,
+        reorder_policy: ReorderPolicy | None = None,
+        output_maxsize: int | None = None,
+        queue_timeout: float = 0.1,
+        transport: StageTransport = StageTransport.QUEUE,
+        tracing: bool = False,
+    ):
+        if start < 0 or stop is not None and stop <= start:
+            raise ValueError(f"Invalid frame range: [{start}, {stop})")
+        if stride < 1:
+            raise ValueError("stride must be at least 1")
+        if prefetch < 1:
+            raise ValueError("prefetch must be at least 1")
+
+        if reorder_policy is None and replicas > 1:
+            reorder_policy = ReorderPolicy(late_policy=LatePolicy.FORWARD)
+
+        Stage.__init__(
+            self,
+            stage_type=StageType.One2One,
+            stage_executor=stage_executor,
+            output_maxsize=output_maxsize,
+            queue_timeout=queue_timeout,
+            transport=transport,
+            replicas=replicas,
+            reorder_policy=reorder_policy,
+            tracing=tracing,
+        )
+
+        if stop is None and replicas > 1:
+            # The chunks are computed on the length of the file
+            cap = cv2.VideoCapture(path)
+            stop = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+            cap.release()
+            if stop <= start:
+                raise ValueError(f"Cannot split {path} in chunks, its length is unknown or shorter than start")
+
+        self.path = path
+        self.start_frame = start
+        self.stop_frame = stop
+        self.stride = stride
+        self.prefetch = prefetch
+
+        # One decoder for each worker, THREAD replicas share the stage
+        self._decoders: dict[int, _Decoder] = {}
+
+    def chunk(self, replica: int) -> range:
+        """Positions in the range of the frames decoded by a replica."""
+        if self.stop_frame is None:
+            # Single worker reading until the end of the file
+            return range(0, 2**63 - 1)
+
+        frames = math.ceil((self.stop_frame - self.start_frame) / self.stride)
+        return range(frames * replica // self._replicas, frames * (replica + 1) // self._replicas)
+
+    def pre_run(self):
+        decoder = _Decoder(self.path, self.start_frame, self.stride, self.chunk(self._replica_index()), self.prefetch)
+        self._decoders[threading.get_ident()] = decoder
+        decoder.start()
+
+    def post_run(self):
+        decoder = self._decoders.pop(threading.get_ident(), None)
+        if decoder is not None:
+            decoder.close()
+
+    def process(self, key: str, payload: Payload | None) -> Payload | None:
+        decoder = self._decoders[threading.get_ident()]
+        try:
+            frame = decoder.frames.get(timeout=self._queue_timeout)
+        except queue.Empty:
+            return None
+
+        if frame is None:
+            # End of the range, or of the file
+            self._end_of_stream(key)
+            return None
+
+        position, index, image = frame
+        return VideoFileOutput(sequence=position, frame=image, frame_index=index)
+
+
+class _Decoder:
+    """Thread decoding a chunk of a video file into a bounded queue, None marks its end."""
+
+    def __init__(self, path: str, first: int, stride: int, positions: range, prefetch: int):
+        self.path = path
+        self.first = first
+        self.stride = stride
+        self.positions = positions
+        self.frames = queue.Queue(maxsize=prefetch)
+
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._decode, daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def close(self):
+        self._stop.set()
+        self._thread.join()
+
+    def _decode(self):
+        cap = cv2.VideoCapture(self.path)
+        try:
+            self._seek(cap, self.first + self.positions.start * self.stride)
+
+            for position in self.positions:
+                if position > self.positions.start:
+                    # Skipped frames are grabbed without being decoded
+                    for _ in range(self.stride - 1):
+                        cap.grab()
+
+                ret, image = cap.read()
+                if not ret or not self._put((position, self.first + position * self.stride, image)):
+                    break
+        finally:
+            cap.release()
+            self._put(None)
+
+    def _seek(self, cap: cv2.VideoCapture, index: int):
+        if index == 0:
+            return
+
+        cap.set(cv2.CAP_PROP_POS_FRAMES, index)
+        if int(cap.get(cv2.CAP_PROP_POS_FRAMES)) != index:
+            # The backend cannot seek to the exact frame, read up to it from the beginning
+            cap.set(cv2.CAP_PROP_POS_FRAMES, 0)
+            for _ in range(index):
+                cap.grab()
+
+    def _put(self, item) -> bool:
+        while not self._stop.is_set():
+            try:
+                self.frames.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
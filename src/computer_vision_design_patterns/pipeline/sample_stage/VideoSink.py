@@ -8,8 +8,8 @@ from computer_vision_design_patterns.pipeline.stage import PoisonPill, Stage, St
 
 
 class VideoSink(Stage):
-    def __init__(self, stage_executor):
-        Stage.__init__(self, stage_type=StageType.One2One, stage_executor=stage_executor)
+    def __init__(self, stage_executor, batch_size: int = 1):
+        Stage.__init__(self, stage_type=StageType.One2One, stage_executor=stage_executor, batch_size=batch_size)
 
     def pre_run(self):
         pass
@@ -39,3 +39,7 @@ class VideoSink(Stage):
             return None
 
         return payload
+
+    def process_batch(self, key: str, payloads: list[Payload]) -> list[Payload | None]:
+        # Only the most recent frame of the batch is worth showing
+        return [None] * (len(payloads) - 1) + [self.process(key, payloads[-1])]
@@ -3,3 +3,6 @@ from .SimpleStreamStage import SimpleStreamStage  # noqa
 from .VideoSink import VideoSink  # noqa
 from .RGB2GRAYStage import RGB2GRAYStage  # noqa
 from .SwitchStage import SwitchStage  # noqa
+from .MicroBatchStage import MicroBatchStage  # noqa
+from .SyntheticStreamStage import SyntheticStreamStage  # noqa
+from .VideoFileStage import VideoFileStage  # noqa
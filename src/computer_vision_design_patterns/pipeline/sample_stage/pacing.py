@@ -0,0 +1,33 @@
+# -*- coding: utf-8 -*-
+from __future__ import annotations
+
+import time
+
+
+class FramePacer:
+    """
+    Paces a stream of frames at 'fps' frames per second.
+
+    due() tells whether the next frame is due, sleeping until it is but at most 'max_sleep', so the worker calling it
+    notices when its stage is stopped. A stream that fell behind does not burst to catch up.
+    """
+
+    def __init__(self, fps: float):
+        self.fps = fps
+        self._next_frame_time: float | None = None
+
+    def reset(self) -> None:
+        self._next_frame_time = None
+
+    def due(self, max_sleep: float) -> bool:
+        now = time.monotonic()
+        next_frame_time = now if self._next_frame_time is None else self._next_frame_time
+
+        delay = next_frame_time - now
+        if delay > 0:
+            time.sleep(min(delay, max_sleep))
+            if time.monotonic() < next_frame_time:
+                return False
+
+        self._next_frame_time = max(next_frame_time + 1 / self.fps, now)
+        return True
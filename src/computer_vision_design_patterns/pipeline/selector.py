@@ -0,0 +1,138 @@
+# -*- coding: utf-8 -*-
+from __future__ import annotations
+
+import asyncio
+import threading
+import time
+from multiprocessing import connection
+
+from computer_vision_design_patterns.pipeline.thread_queue import ThreadQueue
+
+# When a stage mixes process and thread inputs it can't block on both at once, it waits on the pipes in slices
+MIXED_WAIT_SLICE = 0.005
+
+
+class InputSelector:
+    """
+    Wait for data on many input queues at once and return the keys of the ones that can be read.
+
+    Process queues are waited through their pipe reader with `multiprocessing.connection.wait`, thread queues notify
+    a shared event when something is put into them.
+    """
+
+    def __init__(self, queues: dict):
+        self.queues = dict(queues)
+
+        self._ready = threading.Event()
+        self._local: dict = {}
+        self._readers: dict = {}
+
+        for key, queue in queues.items():
+            if isinstance(queue, ThreadQueue):
+                queue.add_listener(self._ready.set)
+                self._local[key] = queue
+            else:
+                self._readers[queue._reader] = key
+
+        self._reader_list = list(self._readers)
+
+    def close(self):
+        for queue in self._local.values():
+            queue.remove_listener(self._ready.set)
+
+    def wait(self, timeout: float | None) -> list[str]:
+        deadline = None if timeout is None else time.monotonic() + timeout
+
+        while True:
+            # Clear before checking: a put that happens after the check sets the event again
+            self._ready.clear()
+            keys = [key for key, queue in self._local.items() if not queue.empty()]
+
+            if self._readers:
+                if keys:
+                    wait_timeout = 0
+                elif self._local:
+                    wait_timeout = MIXED_WAIT_SLICE if deadline is None else min(MIXED_WAIT_SLICE, _left(deadline))
+                else:
+                    wait_timeout = None if deadline is None else _left(deadline)
+
+                keys.extend(self._readers[reader] for reader in connection.wait(self._reader_list, wait_timeout))
+
+            if keys:
+                return keys
+
+            if deadline is not None and _left(deadline) <= 0:
+                return keys
+
+            if not self._readers:
+                self._ready.wait(None if deadline is None else _left(deadline))
+
+
+class AsyncInputSelector:
+    """
+    InputSelector for the stages hosted on an event loop.
+
+    The loop watches the pipe readers of process queues, thread queues wake it up with call_soon_threadsafe. On event
+    loops without reader support (e.g. the Windows proactor) the pipes are polled in slices.
+    """
+
+    def __init__(self, queues: dict, loop: asyncio.AbstractEventLoop):
+        self.queues = dict(queues)
+
+        self._loop = loop
+        self._ready = asyncio.Event()
+        self._local: dict = {}
+        self._readers: dict = {}
+        self._watched: list[int] = []
+        self._polling = False
+
+        for key, queue in queues.items():
+            if isinstance(queue, ThreadQueue):
+                queue.add_listener(self._notify)
+                self._local[key] = queue
+            else:
+                self._readers[queue._reader] = key
+
+        for reader in self._readers:
+            try:
+                loop.add_reader(reader.fileno(), self._ready.set)
+                self._watched.append(reader.fileno())
+            except NotImplementedError:
+                self._polling = True
+
+    def _notify(self):
+        self._loop.call_soon_threadsafe(self._ready.set)
+
+    def close(self):
+        for queue in self._local.values():
+            queue.remove_listener(self._notify)
+
+        for fd in self._watched:
+            self._loop.remove_reader(fd)
+
+    async def wait(self, timeout: float | None) -> list[str]:
+        deadline = None if timeout is None else time.monotonic() + timeout
+
+        while True:
+            self._ready.clear()
+            keys = self._ready_keys()
+            if keys or (deadline is not None and _left(deadline) <= 0):
+                return keys
+
+            wait_timeout = None if deadline is None else _left(deadline)
+            if self._polling:
+                wait_timeout = MIXED_WAIT_SLICE if wait_timeout is None else min(MIXED_WAIT_SLICE, wait_timeout)
+
+            try:
+                await asyncio.wait_for(self._ready.wait(), wait_timeout)
+            except asyncio.TimeoutError:
+                pass
+
+    def _ready_keys(self) -> list[str]:
+        keys = [key for key, queue in self._local.items() if not queue.empty()]
+        keys.extend(key for reader, key in self._readers.items() if reader.poll())
+        return keys
+
+
+def _left(deadline: float) -> float:
+    return max(0.0, deadline - time.monotonic())
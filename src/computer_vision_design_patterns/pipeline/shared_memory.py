@@ -0,0 +1,339 @@
+# -*- coding: utf-8 -*-
+from __future__ import annotations
+
+import multiprocessing as mp
+import os
+import sys
+import weakref
+from dataclasses import dataclass, fields, is_dataclass, replace
+from multiprocessing import resource_tracker, shared_memory
+from queue import Full
+
+import numpy as np
+
+from computer_vision_design_patterns.pipeline.payload import Payload
+
+# Bytes kept for the name of the shared memory block of a slot, the names of the platforms are much shorter
+_NAME_SIZE = 64
+
+
+@dataclass(frozen=True, slots=True)
+class SharedFrame:
+    """
+    Descriptor of an array stored in a FrameRing slot.
+
+    It is what actually travels through the queue in place of the array pixels.
+    """
+
+    name: str
+    slot: int
+    offset: int
+    shape: tuple[int, ...]
+    dtype: str
+
+
+class FrameRing:
+    """
+    Ring of fixed-size shared memory slots used to move arrays between processes without copies.
+
+    The shared memory block is created lazily by the producer, when the first array is stored, so the slot size
+    matches the frame size. Every slot has a reference count: the producer sets it to the number of consumers that
+    will receive the descriptor, and each consumer releases it once the array view it got is garbage collected.
+    A slot is reused only when its reference count drops back to zero.
+
+    The producer unlinks the block when it closes the ring, unless descriptors are still queued or views still alive:
+    then the block is dropped from the resource tracker of the producer and left to the process releasing the last of
+    its slots, so the consumers that read the queue after the producer exited still find their frames. Each worker
+    process of a replicated producer has its own block.
+    """
+
+    def __init__(self, slots: int):
+        if slots < 1:
+            raise ValueError(f"Invalid number of slots: {slots}")
+
+        self._slots = slots
+        self._refcounts = mp.Array("i", slots)
+        self._free = mp.Semaphore(slots)
+        # Block of each slot, and whether its owner closed the ring while the slot was in use
+        self._blocks = mp.RawArray("c", slots * _NAME_SIZE)
+        self._orphaned = mp.RawArray("b", slots)
+
+        self._init_local_state()
+
+    def _init_local_state(self):
+        # Process-local state, never shared with other processes
+        self._pid: int | None = None
+        self._cursor = 0
+        self._slot_size = 0
+        self._owned: shared_memory.SharedMemory | None = None
+        self._attached: dict[str, shared_memory.SharedMemory] = {}
+
+    def __getstate__(self):
+        return {
+            "_slots": self._slots,
+            "_refcounts": self._refcounts,
+            "_free": self._free,
+            "_blocks": self._blocks,
+            "_orphaned": self._orphaned,
+        }
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._init_local_state()
+
+    @property
+    def slots(self) -> int:
+        return self._slots
+
+    def free_slots(self) -> int:
+        with self._refcounts.get_lock():
+            return sum(1 for count in self._refcounts if count == 0)
+
+    def store(self, payload: Payload, consumers: int = 1, block: bool = True, timeout: float | None = None):
+        """Copy the array fields of the payload into free slots and return a payload carrying descriptors."""
+        if not is_dataclass(payload):
+            return payload
+
+        changes = {}
+        try:
+            for f in fields(payload):
+                value = getattr(payload, f.name)
+                if not isinstance(value, np.ndarray):
+                    continue
+
+                frame = self._write(value, consumers, block, timeout)
+                if frame is not None:
+                    changes[f.name] = frame
+
+        except Full:
+            self._release_frames(changes.values(), consumers)
+            raise
+
+        return replace(payload, **changes) if changes else payload
+
+    def load(self, payload):
+        """Replace the descriptors of the payload with array views on the shared memory slots."""
+        if not is_dataclass(payload):
+            return payload
+
+        for f in fields(payload):
+            value = getattr(payload, f.name)
+            if isinstance(value, SharedFrame):
+                # The payload has just been unpickled and nobody else holds a reference to it
+                object.__setattr__(payload, f.name, self._view(value))
+
+        return payload
+
+    def retain(self, payload) -> bool:
+        """Add a consumer to the slots of a payload already stored in this ring, return False if it is not."""
+        if not is_dataclass(payload) or self._owned is None:
+            return False
+
+        frames = [getattr(payload, f.name) for f in fields(payload)]
+        frames = [frame for frame in frames if isinstance(frame, SharedFrame) and frame.name == self._owned.name]
+        with self._refcounts.get_lock():
+            for frame in frames:
+                self._refcounts[frame.slot] += 1
+
+        return len(frames) > 0
+
+    def discard(self, payload, consumers: int = 1):
+        """Release the slots of a stored payload that will never reach its consumers."""
+        if is_dataclass(payload):
+            self._release_frames((getattr(payload, f.name) for f in fields(payload)), consumers)
+
+    def _release_frames(self, frames, consumers: int):
+        for frame in frames:
+            if isinstance(frame, SharedFrame):
+                for _ in range(consumers):
+                    self.release(frame.slot)
+
+    def release(self, slot: int):
+        with self._refcounts.get_lock():
+            self._refcounts[slot] -= 1
+            if self._refcounts[slot] > 0:
+                return
+
+            orphaned = bool(self._orphaned[slot])
+            if orphaned:
+                # The owner is gone, the last of its slots released unlinks the block in its place
+                self._orphaned[slot] = 0
+                name = self._block(slot)
+                orphaned = not any(self._orphaned[other] and self._block(other) == name for other in range(self._slots))
+
+        self._free.release()
+        if orphaned:
+            _unlink(name)
+
+    def close(self):
+        for shm in self._attached.values():
+            try:
+                shm.close()
+            except BufferError:
+                # Some views are still alive, the mapping is released with them
+                pass
+
+        self._attached.clear()
+
+        if self._owned is not None and self._pid == os.getpid():
+            with self._refcounts.get_lock():
+                # Descriptors still queued or views still alive, the block is unlinked by the last release
+                in_use = [
+                    slot
+                    for slot in range(self._slots)
+                    if self._refcounts[slot] > 0 and self._block(slot) == self._owned.name
+                ]
+                for slot in in_use:
+                    self._orphaned[slot] = 1
+
+            if in_use:
+                # The resource tracker of this process would unlink the block when the process exits
+                resource_tracker.unregister(self._owned._name, "shared_memory")
+            else:
+                try:
+                    self._owned.unlink()
+                except FileNotFoundError:
+                    pass
+
+        self._owned = None
+
+    def _write(self, array: np.ndarray, consumers: int, block: bool, timeout: float | None) -> SharedFrame | None:
+        if self._owned is None:
+            self._slot_size = array.nbytes
+            self._owned = shared_memory.SharedMemory(create=True, size=max(1, self._slot_size * self._slots))
+            self._pid = os.getpid()
+            self._attached[self._owned.name] = self._owned
+
+        if array.nbytes > self._slot_size:
+            # The frame does not fit in a slot, it will travel inline in the queue
+            return None
+
+        slot = self._acquire(consumers, block, timeout)
+        offset = slot * self._slot_size
+        self._blocks[slot * _NAME_SIZE : (slot + 1) * _NAME_SIZE] = self._owned.name.encode().ljust(_NAME_SIZE, b"\0")
+
+        destination = np.ndarray(array.shape, dtype=array.dtype, buffer=self._owned.buf, offset=offset)
+        np.copyto(destination, array)
+
+        return SharedFrame(name=self._owned.name, slot=slot, offset=offset, shape=array.shape, dtype=array.dtype.str)
+
+    def _acquire(self, consumers: int, block: bool, timeout: float | None) -> int:
+        if not self._free.acquire(block, timeout):
+            raise Full
+
+        with self._refcounts.get_lock():
+            for i in range(self._slots):
+                slot = (self._cursor + i) % self._slots
+                if self._refcounts[slot] == 0:
+                    self._refcounts[slot] = consumers
+                    self._cursor = slot + 1
+                    return slot
+
+        # Unreachable as long as the semaphore and the reference counts are consistent
+        self._free.release()
+        raise Full
+
+    def _block(self, slot: int) -> str:
+        return self._blocks[slot * _NAME_SIZE : (slot + 1) * _NAME_SIZE].rstrip(b"\0").decode()
+
+    def _view(self, frame: SharedFrame) -> np.ndarray:
+        shm = self._attached.get(frame.name)
+        if shm is None:
+            shm = _attach(frame.name)
+            self._attached[frame.name] = shm
+
+        view = np.ndarray(frame.shape, dtype=frame.dtype, buffer=shm.buf, offset=frame.offset)
+        weakref.finalize(view, self.release, frame.slot)
+        return view
+
+
+def _attach(name: str) -> shared_memory.SharedMemory:
+    # Only the producer owns the block: consumers must not unlink it when they exit
+    if sys.version_info >= (3, 13):
+        return shared_memory.SharedMemory(name=name, track=False)
+
+    shm = shared_memory.SharedMemory(name=name)
+    resource_tracker.unregister(shm._name, "shared_memory")
+    return shm
+
+
+def _unlink(name: str) -> None:
+    """Unlink a block on behalf of the producer that created it, which already dropped it from its resource tracker."""
+    try:
+        if sys.version_info >= (3, 13):
+            shm = shared_memory.SharedMemory(name=name, track=False)
+            shm.close()
+            shm.unlink()
+        else:
+            # Attaching registers the block again, unlink() unregisters it
+            shm = shared_memory.SharedMemory(name=name)
+            shm.close()
+            shm.unlink()
+    except FileNotFoundError:
+        pass
+
+
+class SharedMemoryQueue:
+    """
+    Queue with the same interface of `mp.Queue` that moves array payload fields through a FrameRing.
+
+    Only the descriptors are pickled and sent through the underlying queue, consumers get array views on the shared
+    memory with no copy. The views are read-write but they belong to the ring: a stage that needs to keep a frame
+    longer than the payload lifetime should copy it.
+
+    Queues can share a ring: a payload stored once in it with FrameRing.store() can be put to all of them, each put
+    adds a consumer to its slots. A shared ring is closed by its owner, not by the queues.
+    """
+
+    def __init__(self, maxsize: int = 0, ring: FrameRing | None = None, shared_ring: bool = False):
+        self._queue: mp.Queue = mp.Queue(maxsize=maxsize)
+        self._ring = ring if ring is not None else FrameRing(slots=(maxsize or 12) + 4)
+        self._shared_ring = shared_ring
+
+    @property
+    def ring(self) -> FrameRing:
+        return self._ring
+
+    @property
+    def _reader(self):
+        return self._queue._reader
+
+    def put(self, obj, block: bool = True, timeout: float | None = None) -> None:
+        retained = self._ring.retain(obj)
+        encoded = obj if retained else self._ring.store(obj, block=block, timeout=timeout)
+
+        try:
+            self._queue.put(encoded, block, timeout)
+        except Full:
+            if retained or encoded is not obj:
+                self._ring.discard(encoded)
+            raise
+
+    def put_nowait(self, obj) -> None:
+        self.put(obj, False)
+
+    def get(self, block: bool = True, timeout: float | None = None):
+        return self._ring.load(self._queue.get(block, timeout))
+
+    def get_nowait(self):
+        return self.get(False)
+
+    def qsize(self) -> int:
+        return self._queue.qsize()
+
+    def empty(self) -> bool:
+        return self._queue.empty()
+
+    def full(self) -> bool:
+        return self._queue.full()
+
+    def close(self) -> None:
+        self._queue.close()
+        if not self._shared_ring:
+            self._ring.close()
+
+    def join_thread(self) -> None:
+        self._queue.join_thread()
+
+    def cancel_join_thread(self) -> None:
+        self._queue.cancel_join_thread()
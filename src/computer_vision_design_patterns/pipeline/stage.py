@@ -1,6 +1,10 @@
 # -*- coding: utf-8 -*-
 from __future__ import annotations
 
+import asyncio
+import dataclasses
+import functools
+import itertools
 import multiprocessing as mp
 import threading
 import time
@@ -11,11 +15,26 @@ from queue import Empty, Full
 from loguru import logger
 
 from computer_vision_design_patterns.pipeline import Payload
+from computer_vision_design_patterns.pipeline.asyncio_executor import AsyncioWorker, EventLoopThread, resolve
+from computer_vision_design_patterns.pipeline.buffer_pool import BufferPool
+from computer_vision_design_patterns.pipeline.credits import CreditGate
+from computer_vision_design_patterns.pipeline.metrics import StageMetrics
+from computer_vision_design_patterns.pipeline.overflow import OverflowAction, OverflowGuard, OverflowPolicy
+from computer_vision_design_patterns.pipeline.placement import Placement
+from computer_vision_design_patterns.pipeline.reorder import ReorderBuffer, ReorderPolicy
+from computer_vision_design_patterns.pipeline.selector import AsyncInputSelector, InputSelector
+from computer_vision_design_patterns.pipeline.shared_memory import FrameRing, SharedMemoryQueue
+from computer_vision_design_patterns.pipeline.thread_queue import ThreadQueue
+from computer_vision_design_patterns.pipeline.trace import Trace
+
+# Time given to a terminated or killed worker process to exit, so it is reaped and its queue threads joined
+REAP_TIMEOUT = 1.0
 
 
 class StageExecutor(Enum):
     THREAD = 1
     PROCESS = 2
+    ASYNCIO = 3
 
 
 class StageType(Enum):
@@ -25,38 +44,157 @@ class StageType(Enum):
     Many2Many = 4
 
 
+class StageTransport(Enum):
+    QUEUE = 1
+    SHARED_MEMORY = 2
+
+
 class PoisonPill(Payload):
     pass
 
 
+def _qsize(queue) -> int | None:
+    try:
+        return queue.qsize()
+    except NotImplementedError:
+        # mp.Queue.qsize() is not available on macOS
+        return None
+
+
 class Stage(ABC):
+    """
+    Base class of the pipeline stages.
+
+    With replicas > 1 the stage starts many workers that consume from the same input queues. PROCESS replicas get a
+    copy of the stage each, THREAD replicas share it, so their process() must be thread safe. The outputs of a
+    replicated stage are put back in order by the linked stages according to reorder_policy.
+
+    overflow_policy decides what happens when an output queue is full, it can be overridden for each link.
+
+    A source stage with tracing=True attaches a Trace to the payloads it produces, every stage adds its hop and
+    records the queue wait and the latency from the source in its stats.
+
+    A stage with credits grants that many queued payloads to each stage linked to its inputs. The linked stages wait
+    for a credit before putting a payload instead of applying their overflow policy, and a source without credits does
+    not produce the payload at all, so frames are skipped before being read rather than dropped downstream. The credit
+    comes back when the stage takes the payload from the queue.
+
+    placement sets the cores, the priority and the thread pool sizes of each worker before its pre_run().
+
+    With the SHARED_MEMORY transport the outputs of a One2Many stage share one ring: the frame is stored once, with a
+    reference for each consumer. Through process queues each output pickles the payload on its own.
+    """
+
     def __init__(
         self,
         stage_type: StageType,
         stage_executor: StageExecutor,
         output_maxsize: int | None = None,
         queue_timeout: float = 0.1,
+        transport: StageTransport = StageTransport.QUEUE,
+        shared_memory_slots: int | None = None,
+        batch_size: int = 1,
+        batch_timeout: float = 0.0,
+        replicas: int = 1,
+        reorder_policy: ReorderPolicy | None = None,
+        overflow_policy: OverflowPolicy | None = None,
+        tracing: bool = False,
+        credits: int | None = None,
+        placement: Placement | None = None,
     ):
+        if batch_size < 1:
+            raise ValueError(f"Invalid batch size: {batch_size}")
+
+        if replicas < 1:
+            raise ValueError(f"Invalid number of replicas: {replicas}")
+
+        if credits is not None and credits < 1:
+            raise ValueError(f"Invalid number of credits: {credits}")
+
         self._output_maxsize = output_maxsize
         self._queue_timeout = queue_timeout
+        self._transport = transport
+        self._shared_memory_slots = shared_memory_slots
+        self._batch_size = batch_size
+        self._batch_timeout = batch_timeout
+        self._replicas = replicas
+        self._reorder_policy = reorder_policy
+        self._overflow_policy = overflow_policy if overflow_policy is not None else OverflowPolicy()
+        self._tracing = tracing
+        self._credits = credits
+        self.placement = placement
 
+        # Held to change the links, and to read them from the workers: THREAD stages can be linked while running
+        self._links_lock = threading.RLock()
         self.input_queues: dict[str, mp.Queue] = {}
         self._output_queues: dict[str, mp.Queue] = {}
+        self._overflow_guards: dict[str, OverflowGuard] = {}
+        # Credits granted by the linked stages on the outputs, and granted by this stage on the inputs
+        self._output_credits: dict[str, CreditGate] = {}
+        self._input_credits: dict[str, CreditGate] = {}
+        self._reorder_buffers: dict[str, ReorderBuffer] = {}
+
+        # One selector for each worker thread, THREAD replicas share the stage
+        self._selectors: dict[int, InputSelector] = {}
+        self._sequences: dict[str, itertools.count] = {}
+
+        # Stages linked on each key, used to find the chains that can be fused
+        self._upstream: dict[str, Stage] = {}
+        self._downstream: dict[str, Stage] = {}
+        # Input key of the linked stage for each output key, they differ when a stage copies a stream to many outputs
+        self._output_streams: dict[str, str] = {}
+        self._fused_next: Stage | None = None
+        self._fused_head: Stage | None = None
+        # Ring shared by the SHARED_MEMORY outputs of a One2Many stage
+        self._fanout_ring: FrameRing | None = None
+        # Set by the stages that take their output arrays from a pool
+        self.buffer_pool: BufferPool | None = None
+
+        # Created on start, when the linked keys are known. Each worker thread writes its own row.
+        self.name = self.__class__.__name__
+        self._metrics: StageMetrics | None = None
+        self._metric_rows: dict[int, int] = {}
 
         self._stage_type: StageType = stage_type
         self._stage_executor: StageExecutor = stage_executor
 
-        if self._stage_executor == StageExecutor.THREAD:
+        if self._stage_executor in (StageExecutor.THREAD, StageExecutor.ASYNCIO):
             self._running = threading.Event()
-            self._worker = threading.Thread(target=self._run)
-
         elif self._stage_executor == StageExecutor.PROCESS:
             self._running = mp.Event()
-            self._worker = mp.Process(target=self._run)
-
         else:
             raise ValueError(f"Invalid stage executor: {self._stage_executor}")
 
+        self._workers = [self._new_worker(replica) for replica in range(replicas)]
+        self._worker = self._workers[0]
+
+        # Each worker signals when its pre_run() is done, then it waits to be released before processing
+        event_type = mp.Event if self._stage_executor == StageExecutor.PROCESS else threading.Event
+        self._ready = [event_type() for _ in range(replicas)]
+        self._released = event_type()
+
+        # Inputs that delivered their end of stream, for each worker thread. The last worker to leave sends the end of
+        # stream to the linked stages, retrying until the drain deadline when their queues are full. The worker
+        # processes buffer their outputs in feeder threads, the last one waits for the others to flush them first.
+        self._ended: dict[int, set[str]] = {}
+        self._finished_workers = mp.Value("i", 0)
+        self._flushed_workers = mp.Value("i", 0)
+        self._drain_deadline = mp.Value("d", 0.0)
+
+        # For each worker, the time.monotonic() its current process() call started (0 out of the calls) and whether
+        # it left its loop normally, so a supervisor can tell the hung and crashed workers from the busy or done ones
+        self._busy_since = mp.RawArray("d", replicas)
+        self._completed = mp.RawArray("b", replicas)
+        self._restarts = 0
+
+    def _new_worker(self, replica: int):
+        if self._stage_executor == StageExecutor.THREAD:
+            return threading.Thread(target=self._run, args=(replica,))
+        if self._stage_executor == StageExecutor.PROCESS:
+            return mp.Process(target=self._run, args=(replica,))
+        # Hosted as coroutines on the event loop shared with the other ASYNCIO stages
+        return AsyncioWorker(functools.partial(self._arun, replica))
+
     @abstractmethod
     def pre_run(self):
         pass
@@ -71,17 +209,100 @@ class Stage(ABC):
             self._running.clear()
             return None
 
+    def process_batch(self, key: str, payloads: list[Payload]) -> list[Payload | None]:
+        """
+        Process the payloads drained from an input queue when the stage runs with batch_size > 1.
+
+        Stages that can process many payloads at once (e.g. stacking the frames) should override it, the default
+        implementation calls process() for each payload. It returns one entry for each payload, in the same order.
+        """
+        return [self.process(key, payload) for payload in payloads]
+
+    @property
+    def executor(self) -> StageExecutor:
+        return self._stage_executor
+
+    @property
+    def fusable(self) -> bool:
+        """Whether the stage can run in the worker of the stage linked on its input."""
+        return (
+            self._stage_type == StageType.One2One
+            and self._stage_executor == StageExecutor.THREAD
+            and self._replicas == 1
+            and self._batch_size == 1
+            and self._fused_head is None
+            and self._fused_next is None
+            and not any(worker.is_alive() for worker in self._workers)
+        )
+
+    def upstream_stages(self) -> list[Stage]:
+        return list(self._upstream.values())
+
+    def downstream_stages(self) -> list[Stage]:
+        return list(self._downstream.values())
+
+    def fuse(self, stages: list[Stage]) -> None:
+        """
+        Run the linear chain of stages that follows this one in its worker.
+
+        Each payload is handed to the process() of the next stage directly instead of going through the queue between
+        them. The fused stages keep their own pre_run(), post_run() and running flag, stopping any of them stops the
+        whole chain.
+        """
+        chain = [self, *stages]
+        for stage in chain:
+            if not stage.fusable:
+                raise ValueError(f"Cannot fuse {stage.__class__.__name__}")
+
+        for previous, stage in zip(chain, stages):
+            if list(previous._downstream.values()) != [stage] or list(stage._upstream.values()) != [previous]:
+                raise ValueError(f"{stage.__class__.__name__} is not linked only to {previous.__class__.__name__}")
+
+        for previous, stage in zip(chain, stages):
+            previous._fused_next = stage
+            stage._fused_head = self
+
+        self._workers = [threading.Thread(target=self._run_fused)]
+        self._worker = self._workers[0]
+        for stage in stages:
+            stage._workers = self._workers
+            stage._worker = self._worker
+
+    def _fused_chain(self) -> list[Stage]:
+        chain = [self]
+        while chain[-1]._fused_next is not None:
+            chain.append(chain[-1]._fused_next)
+        return chain
+
+    def bind_event_loop(self, event_loop: EventLoopThread) -> None:
+        """Set the event loop that will host the workers of an ASYNCIO stage."""
+        for worker in self._workers:
+            if isinstance(worker, AsyncioWorker):
+                worker.event_loop = event_loop
+
     def is_alive(self) -> bool:
-        return self._worker.is_alive()
+        return any(worker.is_alive() for worker in self._workers)
+
+    def is_ready(self) -> bool:
+        """Whether the pre_run() of every worker is done."""
+        return all(ready.is_set() for ready in self._ready)
+
+    def release(self) -> None:
+        """Let the workers of a stage started with hold=True process data."""
+        self._released.set()
+
+    def _wait_released(self):
+        while self._running.is_set() and not self._released.wait(0.01):
+            pass
 
-    def get_from_left(self, key: str) -> Payload | None:
+    def get_from_left(self, key: str, block: bool = True) -> Payload | None:
         """Get data from the previous stage / stages."""
         queue = self.input_queues.get(key)
         if queue is None:
             return None
 
         try:
-            data = queue.get(timeout=self._queue_timeout)
+            data = queue.get(timeout=self._queue_timeout) if block else queue.get_nowait()
 
         except (ValueError, OSError):
             logger.error(f"Queue {key} is closed")
@@ -90,7 +311,12 @@ class Stage(ABC):
         except Empty:
             return None
 
-        return data if data else None
+        if not data:
+            return None
+
+        if self._input_credits and not isinstance(data, PoisonPill):
+            self._grant_credits(key, 1)
+        return data
 
     def put_to_right(self, key: str, payload: Payload) -> None:
         """Put data to the next stage / stages."""
@@ -98,49 +324,483 @@ class Stage(ABC):
         if queue is None:
             return None
 
+        guard = self._overflow_guards.get(key)
+        if guard is None:
+            guard = self._overflow_guards[key] = OverflowGuard(self._overflow_policy)
+
+        gate = self._output_credits.get(key)
+        if gate is not None and self.input_queues:
+            # Sources take their credits before producing the payload
+            if not gate.wait(self._queue_timeout, self._running):
+                return None
+
         try:
-            queue.put(payload, timeout=self._queue_timeout)
+            # Never block the event loop shared with the other stages
+            timeout = 0.0 if self._stage_executor == StageExecutor.ASYNCIO else self._queue_timeout
+            guard.put(queue, payload, timeout, self._running)
 
         except (ValueError, OSError):
             logger.error(f"Queue {key} is closed")
             return None
 
-        except Full:
-            logger.warning(f"Queue {self.__class__.__name__}, Output queue {key} is full, dropping frame")
+        if self._metrics is not None:
+            self._metrics.record_output(self._metric_row(), key)
+
+    def dropped(self) -> dict[str, int]:
+        """Number of payloads dropped by the overflow policy of each output queue."""
+        return {key: guard.dropped for key, guard in self._overflow_guards.items()}
+
+    def throttled(self) -> dict[str, int]:
+        """Number of payloads a source did not produce for lack of credits on each output queue."""
+        return {key: gate.throttled for key, gate in self._output_credits.items()}
+
+    def _take_credits(self, key: str, output_keys: set[str]) -> list[CreditGate] | None:
+        """Credits of the outputs a source payload goes to, None if one of them has none left."""
+        if not self._output_credits:
+            return []
+
+        keys = output_keys if self._stage_type == StageType.One2Many else [key]
+        gates = [self._output_credits[output_key] for output_key in keys if output_key in self._output_credits]
+
+        for i, gate in enumerate(gates):
+            if not gate.acquire(self._queue_timeout if i == 0 else 0):
+                gate.throttle()
+                for taken in gates[:i]:
+                    taken.release()
+                return None
+
+        return gates
+
+    def _grant_credits(self, key: str, count: int) -> None:
+        gate = self._input_credits.get(key)
+        if gate is not None and count:
+            gate.release(count)
+
+    def stats(self) -> dict:
+        """Runtime metrics of the stage, collected since it has been started."""
+        stats = self._metrics.snapshot() if self._metrics is not None else {}
+        with self._links_lock:
+            input_queues = list(self.input_queues.items())
+        stats["queue_depth"] = {key: _qsize(queue) for key, queue in input_queues}
+        stats["dropped"] = self.dropped()
+        stats["throttled"] = self.throttled()
+        stats["restarts"] = self._restarts
+        if self.buffer_pool is not None:
+            stats["buffer_pool"] = self.buffer_pool.stats()
+        return stats
+
+    def _init_metrics(self):
+        if self._metrics is None:
+            with self._links_lock:
+                input_keys, output_keys = list(self.input_queues.keys()), list(self._output_queues.keys())
+            self._metrics = StageMetrics(
+                self._replicas, input_keys, output_keys, shared=self._stage_executor == StageExecutor.PROCESS
+            )
+
+    def _linked_keys(self) -> tuple[set[str], set[str]]:
+        """Keys of the input and of the output queues."""
+        with self._links_lock:
+            return set(self.input_queues.keys()), set(self._output_queues.keys())
+
+    def _metric_row(self) -> int:
+        # THREAD replicas share the stage, the other workers always write the first row of their copy
+        return self._replica_index() if self._replicas > 1 else 0
+
+    def _replica_index(self) -> int:
+        """Replica of the calling worker, 0 outside of the workers."""
+        return self._metric_rows.get(threading.get_ident(), 0)
+
+    def _timed(self, method, *args):
+        """Call process() or process_batch(), record its latency and since when the worker is in the call."""
+        row = self._metric_row()
+        self._busy_since[row] = time.monotonic()
+
+        metrics = self._metrics
+        if metrics is None:
             try:
-                queue.get_nowait()
-                queue.put_nowait(payload)
-            except (Empty, Full):
-                pass
+                return method(*args)
+            finally:
+                self._busy_since[row] = 0.0
+
+        start = time.perf_counter_ns()
+        try:
+            return method(*args)
+        except Exception:
+            metrics.record_error(row)
+            raise
+        finally:
+            self._busy_since[row] = 0.0
+            metrics.record_call(row, time.perf_counter_ns() - start)
+
+    async def _atimed(self, method, *args):
+        metrics = self._metrics
+        if metrics is None:
+            return await resolve(method(*args))
+
+        start = time.perf_counter_ns()
+        try:
+            return await resolve(method(*args))
+        except Exception:
+            metrics.record_error(0)
+            raise
+        finally:
+            metrics.record_call(0, time.perf_counter_ns() - start)
+
+    def _open_inputs(self) -> dict[str, mp.Queue]:
+        ended = self._ended.get(threading.get_ident()) or set()
+        with self._links_lock:
+            return {key: queue for key, queue in self.input_queues.items() if key not in ended}
+
+    def _end_of_stream(self, key: str) -> None:
+        """Stop reading an input after its PoisonPill, the worker leaves once all the inputs have ended."""
+        self._ended.setdefault(threading.get_ident(), set()).add(key)
+        if self._replicas == 1 and self._drained():
+            self._running.clear()
+
+    def _drained(self) -> bool:
+        ended = self._ended.get(threading.get_ident())
+        with self._links_lock:
+            return bool(ended) and self.input_queues.keys() <= ended
+
+    def _wait_for_inputs(self, timeout: float | None = None) -> list[str]:
+        """Wait until one or more input queues have data and return their keys."""
+        queues = self._open_inputs()
+        selector = self._selectors.get(threading.get_ident())
+        # The queues are compared by identity, the ones replaced when a worker is restarted need a new selector
+        if selector is None or selector.queues != queues:
+            if selector is not None:
+                selector.close()
+            selector = InputSelector(dict(queues))
+            self._selectors[threading.get_ident()] = selector
+
+        return selector.wait(self._queue_timeout if timeout is None else timeout)
 
     def _process_stage(self):
-        input_keys = set(self.input_queues.keys())
-        output_keys = set(self._output_queues.keys())
+        input_keys, output_keys = self._linked_keys()
 
-        keys_to_process = input_keys if input_keys else output_keys
+        if not input_keys:
+            # Source stage, it produces data for each output
+            for key in output_keys:
+                credits = self._take_credits(key, output_keys)
+                if credits is None:
+                    continue
 
-        for key in keys_to_process:
-            payload = self.get_from_left(key)
-            if isinstance(payload, PoisonPill):
-                self._running.clear()
+                started = time.monotonic() if self._tracing else None
+                processed_payload = self._timed(self.process, key, None)
+                if processed_payload is None:
+                    for gate in credits:
+                        gate.release()
+                    continue
+
+                trace = self._new_trace(started) if started is not None else None
+                self._forward(key, processed_payload, output_keys, trace=trace)
+            return
+
+        start = time.perf_counter_ns()
+        ready_keys = self._wait_for_inputs()
+        if self._metrics is not None:
+            self._metrics.record_idle(self._metric_row(), time.perf_counter_ns() - start)
+
+        if not ready_keys:
+            # No data within the timeout, stages still get called like on an empty get
+            for key in input_keys:
+                self._forward(key, self._timed(self.process, key, None), output_keys)
+
+        # A single wait for the batches of all the ready inputs, not one for each of them
+        deadline = time.monotonic() + self._batch_timeout
+        for key in ready_keys:
+            payloads, poisoned = self._take_from_left(key, deadline=deadline)
+            if payloads:
+                self._process_payloads(key, payloads, output_keys)
+
+            if poisoned:
+                self._end_of_stream(key)
+
+        for key, reorder_buffer in list(self._reorder_buffers.items()):
+            # Payloads that stopped waiting for the missing ones of a replicated stage
+            payloads = reorder_buffer.expire()
+            if payloads:
+                self._process_payloads(key, payloads, output_keys)
+
+    def _process_payloads(self, key: str, payloads: list[Payload], output_keys: set[str]) -> None:
+        if self._metrics is not None:
+            self._metrics.record_input(self._metric_row(), key, len(payloads))
+
+        if self._batch_size > 1:
+            started = time.monotonic()
+            processed_payloads = self._timed(self.process_batch, key, payloads)
+            ended = time.monotonic()
+            for processed_payload, payload in zip(processed_payloads, payloads):
+                self._forward(
+                    key, processed_payload, output_keys, payload, self._trace_hop(key, payload, started, ended)
+                )
+        else:
+            for payload in payloads:
+                if payload.trace is None:
+                    self._forward(key, self._timed(self.process, key, payload), output_keys, payload)
+                else:
+                    started = time.monotonic()
+                    processed_payload = self._timed(self.process, key, payload)
+                    trace = self._trace_hop(key, payload, started, time.monotonic())
+                    self._forward(key, processed_payload, output_keys, payload, trace)
+
+    def _take_from_left(
+        self, key: str, block: bool = True, deadline: float | None = None
+    ) -> tuple[list[Payload], bool]:
+        """Get the payloads to process from an input queue, and whether a PoisonPill followed them."""
+        if self._batch_size > 1:
+            payloads = self._get_batch_from_left(key, block, deadline)
+        else:
+            payload = self.get_from_left(key, block)
+            payloads = [payload] if payload is not None else []
+
+        poisoned = len(payloads) > 0 and isinstance(payloads[-1], PoisonPill)
+        if poisoned:
+            payloads.pop()
+
+        reorder_buffer = self._reorder_buffers.get(key)
+        if reorder_buffer is not None:
+            payloads = [ordered for payload in payloads for ordered in reorder_buffer.push(payload)]
+
+        return payloads, poisoned
+
+    def _forward(
+        self,
+        key: str,
+        processed_payload: Payload | None,
+        output_keys: set[str],
+        payload: Payload | None = None,
+        trace: Trace | None = None,
+    ) -> None:
+        if processed_payload is None or not output_keys:
+            return
+
+        if processed_payload.sequence is None:
+            sequence = self._sequence_for(key, payload)
+            if sequence is not None:
+                # The processed payload has not been published yet, it is safe to stamp it
+                object.__setattr__(processed_payload, "sequence", sequence)
+
+        if trace is not None:
+            if processed_payload is payload:
+                # The input payload can be shared with other stages, the trace goes on a copy
+                processed_payload = dataclasses.replace(processed_payload, trace=trace)
+            else:
+                object.__setattr__(processed_payload, "trace", trace)
+            trace.mark_enqueued()
+
+        if self._fused_next is not None:
+            # Fused One2One chain, the next stage processes the payload in this worker
+            fused_next = self._fused_next
+            if self._metrics is not None:
+                self._metrics.record_output(self._metric_row(), key)
+            fused_next._process_payloads(key, [processed_payload], fused_next._linked_keys()[1])
+            return
+
+        if self._stage_type == StageType.One2Many:
+            self._fan_out(processed_payload, output_keys)
+        else:
+            self.put_to_right(key, processed_payload)
+
+    def _fan_out(self, payload: Payload, output_keys: set[str]) -> None:
+        """Put the payload to all the outputs, the queues sharing the shared memory ring get its frames stored once."""
+        ring_keys = [key for key in output_keys if isinstance(self._output_queues.get(key), SharedMemoryQueue)]
+
+        shared = payload
+        if len(ring_keys) > 1:
+            try:
+                # Held until every queue has added its consumer, so the slots are not freed in the meantime
+                shared = self._fanout_ring.store(payload, block=False)
+            except Full:
+                # No free slot, each queue stores the payload applying its own overflow policy
+                pass
+
+        for output_key in output_keys:
+            self.put_to_right(output_key, shared if output_key in ring_keys else payload)
+
+        if shared is not payload:
+            self._fanout_ring.discard(shared)
+
+    def _new_trace(self, started: float) -> Trace:
+        trace = Trace()
+        trace.add_hop(started, time.monotonic())
+        return trace
+
+    def _trace_hop(self, key: str, payload: Payload, started: float, ended: float) -> Trace | None:
+        """Record the latencies of a traced payload and return the trace of the processed payload."""
+        trace = payload.trace
+        if trace is None:
+            return None
+
+        if self._metrics is not None:
+            self._metrics.record_trace(self._metric_row(), key, started - trace.enqueued, ended - trace.origin)
+
+        trace = trace.copy()
+        trace.add_hop(started, ended)
+        return trace
+
+    def _sequence_for(self, key: str, payload: Payload | None) -> int | None:
+        if payload is not None:
+            return payload.sequence
+
+        if self.input_queues:
+            return None
+
+        # Source stage: every output stream gets its own numbering
+        sequence = self._sequences.get(key)
+        if sequence is None:
+            sequence = self._sequences[key] = itertools.count()
+        return next(sequence)
+
+    def _get_batch_from_left(self, key: str, block: bool = True, deadline: float | None = None) -> list[Payload]:
+        """
+        Drain up to batch_size payloads from an input queue, waiting for them until deadline, by default batch_timeout
+        from now. Once the deadline has passed only the payloads already queued are taken.
+        """
+        queue = self.input_queues.get(key)
+        if queue is None:
+            return []
+
+        payloads = []
+        if not block:
+            deadline = time.monotonic()
+        elif deadline is None:
+            deadline = time.monotonic() + self._batch_timeout
+
+        while len(payloads) < self._batch_size:
+            remaining = deadline - time.monotonic()
+            try:
+                payload = queue.get(timeout=remaining) if remaining > 0 else queue.get_nowait()
+
+            except (ValueError, OSError):
+                logger.error(f"Queue {key} is closed")
                 break
-            processed_payload = self.process(key, payload)
 
-            if processed_payload is None or not output_keys:
+            except Empty:
+                break
+
+            if not payload:
                 continue
 
-            if self._stage_type == StageType.One2Many:
-                for output_key in output_keys:
-                    self.put_to_right(output_key, processed_payload)
-            else:
-                self.put_to_right(key, processed_payload)
+            payloads.append(payload)
+            if isinstance(payload, PoisonPill):
+                break
+
+        if self._input_credits:
+            self._grant_credits(key, sum(not isinstance(payload, PoisonPill) for payload in payloads))
+        return payloads
+
+    async def _await_inputs(self) -> list[str]:
+        """Wait on the event loop until one or more input queues have data and return their keys."""
+        task = id(asyncio.current_task())
+        queues = self._open_inputs()
+
+        selector = self._selectors.get(task)
+        if selector is None or selector.queues != queues:
+            if selector is not None:
+                selector.close()
+            selector = AsyncInputSelector(dict(queues), asyncio.get_running_loop())
+            self._selectors[task] = selector
+
+        return await selector.wait(self._queue_timeout)
+
+    async def _aprocess_stage(self):
+        """Coroutine version of _process_stage() used by the ASYNCIO stages, process() can be 'async def'."""
+        input_keys, output_keys = self._linked_keys()
 
-    def _run(self):
+        if not input_keys:
+            for key in output_keys:
+                started = time.monotonic()
+                processed_payload = await self._atimed(self.process, key, None)
+                trace = self._new_trace(started) if self._tracing else None
+                self._forward(key, processed_payload, output_keys, trace=trace)
+            return
+
+        start = time.perf_counter_ns()
+        ready_keys = await self._await_inputs()
+        if self._metrics is not None:
+            self._metrics.record_idle(0, time.perf_counter_ns() - start)
+
+        if not ready_keys:
+            for key in input_keys:
+                self._forward(key, await self._atimed(self.process, key, None), output_keys)
+
+        for key in ready_keys:
+            payloads, poisoned = self._take_from_left(key, block=False)
+            if payloads:
+                await self._aprocess_payloads(key, payloads, output_keys)
+
+            if poisoned:
+                self._end_of_stream(key)
+
+        for key, reorder_buffer in list(self._reorder_buffers.items()):
+            payloads = reorder_buffer.expire()
+            if payloads:
+                await self._aprocess_payloads(key, payloads, output_keys)
+
+    async def _aprocess_payloads(self, key: str, payloads: list[Payload], output_keys: set[str]) -> None:
+        if self._metrics is not None:
+            self._metrics.record_input(0, key, len(payloads))
+
+        if self._batch_size > 1:
+            started = time.monotonic()
+            processed_payloads = await self._atimed(self.process_batch, key, payloads)
+            ended = time.monotonic()
+            for processed_payload, payload in zip(processed_payloads, payloads):
+                self._forward(
+                    key, processed_payload, output_keys, payload, self._trace_hop(key, payload, started, ended)
+                )
+        else:
+            for payload in payloads:
+                started = time.monotonic()
+                processed_payload = await self._atimed(self.process, key, payload)
+                trace = self._trace_hop(key, payload, started, time.monotonic())
+                self._forward(key, processed_payload, output_keys, payload, trace)
+
+    async def _arun(self, replica: int = 0):
         logger.info(f"Starting {self.__class__.__name__}")
+        await resolve(self.pre_run())
+        self._ready[replica].set()
+
+        while self._running.is_set() and not self._released.is_set():
+            await asyncio.sleep(0.005)
+        logger.info(f"Running {self.__class__.__name__}")
+
+        while self._running.is_set() and not self._drained():
+            try:
+                await self._aprocess_stage()
+
+            except Exception as e:
+                logger.exception(e)
+                logger.error(f"Error in {self.__class__.__name__}: {str(e)}")
+
+            # Let the other stages hosted on the loop run
+            await asyncio.sleep(0)
+
+        selector = self._selectors.pop(id(asyncio.current_task()), None)
+        if selector is not None:
+            selector.close()
+
+        if self._finish_worker():
+            # The queues of the linked stages can be full, so wait for them outside the event loop
+            await asyncio.get_running_loop().run_in_executor(None, self._send_end_of_stream)
+
+        await resolve(self.post_run())
+        self._release_shared_memory()
+
+    def _run(self, replica: int = 0):
+        self._metric_rows[threading.get_ident()] = replica
+
+        logger.info(f"Starting {self.__class__.__name__}")
+        if self.placement is not None:
+            self.placement.apply(replica)
         self.pre_run()
+        self._ready[replica].set()
+
+        self._wait_released()
         logger.info(f"Running {self.__class__.__name__}")
 
-        while self._running.is_set():
+        while self._running.is_set() and not self._drained():
             try:
                 self._process_stage()
 
@@ -149,15 +809,234 @@ class Stage(ABC):
                 self.stop()
 
             except Exception as e:
+                # A worker that dies or hangs is restarted by the supervisor of the pipeline, if it has one
                 logger.exception(e)
                 logger.error(f"Error in {self.__class__.__name__}: {str(e)}")
-                # TODO add crash callback
+
+        if self._finish_worker():
+            self._wait_flushed()
+            self._send_end_of_stream()
+        elif self._stage_executor == StageExecutor.PROCESS:
+            self._flush_outputs()
 
         self.post_run()
+        self._release_shared_memory()
+        self._completed[replica] = 1
+
+    def _run_fused(self):
+        chain = self._fused_chain()
+        names = " -> ".join(stage.__class__.__name__ for stage in chain)
+
+        logger.info(f"Starting fused {names}")
+        if self.placement is not None:
+            self.placement.apply()
+        for stage in chain:
+            stage.pre_run()
+        for stage in chain:
+            stage._ready[0].set()
+
+        self._wait_released()
+        logger.info(f"Running fused {names}")
+
+        while all(stage._running.is_set() for stage in chain) and not self._drained():
+            try:
+                self._process_stage()
+
+            except KeyboardInterrupt:
+                logger.error(f"Keyboard interrupt in fused {names}")
+                for stage in chain:
+                    stage.stop()
+
+            except Exception as e:
+                logger.exception(e)
+                logger.error(f"Error in fused {names}: {str(e)}")
+
+        chain[-1]._send_end_of_stream()
+
+        for stage in chain:
+            stage.post_run()
+            stage._release_shared_memory()
+
+    def crashed_workers(self) -> list[int]:
+        """Replicas whose worker died without leaving its loop, killed by a signal or by an uncaught error."""
+        if self._stage_executor == StageExecutor.ASYNCIO:
+            # The coroutines catch the errors of the stage, and a crash takes down the whole event loop anyway
+            return []
+
+        return [
+            replica
+            for replica, worker in enumerate(self._workers)
+            if worker.ident is not None and not worker.is_alive() and not self._completed[replica]
+        ]
 
-        exit(0)
+    def busy_time(self, replica: int) -> float:
+        """Seconds the worker of a replica has spent in its current process() call, 0 if it is not in one."""
+        busy_since = self._busy_since[replica]
+        return time.monotonic() - busy_since if busy_since > 0 else 0.0
 
-    def link(self, stage: Stage, key: str) -> None:
+    def restart_worker(self, replica: int) -> None:
+        """
+        Replace the worker of a replica with a new one, which runs pre_run() again.
+
+        A PROCESS worker still alive is killed first. A THREAD worker cannot be, it must be dead. A dead PROCESS worker
+        may have held the locks of its queues or left half a payload in their pipes, so the new worker gets new queues,
+        see renew_queues().
+        """
+        worker = self._workers[replica]
+        if worker.is_alive():
+            if self._stage_executor != StageExecutor.PROCESS:
+                raise RuntimeError(f"Cannot restart the running {self._stage_executor.name} worker of {self.name}")
+            worker.kill()
+            worker.join()
+
+        if self._stage_executor == StageExecutor.PROCESS:
+            self.renew_queues()
+
+        self._busy_since[replica] = 0.0
+        self._completed[replica] = 0
+        self._ready[replica].clear()
+        self._restarts += 1
+
+        worker = self._workers[replica] = self._new_worker(replica)
+        if replica == 0:
+            self._worker = worker
+        worker.start()
+
+    def renew_queues(self) -> None:
+        """
+        Replace the input and output queues with new ones on both ends of their links, the queued payloads are lost.
+
+        Only the links whose other end runs in this process, or is not running, can be renewed: the other replicas of
+        the stage and the running PROCESS stages keep their copy of the queues. The other links keep the old queue.
+        """
+        if any(worker.is_alive() for worker in self._workers):
+            logger.warning(f"Cannot renew the queues of {self.name}, some of its workers are running")
+            return
+
+        with self._links_lock:
+            inputs = list(self.input_queues.items())
+            output_keys = list(self._output_queues.keys())
+
+        for input_key, queue in inputs:
+            upstream = self._upstream.get(input_key)
+            if upstream is None:
+                continue
+            with upstream._links_lock:
+                keys = [key for key, output_queue in upstream._output_queues.items() if output_queue is queue]
+            for key in keys:
+                # Nobody reads the old queue anymore, closing it lets the producer give up a put blocked on it
+                upstream._renew_output(key, close=True)
+
+        for key in output_keys:
+            # The linked stage may be reading the old queue, it is dropped once it moves to the new one
+            self._renew_output(key, close=False)
+
+    def _renew_output(self, key: str, close: bool) -> None:
+        stage = self._downstream[key]
+        for linked in (self, stage):
+            if linked._stage_executor == StageExecutor.PROCESS and linked.is_alive():
+                logger.warning(f"Cannot renew the queue {key} of {self.name}, the workers of {linked.name} are running")
+                return
+
+        input_key = self._output_streams.get(key, key)
+        queue = self._create_queue(stage, self._overflow_guards[key].policy)
+
+        first, second = sorted((self, stage), key=id)
+        with first._links_lock, second._links_lock:
+            old = self._output_queues[key]
+            self._output_queues[key] = queue
+            stage.input_queues[input_key] = queue
+
+            if stage._credits is not None:
+                # The credits of the payloads lost with the old queue would never come back
+                gate = CreditGate(stage._credits, shared=not isinstance(queue, ThreadQueue))
+                self._output_credits[key] = gate
+                stage._input_credits[input_key] = gate
+
+        # The feeder thread of this process may be stuck on the old queue, it must not hold up the exit
+        old.cancel_join_thread()
+        if close:
+            old.close()
+
+    def _finish_worker(self) -> bool:
+        """Count a worker that left the processing loop, return whether it is the last one."""
+        with self._finished_workers.get_lock():
+            self._finished_workers.value += 1
+            return self._finished_workers.value == self._replicas
+
+    def _flush_outputs(self):
+        """Wait for the payloads this worker process put to be written to the queues, then count it as flushed."""
+        with self._links_lock:
+            output_queues = list(self._output_queues.values())
+
+        for queue in output_queues:
+            if not isinstance(queue, ThreadQueue):
+                queue.close()
+                queue.join_thread()
+
+        self._worker_flushed()
+
+    def _worker_flushed(self):
+        with self._flushed_workers.get_lock():
+            self._flushed_workers.value += 1
+
+    def _wait_flushed(self):
+        """Wait for the other worker processes to flush their outputs, so the end of stream does not overtake them."""
+        if self._stage_executor != StageExecutor.PROCESS:
+            return
+
+        while self._flushed_workers.value < self._replicas - 1:
+            if not self._running.is_set() and time.monotonic() > self._drain_deadline.value:
+                logger.warning(f"Workers of {self.name} not flushed, sending the end of stream anyway")
+                return
+            time.sleep(0.005)
+
+    def _send_end_of_stream(self):
+        """Put a PoisonPill behind the queued payloads for each worker of the linked stages."""
+        deadline = self._drain_deadline.value
+        timeout = self._queue_timeout or 0.1
+
+        with self._links_lock:
+            output_queues = list(self._output_queues.items())
+
+        for key, queue in output_queues:
+            downstream = self._downstream.get(key)
+            for _ in range(downstream._replicas if downstream is not None else 1):
+                while True:
+                    try:
+                        queue.put(PoisonPill(), timeout=timeout)
+                        break
+
+                    except (ValueError, OSError):
+                        logger.error(f"Queue {key} is closed")
+                        break
+
+                    except Full:
+                        if time.monotonic() > deadline:
+                            logger.warning(f"Cannot send the end of stream to {key}, the queue is full")
+                            break
+
+    def drain_until(self, deadline: float) -> None:
+        """Set the time.monotonic() deadline to deliver the end of stream to the linked stages."""
+        self._drain_deadline.value = deadline
+
+    def _release_shared_memory(self):
+        # The shared memory blocks are created by the producer, so they are unlinked when its worker exits, or by the
+        # consumer releasing the last frame when some are still queued
+        with self._links_lock:
+            output_queues = list(self._output_queues.values())
+
+        for queue in output_queues:
+            if isinstance(queue, SharedMemoryQueue):
+                queue.ring.close()
+
+    def check_linkable(self) -> None:
+        """Raise RuntimeError if the stage cannot be linked now, its worker processes would never see the queue."""
+        if self._stage_executor == StageExecutor.PROCESS and self.is_alive():
+            raise RuntimeError(f"Cannot link {self.name} while its worker processes are running")
+
+    def link(self, stage: Stage, key: str, overflow_policy: OverflowPolicy | None = None) -> str:
+        """Link an output of this stage to an input of the stage, both on key, and return the output key."""
         # Check if the stage can be linked based on the stage type
         if self._stage_type in [StageType.One2One, StageType.Many2One] and len(self._output_queues) > 0:
             raise ValueError(f"Cannot link more outputs for stage type {self._stage_type}")
@@ -165,55 +1044,170 @@ class Stage(ABC):
         if stage._stage_type in [StageType.One2One, StageType.One2Many] and len(stage.input_queues) > 0:
             raise ValueError(f"Cannot link more inputs for stage type {stage._stage_type}")
 
+        return self._connect(stage, key, key, overflow_policy)
+
+    def _connect(
+        self, stage: Stage, output_key: str, input_key: str, overflow_policy: OverflowPolicy | None = None
+    ) -> str:
+        overflow_policy = overflow_policy if overflow_policy is not None else self._overflow_policy
+        if overflow_policy.action == OverflowAction.BLOCK and self._stage_executor == StageExecutor.ASYNCIO:
+            raise ValueError("ASYNCIO stages cannot block on their output queues")
+
+        if stage._credits is not None and self._stage_executor == StageExecutor.ASYNCIO:
+            raise ValueError("ASYNCIO stages cannot wait for the credits of their output queues")
+
+        self.check_linkable()
+        stage.check_linkable()
+
+        queue = self._create_queue(stage, overflow_policy)
+
+        # Always in the same order, so two links made at the same time do not wait for each other
+        first, second = sorted((self, stage), key=id)
+        with first._links_lock, second._links_lock:
+            self._output_queues[output_key] = queue
+            self._overflow_guards[output_key] = OverflowGuard(
+                overflow_policy, shared=not isinstance(queue, ThreadQueue)
+            )
+            stage.input_queues[input_key] = queue
+
+            if stage._credits is not None:
+                gate = CreditGate(stage._credits, shared=not isinstance(queue, ThreadQueue))
+                self._output_credits[output_key] = gate
+                stage._input_credits[input_key] = gate
+
+            self._downstream[output_key] = stage
+            self._output_streams[output_key] = input_key
+            stage._upstream[input_key] = self
+
+            if self._replicas > 1:
+                # The replicas complete the payloads out of order, the linked stage puts them back in sequence
+                stage._reorder_buffers[input_key] = ReorderBuffer(self._reorder_policy)
+
+        for linked in (self, stage):
+            if linked._metrics is not None:
+                # Started stages count the new stream from now on
+                input_keys, output_keys = linked._linked_keys()
+                linked._metrics = linked._metrics.with_keys(sorted(input_keys), sorted(output_keys))
+
+        return output_key
+
+    def _create_queue(self, stage: Stage, overflow_policy: OverflowPolicy) -> mp.Queue:
         maxsize = self._output_maxsize if self._output_maxsize is not None else 0
+        if overflow_policy.action == OverflowAction.LATEST_ONLY:
+            maxsize = 1
+        if stage._credits is not None:
+            # The credits keep the queue from filling up
+            maxsize = stage._credits
 
-        queue: mp.Queue = mp.Queue(maxsize=maxsize)
+        in_process = (StageExecutor.THREAD, StageExecutor.ASYNCIO)
+        if self._stage_executor in in_process and stage._stage_executor in in_process:
+            # No process boundary is crossed, payloads can be passed by reference
+            return ThreadQueue(maxsize=maxsize)
 
-        self._output_queues[key] = queue
-        stage.input_queues[key] = queue
+        if self._transport == StageTransport.SHARED_MEMORY:
+            # Frames stay in shared memory slots, only their descriptors go through the queue. A few slots more than
+            # the queue size are needed because the consumer holds the frames it is processing.
+            slots = self._shared_memory_slots or (maxsize or 12) + 4
+            if self._stage_type == StageType.One2Many:
+                # The copies of a frame take a single slot, released when the last consumer is done with it
+                if self._fanout_ring is None:
+                    self._fanout_ring = FrameRing(slots)
+                return SharedMemoryQueue(maxsize=maxsize, ring=self._fanout_ring, shared_ring=True)
+
+            return SharedMemoryQueue(maxsize=maxsize, ring=FrameRing(slots))
+
+        return mp.Queue(maxsize=maxsize)
 
     def unlink(self, stream_id: str) -> None:
-        for key in set(self.input_queues.keys()):
-            if stream_id in key:
-                self.input_queues[key].close()
-                self.input_queues[key].join_thread()
-                del self.input_queues[key]
-
-        for key in set(self._output_queues.keys()):
-            if stream_id in key:
-                self._output_queues[key].close()
-                self._output_queues[key].join_thread()
-                del self._output_queues[key]
+        """Remove the input and the outputs of a stream, the stage stops once it has no queues left."""
+        if stream_id in self.input_queues:
+            self.unlink_input(stream_id)
+
+        for key in [key for key in self._output_queues if self._output_streams.get(key, key) == stream_id]:
+            self.unlink_output(key)
 
         if len(self.input_queues) == 0 and len(self._output_queues) == 0:
             self.stop()
             self.join()
 
-    def start(self):
+    def unlink_input(self, key: str) -> None:
+        with self._links_lock:
+            queue = self.input_queues.pop(key)
+            self._upstream.pop(key, None)
+            self._reorder_buffers.pop(key, None)
+            self._input_credits.pop(key, None)
+        queue.close()
+        queue.join_thread()
+
+    def unlink_output(self, key: str) -> None:
+        # Taken out of the dictionaries first, the workers stop putting to the queue before it is closed
+        with self._links_lock:
+            queue = self._output_queues.pop(key)
+            self._downstream.pop(key, None)
+            self._output_streams.pop(key, None)
+            self._overflow_guards.pop(key, None)
+            self._output_credits.pop(key, None)
+        queue.close()
+        queue.join_thread()
+
+    def start(self, hold: bool = False):
+        """Start the workers, with hold=True they wait for release() after pre_run()."""
         self._running.set()
-        self._worker.start()
+        if not hold:
+            self._released.set()
+
+        self._init_metrics()
+        if self._fused_head is not None:
+            # The worker is shared with the head of the fused chain, which starts it
+            return
+
+        for stage in self._fused_chain()[1:]:
+            stage._running.set()
+            stage._init_metrics()
+
+        for worker in self._workers:
+            worker.start()
 
     def stop(self):
+        """Stop the workers, they send the end of stream to the linked stages when they leave."""
         logger.info(f"Stopping {self.__class__.__name__}")
         self._running.clear()
-        time.sleep(0.1)
 
-    def join(self):
-        if self._worker:
-            self._worker.join(timeout=self._queue_timeout * 2)
+    def join(self, timeout: float | None = None):
+        """Wait for the workers, terminating the ones still alive after timeout (by default 2 * queue_timeout)."""
+        terminated = [self._join_worker(worker, timeout) for worker in self._workers]
+
+        if any(terminated):
+            # Nobody reads the input queues any more, the feeder threads writing to them must not hold up the exit
+            with self._links_lock:
+                input_queues = list(self.input_queues.values())
+            for queue in input_queues:
+                queue.cancel_join_thread()
+
+        logger.info(f"Stopped {self.__class__.__name__}")
 
-            if self._worker.is_alive():
-                logger.warning(f"Worker in {self.__class__.__name__} did not stop gracefully")
-                if self._stage_executor == StageExecutor.PROCESS:
-                    self._worker.terminate()
-                self._worker.join(timeout=self._queue_timeout * 2)
+    def _join_worker(self, worker, timeout: float | None = None) -> bool:
+        """Join a worker, return whether its process had to be terminated."""
+        timeout = self._queue_timeout * 2 if timeout is None else timeout
+        worker.join(timeout=timeout)
+
+        if not worker.is_alive():
+            return False
+
+        logger.warning(f"Worker in {self.__class__.__name__} did not stop gracefully")
+        if self._stage_executor == StageExecutor.PROCESS:
+            worker.terminate()
+            worker.join(timeout=REAP_TIMEOUT)
+        else:
+            worker.join(timeout=timeout)
 
-                if self._worker.is_alive():
-                    logger.error(f"Worker in {self.__class__.__name__} is still alive, will be killed")
-                    if self._stage_executor == StageExecutor.PROCESS:
-                        self._worker.kill()
+        if worker.is_alive():
+            logger.error(f"Worker in {self.__class__.__name__} is still alive, will be killed")
+            if self._stage_executor == StageExecutor.PROCESS:
+                worker.kill()
+                worker.join(timeout=REAP_TIMEOUT)
 
-            logger.info(f"Stopped {self.__class__.__name__}")
+        return self._stage_executor == StageExecutor.PROCESS
 
     # def poison_pill(self):
     #     """Poison the stage and the stages linked in output."""
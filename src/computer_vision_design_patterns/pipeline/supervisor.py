@@ -0,0 +1,153 @@
+# -*- coding: utf-8 -*-
+from __future__ import annotations
+
+import threading
+import time
+from collections import deque
+from dataclasses import dataclass
+from typing import TYPE_CHECKING
+
+from loguru import logger
+
+from computer_vision_design_patterns.pipeline.stage import Stage, StageExecutor
+
+if TYPE_CHECKING:
+    from computer_vision_design_patterns.pipeline.pipeline import Pipeline
+
+
+@dataclass(frozen=True, slots=True)
+class RestartPolicy:
+    """
+    When the supervisor of a pipeline restarts the worker of a stage.
+
+    A worker is restarted when it dies without leaving its loop, for example on a segfault in a native library, or
+    when a process() call lasts more than 'process_deadline' seconds (None disables the watchdog). A stage can be
+    restarted at most 'max_restarts' times within 'window' seconds, then the supervisor gives up on it: the stage is
+    stopped and its linked stages receive the end of stream. The workers are checked every 'check_interval' seconds.
+    """
+
+    max_restarts: int = 3
+    window: float = 60.0
+    process_deadline: float | None = None
+    check_interval: float = 0.05
+
+    def __post_init__(self):
+        if self.max_restarts < 0:
+            raise ValueError(f"Invalid number of restarts: {self.max_restarts}")
+        if self.process_deadline is not None and self.process_deadline <= 0:
+            raise ValueError(f"Invalid process deadline: {self.process_deadline}")
+
+
+class Supervisor:
+    """
+    Thread watching the workers of the running stages of a pipeline and restarting the crashed or hung ones.
+
+    The new worker runs pre_run() again, the payload the old one was processing is lost. A THREAD worker takes over
+    the queues of the old one. A PROCESS worker gets new queues, as the dead one may have left their locks held or
+    half a payload in their pipes, and the payloads still queued to and from it are lost too. A hung THREAD worker
+    cannot be killed: it is reported, and restarted only if it dies. The fused and the ASYNCIO stages are not
+    supervised.
+    """
+
+    def __init__(self, pipeline: Pipeline, policy: RestartPolicy | None = None):
+        self._pipeline = pipeline
+        self._policy = policy if policy is not None else RestartPolicy()
+
+        # Time of the recent restarts of each stage, and the stages given up
+        self._restarts: dict[Stage, deque[float]] = {}
+        self._given_up: set[Stage] = set()
+        self._reported_hangs: set[tuple[Stage, int, float]] = set()
+
+        self._stop = threading.Event()
+        self._thread: threading.Thread | None = None
+
+    def start(self):
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._watch, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def given_up(self) -> list[Stage]:
+        return list(self._given_up)
+
+    def _watch(self):
+        while not self._stop.wait(self._policy.check_interval):
+            for stage in list(self._pipeline.stages):
+                try:
+                    self.check(stage)
+                except Exception as e:
+                    logger.exception(e)
+
+    def check(self, stage: Stage) -> None:
+        """Restart the crashed and hung workers of a stage, within the restart budget."""
+        if (
+            stage in self._given_up
+            or not stage._running.is_set()
+            or stage._fused_head is not None
+            or stage._fused_next is not None
+        ):
+            return
+
+        for replica in stage.crashed_workers():
+            self._restart(stage, replica, "died")
+
+        deadline = self._policy.process_deadline
+        if deadline is None:
+            return
+
+        for replica in range(len(stage._workers)):
+            busy_time = stage.busy_time(replica)
+            if busy_time <= deadline or stage in self._given_up:
+                continue
+
+            if stage.executor == StageExecutor.PROCESS:
+                self._restart(stage, replica, f"spent {busy_time:.2f} s in process()")
+                continue
+
+            # Reported once for each call, identified by the time it started
+            hang = (stage, replica, stage._busy_since[replica])
+            if hang not in self._reported_hangs:
+                self._reported_hangs.add(hang)
+                logger.error(
+                    f"Worker {replica} of {stage.name} hung for {busy_time:.2f} s in process(), cannot kill it"
+                )
+
+    def _restart(self, stage: Stage, replica: int, reason: str):
+        now = time.monotonic()
+        restarts = self._restarts.setdefault(stage, deque())
+        while restarts and now - restarts[0] > self._policy.window:
+            restarts.popleft()
+
+        if len(restarts) >= self._policy.max_restarts:
+            self._give_up(stage, replica, reason)
+            return
+
+        restarts.append(now)
+        logger.warning(f"Worker {replica} of {stage.name} {reason}, restarting it")
+        stage.restart_worker(replica)
+
+    def _give_up(self, stage: Stage, replica: int, reason: str):
+        logger.error(f"Worker {replica} of {stage.name} {reason}, too many restarts: stopping the stage")
+        self._given_up.add(stage)
+        stage.stop()
+
+        for dead in range(len(stage._workers)):
+            worker = stage._workers[dead]
+            if worker.is_alive() and dead == replica and stage.executor == StageExecutor.PROCESS:
+                # Hung in process(), it would never leave
+                worker.kill()
+                worker.join()
+
+            if not worker.is_alive() and not stage._completed[dead]:
+                # The dead worker cannot send the end of stream, if it is the last one to leave it is sent for it
+                stage._completed[dead] = 1
+                if stage._finish_worker():
+                    stage._send_end_of_stream()
+                else:
+                    # Nothing buffered is left to wait for
+                    stage._worker_flushed()
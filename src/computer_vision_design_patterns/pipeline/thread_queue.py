@@ -0,0 +1,50 @@
+# -*- coding: utf-8 -*-
+from __future__ import annotations
+
+from queue import Queue
+from typing import Callable
+
+
+class ThreadQueue(Queue):
+    """
+    Queue with the same interface of `mp.Queue` for links between stages running in the same process.
+
+    Payloads are passed by reference: there is no feeder thread, no pipe and no pickling. Listeners are called after
+    every put, so a consumer can wait on many queues at once.
+    """
+
+    def __init__(self, maxsize: int = 0):
+        Queue.__init__(self, maxsize=maxsize)
+        self._closed = False
+        self._listeners: list[Callable[[], None]] = []
+
+    def add_listener(self, listener: Callable[[], None]) -> None:
+        self._listeners.append(listener)
+
+    def remove_listener(self, listener: Callable[[], None]) -> None:
+        if listener in self._listeners:
+            self._listeners.remove(listener)
+
+    def put(self, item, block: bool = True, timeout: float | None = None) -> None:
+        self._check_closed()
+        Queue.put(self, item, block, timeout)
+
+        for listener in self._listeners:
+            listener()
+
+    def get(self, block: bool = True, timeout: float | None = None):
+        self._check_closed()
+        return Queue.get(self, block, timeout)
+
+    def close(self) -> None:
+        self._closed = True
+
+    def join_thread(self) -> None:
+        pass
+
+    def cancel_join_thread(self) -> None:
+        pass
+
+    def _check_closed(self):
+        if self._closed:
+            raise ValueError(f"Queue {self!r} is closed")
@@ -0,0 +1,79 @@
+# -*- coding: utf-8 -*-
+from __future__ import annotations
+
+import time
+from array import array
+
+# Hops past the limit are not recorded, the trace keeps a fixed size
+MAX_HOPS = 8
+
+
+class Trace:
+    """
+    Timestamps of the stages a payload went through, for each hop: when the stage started processing it, when the
+    stage finished and when the output has been put to the next queue.
+
+    The times come from time.monotonic(), which is system wide, so they can be compared across processes. A trace
+    pickles to less than 300 bytes.
+    """
+
+    __slots__ = ("_times", "_hops")
+
+    def __init__(self):
+        self._times = array("d", bytes(8 * 3 * MAX_HOPS))
+        self._hops = 0
+
+    def __len__(self) -> int:
+        return self._hops
+
+    def __getstate__(self):
+        return self._times.tobytes(), self._hops
+
+    def __setstate__(self, state):
+        times, self._hops = state
+        self._times = array("d")
+        self._times.frombytes(times)
+
+    @property
+    def origin(self) -> float:
+        """Time the source started producing the payload."""
+        return self._times[0]
+
+    @property
+    def enqueued(self) -> float:
+        """Time the payload has been put to the queue of the stage that is processing it."""
+        return self._times[3 * self._hops - 1] if self._hops else self.origin
+
+    def add_hop(self, started: float, ended: float) -> None:
+        if self._hops == MAX_HOPS:
+            return
+
+        index = 3 * self._hops
+        self._times[index] = started
+        self._times[index + 1] = ended
+        # Fused stages hand the payload over without a queue
+        self._times[index + 2] = ended
+        self._hops += 1
+
+    def mark_enqueued(self, when: float | None = None) -> None:
+        if self._hops:
+            self._times[3 * self._hops - 1] = time.monotonic() if when is None else when
+
+    def copy(self) -> Trace:
+        trace = Trace.__new__(Trace)
+        trace._times = array("d", self._times)
+        trace._hops = self._hops
+        return trace
+
+    def hops(self) -> list[tuple[float, float, float]]:
+        """(started, ended, enqueued) of each hop."""
+        return [tuple(self._times[3 * hop : 3 * hop + 3]) for hop in range(self._hops)]
+
+    def latencies(self) -> list[tuple[float, float]]:
+        """(queue wait, processing time) of each hop, in seconds."""
+        latencies = []
+        enqueued = self.origin
+        for started, ended, next_enqueued in self.hops():
+            latencies.append((started - enqueued, ended - started))
+            enqueued = next_enqueued
+        return latencies
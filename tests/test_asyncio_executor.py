@@ -0,0 +1,120 @@
+# -*- coding: utf-8 -*-
+import asyncio
+import time
+
+import pytest
+
+from computer_vision_design_patterns.pipeline import Payload, Pipeline, Stage
+from computer_vision_design_patterns.pipeline.asyncio_executor import AsyncioWorker, EventLoopThread, resolve
+from computer_vision_design_patterns.pipeline.stage import StageExecutor, StageType
+from computer_vision_design_patterns.pipeline.thread_queue import ThreadQueue
+
+
+@pytest.fixture
+def event_loop_thread():
+    event_loop = EventLoopThread()
+    yield event_loop
+    event_loop.stop(timeout=1.0)
+
+
+def test_event_loop_thread_runs_coroutines(event_loop_thread):
+    async def answer():
+        return 42
+
+    assert event_loop_thread.submit(answer()).result(timeout=1.0) == 42
+    assert event_loop_thread.is_running()
+
+
+def test_event_loop_thread_stop(event_loop_thread):
+    event_loop_thread.start()
+    event_loop_thread.stop(timeout=1.0)
+    assert not event_loop_thread.is_running()
+
+
+def test_asyncio_worker_lifecycle(event_loop_thread):
+    async def work():
+        await asyncio.sleep(0.02)
+
+    worker = AsyncioWorker(work)
+    worker.event_loop = event_loop_thread
+    assert not worker.is_alive()
+
+    worker.start()
+    assert worker.is_alive()
+    worker.join(timeout=1.0)
+    assert not worker.is_alive()
+
+    with pytest.raises(RuntimeError):
+        worker.start()
+
+
+def test_resolve_sync_and_async_results(event_loop_thread):
+    async def value():
+        return 1
+
+    async def both():
+        return await resolve(value()), await resolve(2)
+
+    assert event_loop_thread.submit(both()).result(timeout=1.0) == (1, 2)
+
+
+class CounterSource(Stage):
+    def __init__(self):
+        Stage.__init__(self, stage_type=StageType.One2One, stage_executor=StageExecutor.THREAD)
+        self.sent = 0
+
+    def pre_run(self):
+        pass
+
+    def post_run(self):
+        pass
+
+    def process(self, key: str, payload: Payload | None) -> Payload | None:
+        if self.sent >= 5:
+            time.sleep(0.01)
+            return None
+        self.sent += 1
+        return Payload()
+
+
+class AsyncSink(Stage):
+    def __init__(self):
+        Stage.__init__(self, stage_type=StageType.One2One, stage_executor=StageExecutor.ASYNCIO, queue_timeout=0.01)
+        self.received = []
+        self.lifecycle = []
+
+    async def pre_run(self):
+        self.lifecycle.append("pre_run")
+
+    def post_run(self):
+        self.lifecycle.append("post_run")
+
+    async def process(self, key: str, payload: Payload | None) -> Payload | None:
+        if payload is not None:
+            await asyncio.sleep(0)
+            self.received.append(payload.sequence)
+        return None
+
+
+def test_asyncio_stages_in_pipeline():
+    pipeline = Pipeline()
+    source = CounterSource()
+    sinks = [AsyncSink() for _ in range(3)]
+    pipeline.add_stage(source)
+    for i, sink in enumerate(sinks):
+        pipeline.add_stage(sink)
+
+    # A One2One source has a single output, the other sinks only idle on the shared loop
+    pipeline.link_stages(source, sinks[0], "stream")
+    assert isinstance(sinks[0].input_queues["stream"], ThreadQueue)
+
+    pipeline.start()
+    event_loop = pipeline._event_loop
+    deadline = time.monotonic() + 5
+    while len(sinks[0].received) < 5 and time.monotonic() < deadline:
+        time.sleep(0.01)
+    pipeline.stop()
+
+    assert sinks[0].received == [0, 1, 2, 3, 4]
+    assert all(sink.lifecycle == ["pre_run", "post_run"] for sink in sinks)
+    assert not event_loop.is_running()
@@ -0,0 +1,74 @@
+# -*- coding: utf-8 -*-
+import gc
+
+import numpy as np
+import pytest
+
+from computer_vision_design_patterns.pipeline.buffer_pool import BufferPool
+from computer_vision_design_patterns.pipeline.sample_stage import RGB2GRAYStage
+from computer_vision_design_patterns.pipeline.sample_stage.SimpleStreamStage import VideoStreamOutput
+from computer_vision_design_patterns.pipeline.stage import StageExecutor
+
+
+def test_buffer_is_reused_once_collected():
+    pool = BufferPool()
+    first = pool.take((4, 4), np.uint8)
+    address = first.__array_interface__["data"][0]
+    del first
+    gc.collect()
+
+    second = pool.take((4, 4), np.uint8)
+    assert second.__array_interface__["data"][0] == address
+    assert pool.stats() == {"hits": 1, "misses": 1, "hit_rate": 0.5, "free": 0}
+
+
+def test_buffers_are_keyed_by_shape_and_dtype():
+    pool = BufferPool()
+    pool.take((4, 4), np.uint8)
+    gc.collect()
+
+    other_dtype, other_shape = pool.take((4, 4), np.float32), pool.take((2, 8), np.uint8)
+    assert (other_dtype.dtype, other_shape.shape) == (np.float32, (2, 8))
+    assert pool.stats()["misses"] == 3
+    assert pool.free_buffers() == 1
+
+
+def test_views_keep_the_buffer_taken():
+    pool = BufferPool()
+    array = pool.take((4, 4))
+    row = array[1]
+    del array
+    gc.collect()
+    assert pool.free_buffers() == 0
+
+    del row
+    gc.collect()
+    assert pool.free_buffers() == 1
+
+
+def test_max_free_buffers():
+    pool = BufferPool(max_free=1)
+    arrays = [pool.take((4, 4)) for _ in range(3)]
+    del arrays
+    gc.collect()
+    assert pool.free_buffers() == 1
+
+    with pytest.raises(ValueError):
+        BufferPool(max_free=-1)
+
+
+def test_rgb2gray_outputs_come_from_the_pool():
+    stage = RGB2GRAYStage(StageExecutor.THREAD)
+    frame = np.random.default_rng(0).integers(0, 256, (8, 8, 3), dtype=np.uint8)
+
+    for _ in range(3):
+        gray = stage.process("a", VideoStreamOutput(frame=frame)).frame
+        assert gray.shape == (8, 8)
+        del gray
+        gc.collect()
+
+    batch = stage.process_batch("a", [VideoStreamOutput(frame=frame) for _ in range(2)])
+    np.testing.assert_array_equal(batch[0].frame, batch[1].frame)
+
+    stats = stage.stats()["buffer_pool"]
+    assert (stats["hits"], stats["misses"]) == (2, 2)
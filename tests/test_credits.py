@@ -0,0 +1,123 @@
+# -*- coding: utf-8 -*-
+import threading
+import time
+
+import pytest
+
+from computer_vision_design_patterns.pipeline import Payload, Pipeline, Stage
+from computer_vision_design_patterns.pipeline.credits import CreditGate
+from computer_vision_design_patterns.pipeline.stage import StageExecutor, StageType
+
+
+class CountingSource(Stage):
+    def __init__(self, stage_executor: StageExecutor = StageExecutor.THREAD):
+        Stage.__init__(self, StageType.One2One, stage_executor, queue_timeout=0.01)
+        self.produced = 0
+
+    def pre_run(self):
+        pass
+
+    def post_run(self):
+        pass
+
+    def process(self, key: str, payload: Payload | None) -> Payload | None:
+        self.produced += 1
+        return Payload()
+
+
+class SlowStage(Stage):
+    def __init__(self, delay: float, credits: int | None, stage_executor: StageExecutor = StageExecutor.THREAD):
+        Stage.__init__(self, StageType.One2One, stage_executor, queue_timeout=0.01, credits=credits)
+        self.delay = delay
+        self.received = 0
+
+    def pre_run(self):
+        pass
+
+    def post_run(self):
+        pass
+
+    def process(self, key: str, payload: Payload | None) -> Payload | None:
+        if payload is None:
+            return None
+        self.received += 1
+        time.sleep(self.delay)
+        return payload
+
+
+def run(stages: list[Stage], duration: float = 0.3) -> Pipeline:
+    pipeline = Pipeline()
+    pipeline.stages = stages
+    for from_stage, to_stage in zip(stages, stages[1:]):
+        Pipeline.link_stages(from_stage, to_stage, "stream")
+
+    pipeline.start()
+    time.sleep(duration)
+    pipeline.stop()
+    return pipeline
+
+
+def test_gate_bounds_the_credits():
+    gate = CreditGate(2)
+    assert gate.acquire(0)
+    assert gate.acquire(0)
+    assert not gate.acquire(0.01)
+
+    gate.release()
+    assert gate.acquire(0)
+
+
+def test_gate_wait_returns_when_stopped():
+    gate = CreditGate(1)
+    running = threading.Event()
+    running.set()
+    assert gate.wait(0.01, running)
+
+    threading.Timer(0.05, running.clear).start()
+    assert not gate.wait(0.01, running)
+
+
+def test_invalid_credits():
+    with pytest.raises(ValueError):
+        CreditGate(0)
+
+    with pytest.raises(ValueError):
+        SlowStage(0.0, credits=0)
+
+
+def test_source_skips_frames_without_credits():
+    source = CountingSource()
+    sink = SlowStage(0.02, credits=2)
+    run([source, sink])
+
+    # Without credits the source would have produced thousands of frames for the overflow policy to drop
+    assert source.produced <= sink.received + 2
+    assert source.stats()["throttled"]["stream"] > 0
+    assert sum(source.dropped().values()) == 0
+
+
+def test_backpressure_propagates_to_the_source():
+    source = CountingSource()
+    middle = SlowStage(0.0, credits=2)
+    sink = SlowStage(0.02, credits=2)
+    run([source, middle, sink])
+
+    assert source.produced <= sink.received + 2 + 2 + 2
+    assert sum(middle.dropped().values()) == 0
+    assert source.throttled()["stream"] > 0
+
+
+def test_credits_across_processes():
+    source = CountingSource()
+    sink = SlowStage(0.02, credits=3, stage_executor=StageExecutor.PROCESS)
+    run([source, sink])
+
+    assert source.throttled()["stream"] > 0
+    assert source.produced <= sink.stats()["calls"] + 3
+
+
+def test_asyncio_producers_cannot_wait_for_credits():
+    source = CountingSource(StageExecutor.ASYNCIO)
+
+    with pytest.raises(ValueError):
+        source.link(SlowStage(0.0, credits=1), "stream")
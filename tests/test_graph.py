@@ -0,0 +1,171 @@
+# -*- coding: utf-8 -*-
+import time
+
+import pytest
+
+from computer_vision_design_patterns.pipeline import Payload, Stage
+from computer_vision_design_patterns.pipeline.graph import PipelineGraph
+from computer_vision_design_patterns.pipeline.overflow import OverflowAction
+from computer_vision_design_patterns.pipeline.sample_stage import RGB2GRAYStage, SwitchStage, SyntheticStreamStage
+from computer_vision_design_patterns.pipeline.stage import StageExecutor, StageType
+
+
+class CountingSink(Stage):
+    def __init__(self, stage_type: StageType = StageType.Many2Many):
+        Stage.__init__(self, stage_type=stage_type, stage_executor=StageExecutor.THREAD, queue_timeout=0.01)
+        self.received = 0
+
+    def pre_run(self):
+        pass
+
+    def post_run(self):
+        pass
+
+    def process(self, key: str, payload: Payload | None) -> Payload | None:
+        if payload is not None:
+            self.received += 1
+        return None
+
+
+def spec(links: list[tuple[str, str, str]], **stages) -> dict:
+    return {"stages": stages, "links": [{"from": f, "to": t, "key": key} for f, t, key in links]}
+
+
+def test_build_from_dict():
+    sink = CountingSink()
+    graph = PipelineGraph.from_dict(
+        {
+            "stages": {
+                "sink": sink,
+                "switch": {"type": "SwitchStage", "stage_executor": "thread"},
+                "gray": {"type": "RGB2GRAYStage", "stage_executor": "THREAD"},
+                "camera": {"type": "SyntheticStreamStage", "stage_executor": "THREAD", "resolution": [32, 24]},
+            },
+            "links": [
+                {"from": "camera", "to": "gray", "key": "stream1", "overflow_policy": "drop_newest"},
+                {"from": "gray", "to": "switch", "key": "stream1"},
+                {"from": "switch", "to": "sink", "key": "stream1"},
+            ],
+            "pipeline": {"stop_timeout": 1.0},
+        }
+    )
+
+    assert graph.topological_order() == ["camera", "gray", "switch", "sink"]
+    assert isinstance(graph.stages["camera"], SyntheticStreamStage)
+    assert graph.stages["camera"].shape == (24, 32, 3)
+    assert graph.links[0].overflow_policy.action == OverflowAction.DROP_NEWEST
+
+    pipeline = graph.build()
+    assert [type(stage) for stage in pipeline.stages] == [
+        SyntheticStreamStage,
+        RGB2GRAYStage,
+        SwitchStage,
+        CountingSink,
+    ]
+    assert [link.output_key for link in pipeline.streams.links("stream1")] == ["stream1", "stream1", "stream1-0"]
+
+    pipeline.start()
+    time.sleep(0.2)
+    pipeline.stop()
+    assert sink.received > 0
+
+
+def test_build_from_toml(tmp_path):
+    pytest.importorskip("tomllib")
+    path = tmp_path / "graph.toml"
+    path.write_text(
+        """
+[pipeline]
+fuse = true
+
+[stages.camera]
+type = "computer_vision_design_patterns.pipeline.sample_stage.SyntheticStreamStage"
+stage_executor = "THREAD"
+
+[stages.switch]
+type = "SwitchStage"
+stage_executor = "THREAD"
+
+[[links]]
+from = "camera"
+to = "switch"
+key = "stream"
+overflow_policy = { action = "keep_every_nth", nth = 3 }
+"""
+    )
+
+    graph = PipelineGraph.from_toml(str(path))
+
+    assert graph.pipeline_options == {"fuse": True}
+    assert graph.topological_order() == ["camera", "switch"]
+    assert graph.links[0].overflow_policy.nth == 3
+
+
+def test_build_from_yaml(tmp_path):
+    pytest.importorskip("yaml")
+    path = tmp_path / "graph.yaml"
+    path.write_text(
+        """
+stages:
+  camera: {type: SyntheticStreamStage, stage_executor: THREAD}
+  switch: {type: SwitchStage, stage_executor: THREAD}
+links:
+  - {from: camera, to: switch, key: stream}
+"""
+    )
+
+    assert PipelineGraph.from_yaml(str(path)).topological_order() == ["camera", "switch"]
+
+
+def validation_errors(graph: PipelineGraph) -> str:
+    with pytest.raises(ValueError) as e:
+        graph.validate()
+    return str(e.value)
+
+
+def test_cycles_are_rejected():
+    graph = PipelineGraph.from_dict(
+        spec([("a", "b", "s"), ("b", "a", "s")], a=CountingSink(), b=CountingSink(), c=CountingSink())
+    )
+
+    assert "Cycle" in validation_errors(graph)
+
+
+def test_cardinalities_are_checked_before_linking():
+    sink = CountingSink(StageType.One2One)
+    graph = PipelineGraph.from_dict(
+        spec([("a", "sink", "s1"), ("b", "sink", "s2")], a=CountingSink(), b=CountingSink(), sink=sink)
+    )
+
+    errors = validation_errors(graph)
+    assert "sink is One2One and has 2 inputs" in errors
+    assert not sink.input_queues
+
+
+def test_dangling_outputs_are_rejected():
+    graph = PipelineGraph.from_dict(
+        spec(
+            [("source", "gray", "s1"), ("gray", "sink", "s2"), ("gray", "sink", "s2")],
+            source=CountingSink(),
+            gray=CountingSink(),
+            sink=CountingSink(),
+            unused=CountingSink(),
+        )
+    )
+
+    errors = validation_errors(graph)
+    assert "gray has no output for s1" in errors
+    assert "gray has more than one output on s2" in errors
+    assert "sink has more than one input on s2" in errors
+    assert "unused is not linked" in errors
+
+
+def test_invalid_specs():
+    with pytest.raises(ValueError, match="unknown type"):
+        PipelineGraph.from_dict({"stages": {"a": {"type": "NoSuchStage"}}})
+
+    with pytest.raises(ValueError, match="no key"):
+        PipelineGraph.from_dict({"links": [{"from": "a", "to": "b"}]})
+
+    graph = PipelineGraph.from_dict(spec([("a", "b", "s")], a=CountingSink()))
+    assert "Unknown stages: b" in validation_errors(graph)
@@ -0,0 +1,71 @@
+# -*- coding: utf-8 -*-
+import multiprocessing as mp
+
+import pytest
+
+from computer_vision_design_patterns.pipeline.metrics import LATENCY_BUCKETS, StageMetrics
+
+
+def test_snapshot_sums_the_rows_of_the_workers():
+    metrics = StageMetrics(replicas=2, input_keys=["in"], output_keys=["out"])
+    metrics.record_call(0, 3_000)
+    metrics.record_call(1, 5_000)
+    metrics.record_error(1)
+    metrics.record_idle(0, 2_000)
+    metrics.record_input(0, "in", 2)
+    metrics.record_input(1, "unknown")
+    metrics.record_output(1, "out")
+
+    snapshot = metrics.snapshot()
+    assert snapshot["calls"] == 2
+    assert snapshot["errors"] == 1
+    assert snapshot["busy_time"] == pytest.approx(8e-6)
+    assert snapshot["utilization"] == pytest.approx(0.8)
+    assert snapshot["inputs"] == {"in": 2}
+    assert snapshot["outputs"] == {"out": 1}
+    assert len(snapshot["latency"]["histogram"]) == LATENCY_BUCKETS
+
+
+def test_latency_percentiles_are_bucket_upper_bounds():
+    metrics = StageMetrics(replicas=1, input_keys=[], output_keys=[])
+    for _ in range(99):
+        metrics.record_call(0, 3_000)
+    metrics.record_call(0, 100_000)
+
+    latency = metrics.snapshot()["latency"]
+    assert latency["p50"] == pytest.approx(4e-6)
+    assert latency["p99"] == pytest.approx(4e-6)
+    assert latency["histogram"][7] == 1
+
+
+def record_calls(metrics: StageMetrics, row: int):
+    for _ in range(100):
+        metrics.record_call(row, 1_000)
+
+
+def test_shared_metrics_are_written_by_processes():
+    metrics = StageMetrics(replicas=2, input_keys=[], output_keys=[], shared=True)
+    workers = [mp.Process(target=record_calls, args=(metrics, row)) for row in range(2)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+
+    assert metrics.snapshot()["calls"] == 200
+
+
+def test_with_keys_keeps_the_counters():
+    metrics = StageMetrics(replicas=2, input_keys=["a"], output_keys=["a"])
+    metrics.record_call(1, 3_000)
+    metrics.record_input(0, "a", 2)
+    metrics.record_output(1, "a")
+    metrics.record_trace(0, "a", 1e-3, 2e-3)
+
+    extended = metrics.with_keys(["a", "b"], ["b"])
+    extended.record_input(1, "b")
+
+    snapshot = extended.snapshot()
+    assert snapshot["calls"] == 1
+    assert snapshot["inputs"] == {"a": 2, "b": 1}
+    assert snapshot["outputs"] == {"a": 1, "b": 0}
+    assert snapshot["trace"]["a"] == metrics.snapshot()["trace"]["a"]
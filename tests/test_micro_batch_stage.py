@@ -0,0 +1,149 @@
+# -*- coding: utf-8 -*-
+import threading
+import time
+
+import numpy as np
+import pytest
+
+from computer_vision_design_patterns.pipeline import Payload, Stage
+from computer_vision_design_patterns.pipeline.sample_stage import MicroBatchStage
+from computer_vision_design_patterns.pipeline.sample_stage.MicroBatchStage import InferenceOutput
+from computer_vision_design_patterns.pipeline.sample_stage.SimpleStreamStage import VideoStreamOutput
+from computer_vision_design_patterns.pipeline.stage import StageExecutor, StageType
+
+
+class PassStage(Stage):
+    def __init__(self):
+        Stage.__init__(self, stage_type=StageType.Many2Many, stage_executor=StageExecutor.THREAD)
+
+    def pre_run(self):
+        pass
+
+    def post_run(self):
+        pass
+
+    def process(self, key: str, payload: Payload | None) -> Payload | None:
+        return payload
+
+
+class SumStage(MicroBatchStage):
+    def __init__(self, max_batch_size: int, max_latency: float, replicas: int = 1):
+        MicroBatchStage.__init__(
+            self, StageExecutor.THREAD, max_batch_size, max_latency, queue_timeout=0.01, replicas=replicas
+        )
+        self.batches = []
+
+    def pre_run(self):
+        pass
+
+    def post_run(self):
+        pass
+
+    def infer(self, batch: np.ndarray):
+        self.batches.append(batch)
+        return [int(frame.sum()) for frame in batch]
+
+
+@pytest.fixture
+def linked():
+    def build(stage: MicroBatchStage, keys: list[str]):
+        source, sink = PassStage(), PassStage()
+        for key in keys:
+            source.link(stage, key)
+            stage.link(sink, key)
+        return source, sink
+
+    return build
+
+
+def test_flush_on_batch_size(linked):
+    stage = SumStage(max_batch_size=3, max_latency=60.0)
+    source, sink = linked(stage, ["a", "b", "c"])
+
+    for i, key in enumerate(["a", "b", "c"]):
+        source.put_to_right(key, VideoStreamOutput(frame=np.full((2, 2, 3), i + 1, dtype=np.uint8)))
+
+    while len(stage.batches) == 0:
+        stage._process_stage()
+
+    assert stage.batches[0].shape == (3, 2, 2, 3)
+    for i, key in enumerate(["a", "b", "c"]):
+        output = sink.get_from_left(key)
+        assert isinstance(output, InferenceOutput)
+        assert output.result == (i + 1) * 12
+
+
+def test_flush_on_latency_deadline(linked):
+    stage = SumStage(max_batch_size=4, max_latency=0.02)
+    source, sink = linked(stage, ["a", "b"])
+    source.put_to_right("a", VideoStreamOutput(frame=np.ones((2, 2, 3), dtype=np.uint8)))
+
+    stage._process_stage()
+    assert stage.batches == []
+
+    time.sleep(0.03)
+    stage._process_stage()
+    assert len(stage.batches) == 1
+    assert sink.get_from_left("a").result == 12
+
+
+def test_keeps_latest_frame_per_stream(linked):
+    stage = SumStage(max_batch_size=2, max_latency=60.0)
+    source, sink = linked(stage, ["a", "b"])
+    source.put_to_right("a", VideoStreamOutput(frame=np.zeros((2, 2, 3), dtype=np.uint8)))
+    source.put_to_right("a", VideoStreamOutput(frame=np.ones((2, 2, 3), dtype=np.uint8)))
+
+    for _ in range(3):
+        stage._process_stage()
+    source.put_to_right("b", VideoStreamOutput(frame=np.ones((2, 2, 3), dtype=np.uint8)))
+    stage._process_stage()
+
+    assert len(stage.batches) == 1
+    assert sink.get_from_left("a").result == 12
+
+
+def test_batch_array_is_preallocated(linked):
+    stage = SumStage(max_batch_size=1, max_latency=60.0)
+    source, _ = linked(stage, ["a"])
+
+    for _ in range(2):
+        source.put_to_right("a", VideoStreamOutput(frame=np.ones((2, 2, 3), dtype=np.uint8)))
+        stage._process_stage()
+
+    assert stage.batches[0].base is stage.batches[1].base
+
+
+def test_replicas_batch_on_their_own(linked):
+    stage = SumStage(max_batch_size=2, max_latency=60.0, replicas=2)
+    source, _ = linked(stage, ["a", "b"])
+    source.put_to_right("a", VideoStreamOutput(frame=np.ones((2, 2, 3), dtype=np.uint8)))
+    stage._process_stage()
+
+    def second_replica():
+        stage._metric_rows[threading.get_ident()] = 1
+        source.put_to_right("b", VideoStreamOutput(frame=np.ones((2, 2, 3), dtype=np.uint8)))
+        stage._process_stage()
+
+    thread = threading.Thread(target=second_replica)
+    thread.start()
+    thread.join()
+
+    # Each replica holds a single frame, neither batch is full
+    assert stage.batches == []
+    assert [len(state.pending) for state in stage._batch_states.values()] == [1, 1]
+
+
+class ShortStage(SumStage):
+    def infer(self, batch: np.ndarray):
+        return SumStage.infer(self, batch)[:-1]
+
+
+def test_missing_results_raise(linked):
+    stage = ShortStage(max_batch_size=2, max_latency=60.0)
+    source, _ = linked(stage, ["a", "b"])
+    for key in ["a", "b"]:
+        source.put_to_right(key, VideoStreamOutput(frame=np.ones((2, 2, 3), dtype=np.uint8)))
+
+    with pytest.raises(ValueError):
+        while not stage.batches:
+            stage._process_stage()
@@ -0,0 +1,116 @@
+# -*- coding: utf-8 -*-
+import multiprocessing as mp
+import threading
+from queue import Empty
+
+import pytest
+
+from computer_vision_design_patterns.pipeline.overflow import OverflowAction, OverflowGuard, OverflowPolicy
+from computer_vision_design_patterns.pipeline.thread_queue import ThreadQueue
+
+
+def drain(queue) -> list:
+    items = []
+    while True:
+        try:
+            items.append(queue.get(timeout=0.05))
+        except Empty:
+            return items
+
+
+def fill(guard: OverflowGuard, queue, count: int, timeout: float = 0.01):
+    for i in range(count):
+        guard.put(queue, i, timeout)
+
+
+def test_invalid_nth():
+    with pytest.raises(ValueError):
+        OverflowPolicy(OverflowAction.KEEP_EVERY_NTH, nth=0)
+
+
+def test_drop_newest_keeps_queued_payloads():
+    guard = OverflowGuard(OverflowPolicy(OverflowAction.DROP_NEWEST))
+    queue = ThreadQueue(maxsize=2)
+    fill(guard, queue, 5)
+    assert drain(queue) == [0, 1]
+    assert guard.dropped == 3
+
+
+def test_drop_oldest_keeps_latest_payloads():
+    guard = OverflowGuard(OverflowPolicy(OverflowAction.DROP_OLDEST))
+    queue = ThreadQueue(maxsize=2)
+    fill(guard, queue, 5)
+    assert drain(queue) == [3, 4]
+    assert guard.dropped == 3
+
+
+def test_latest_only_never_waits():
+    guard = OverflowGuard(OverflowPolicy(OverflowAction.LATEST_ONLY))
+    queue = ThreadQueue(maxsize=1)
+    fill(guard, queue, 5, timeout=10)
+    assert drain(queue) == [4]
+    assert guard.dropped == 4
+
+
+def test_keep_every_nth_replaces_one_payload_every_nth_overflow():
+    guard = OverflowGuard(OverflowPolicy(OverflowAction.KEEP_EVERY_NTH, nth=3))
+    queue = ThreadQueue(maxsize=1)
+    fill(guard, queue, 7)
+    # Overflows are 1..6, the 3rd and the 6th replace the queued payload
+    assert drain(queue) == [6]
+    assert guard.dropped == 6
+
+
+def test_block_waits_for_room():
+    guard = OverflowGuard(OverflowPolicy(OverflowAction.BLOCK))
+    queue = ThreadQueue(maxsize=1)
+    running = threading.Event()
+    running.set()
+    guard.put(queue, 0, 0.01, running)
+
+    consumer = threading.Timer(0.05, queue.get)
+    consumer.start()
+    guard.put(queue, 1, 0.01, running)
+    consumer.join()
+
+    assert drain(queue) == [1]
+    assert guard.dropped == 0
+
+
+def test_no_timeout_waits_for_room():
+    guard = OverflowGuard(OverflowPolicy(OverflowAction.DROP_NEWEST))
+    queue = ThreadQueue(maxsize=1)
+    guard.put(queue, 0, None)
+
+    consumer = threading.Timer(0.05, queue.get)
+    consumer.start()
+    guard.put(queue, 1, None)
+    consumer.join()
+
+    latest = OverflowGuard(OverflowPolicy(OverflowAction.LATEST_ONLY))
+    latest.put(queue, 2, None)
+
+    assert drain(queue) == [2]
+    assert guard.dropped == 0
+    assert latest.dropped == 1
+
+
+def test_block_drops_when_not_running():
+    guard = OverflowGuard(OverflowPolicy(OverflowAction.BLOCK))
+    queue = ThreadQueue(maxsize=1)
+    fill(guard, queue, 2)
+    assert drain(queue) == [0]
+    assert guard.dropped == 1
+
+
+def test_drops_are_counted_across_processes():
+    guard = OverflowGuard(OverflowPolicy(OverflowAction.DROP_OLDEST), shared=True)
+    queue = mp.Queue(maxsize=4)
+    producers = [mp.Process(target=fill, args=(guard, queue, 50, 0.0)) for _ in range(4)]
+    for producer in producers:
+        producer.start()
+    for producer in producers:
+        producer.join()
+
+    assert guard.dropped + len(drain(queue)) == 200
+    assert guard.dropped >= 196
@@ -1,10 +1,13 @@
 # -*- coding: utf-8 -*-
 
+import signal
+import time
 from unittest.mock import Mock
 
 import pytest
 
-from computer_vision_design_patterns.pipeline import Pipeline, Stage
+from computer_vision_design_patterns.pipeline import Payload, Pipeline, Stage
+from computer_vision_design_patterns.pipeline.stage import StageExecutor, StageType
 
 
 @pytest.fixture
@@ -53,19 +56,26 @@ def test_unlink_removes_dead_stages(pipeline):
 
 def test_start(pipeline, mock_stage):
     mock_stage.is_alive.return_value = False
+    mock_stage.upstream_stages.return_value = []
     pipeline.stages = [mock_stage, mock_stage]
     pipeline.start()
     assert mock_stage.start.call_count == 2
+    mock_stage.start.assert_called_with(hold=True)
+    assert mock_stage.release.call_count == 2
 
 
 def test_stop(pipeline, mock_stage):
+    mock_stage.is_alive.return_value = False
+    mock_stage.upstream_stages.return_value = []
     pipeline.stages = [mock_stage, mock_stage]
     pipeline.stop()
+    assert mock_stage.drain_until.call_count == 2
     assert mock_stage.stop.call_count == 2
     assert mock_stage.join.call_count == 2
 
 
 def test_stop_all_stages(pipeline, mock_stage):
+    mock_stage.is_alive.return_value = False
     mock_stage._output_queues = {"queue1": Mock(), "queue2": Mock()}
     pipeline.stages = [mock_stage, mock_stage]
     pipeline.stop_all_stages()
@@ -75,6 +85,56 @@ def test_stop_all_stages(pipeline, mock_stage):
     assert mock_stage.join.call_count == 2
 
 
+class PassStage(Stage):
+    def __init__(self, stage_type: StageType = StageType.One2One, stage_executor=StageExecutor.THREAD):
+        Stage.__init__(self, stage_type, stage_executor, queue_timeout=0.01)
+
+    def pre_run(self):
+        pass
+
+    def post_run(self):
+        pass
+
+    def process(self, key: str, payload: Payload | None) -> Payload | None:
+        return payload
+
+
+def test_start_fuses_linear_thread_chains():
+    pipeline = Pipeline(fuse=True)
+    source = PassStage(StageType.One2Many)
+    first, second, third = PassStage(), PassStage(), PassStage()
+    process_stage = PassStage(stage_executor=StageExecutor.PROCESS)
+    for stage in (source, first, second, third, process_stage):
+        pipeline.add_stage(stage)
+
+    Pipeline.link_stages(source, first, "stream")
+    Pipeline.link_stages(first, second, "stream")
+    Pipeline.link_stages(second, third, "stream")
+    Pipeline.link_stages(third, process_stage, "stream")
+
+    pipeline._fuse_stages()
+
+    assert source._fused_next is None
+    assert first._fused_next is second and second._fused_next is third
+    assert third._fused_next is None
+    assert second._workers is first._workers and third._workers is first._workers
+    assert process_stage._fused_head is None
+
+
+def test_start_does_not_fuse_by_default():
+    pipeline = Pipeline()
+    first, second = PassStage(), PassStage()
+    pipeline.stages = [first, second]
+    Pipeline.link_stages(first, second, "stream")
+
+    pipeline.start()
+    assert first._fused_next is None
+    assert first._workers is not second._workers
+
+    pipeline.stop()
+    assert not first.is_alive() and not second.is_alive()
+
+
 # def test_chain_poison_pill(pipeline):
 #     stage1 = Mock(spec=Stage)
 #     stage2 = Mock(spec=Stage)
@@ -90,3 +150,262 @@ def test_flush(pipeline, mock_stage):
     pipeline.stages = [mock_stage, mock_stage]
     pipeline.flush()
     assert pipeline.stages == []
+
+
+def test_stats_are_collected_from_process_workers():
+    pipeline = Pipeline()
+    first = PassStage(stage_executor=StageExecutor.PROCESS)
+    second = PassStage()
+    pipeline.stages = [first, second]
+    Pipeline.link_stages(first, second, "stream")
+
+    source = PassStage()
+    source.link(first, "stream")
+
+    pipeline.start()
+    for _ in range(5):
+        source.put_to_right("stream", Payload())
+
+    deadline = time.monotonic() + 5
+    while pipeline.stats()["PassStage-1"].get("inputs", {}).get("stream", 0) < 5 and time.monotonic() < deadline:
+        time.sleep(0.01)
+
+    stats = pipeline.stats()
+    pipeline.stop()
+
+    assert list(stats) == ["PassStage", "PassStage-1"]
+    assert stats["PassStage"]["inputs"] == {"stream": 5}
+    assert stats["PassStage"]["outputs"] == {"stream": 5}
+    assert stats["PassStage-1"]["calls"] == 5
+
+
+class SlowStartStage(PassStage):
+    def __init__(self, delay: float, started: list, stage_type: StageType = StageType.One2One):
+        PassStage.__init__(self, stage_type)
+        self.delay = delay
+        self.started = started
+
+    def pre_run(self):
+        self.started.append(self)
+        time.sleep(self.delay)
+
+
+def test_start_runs_pre_run_concurrently_from_the_sinks():
+    started = []
+    source = SlowStartStage(0.2, started)
+    middle = SlowStartStage(0.2, started)
+    sink = SlowStartStage(0.2, started)
+    pipeline = Pipeline()
+    pipeline.stages = [source, middle, sink]
+    Pipeline.link_stages(source, middle, "stream")
+    Pipeline.link_stages(middle, sink, "stream")
+
+    begin = time.monotonic()
+    pipeline.start()
+    elapsed = time.monotonic() - begin
+
+    assert all(stage.is_ready() for stage in pipeline.stages)
+    assert pipeline._topological_order() == [source, middle, sink]
+    assert elapsed < 0.5
+    pipeline.stop()
+
+
+def test_start_raises_when_stages_are_not_ready_in_time():
+    stage = SlowStartStage(1.0, [])
+    pipeline = Pipeline(start_timeout=0.1)
+    pipeline.stages = [stage]
+
+    with pytest.raises(TimeoutError):
+        pipeline.start()
+
+    # The worker is still in pre_run(), it leaves as soon as it is done
+    assert not stage._running.is_set()
+    stage._worker.join()
+    assert not stage._released.is_set()
+
+
+def test_start_sleep_time_is_deprecated_and_not_taken_for_start_timeout():
+    with pytest.warns(DeprecationWarning):
+        pipeline = Pipeline(1.0)
+    assert pipeline._start_timeout == 30.0
+
+    with pytest.raises(TypeError):
+        Pipeline(1.0, 5.0)
+
+
+class BrokenStage(PassStage):
+    def pre_run(self):
+        raise RuntimeError("camera not found")
+
+
+def test_start_raises_when_pre_run_fails():
+    pipeline = Pipeline()
+    pipeline.stages = [BrokenStage(), PassStage()]
+
+    with pytest.raises(RuntimeError):
+        pipeline.start()
+    assert not any(stage.is_alive() for stage in pipeline.stages)
+
+
+class CountingSource(PassStage):
+    def __init__(self, count: int):
+        PassStage.__init__(self)
+        self.count = count
+
+    def process(self, key: str, payload: Payload | None) -> Payload | None:
+        if self.count == 0:
+            time.sleep(0.01)
+            return None
+        self.count -= 1
+        return Payload()
+
+
+class SlowStage(PassStage):
+    def __init__(self, delay: float, stage_executor: StageExecutor = StageExecutor.THREAD):
+        PassStage.__init__(self, stage_executor=stage_executor)
+        self.delay = delay
+
+    def process(self, key: str, payload: Payload | None) -> Payload | None:
+        if payload is not None:
+            time.sleep(self.delay)
+        return payload
+
+
+class CountingSink(PassStage):
+    def __init__(self):
+        PassStage.__init__(self)
+        self.received = 0
+
+    def process(self, key: str, payload: Payload | None) -> Payload | None:
+        if payload is not None:
+            self.received += 1
+        return None
+
+
+def test_stop_drains_the_queued_payloads():
+    source = CountingSource(20)
+    slow = SlowStage(0.01, StageExecutor.PROCESS)
+    sink = CountingSink()
+    pipeline = Pipeline()
+    pipeline.stages = [source, slow, sink]
+    Pipeline.link_stages(source, slow, "stream")
+    Pipeline.link_stages(slow, sink, "stream")
+
+    pipeline.start()
+    while source.count > 0:
+        time.sleep(0.01)
+    pipeline.stop()
+
+    assert sink.received == 20
+    assert not any(stage.is_alive() for stage in pipeline.stages)
+
+
+def test_stop_takes_a_bounded_time():
+    stages = [CountingSource(1000)] + [SlowStage(2.0) for _ in range(4)]
+    pipeline = Pipeline()
+    pipeline.stages = stages
+    for from_stage, to_stage in zip(stages, stages[1:]):
+        Pipeline.link_stages(from_stage, to_stage, "stream")
+
+    pipeline.start()
+    time.sleep(0.05)
+
+    begin = time.monotonic()
+    pipeline.stop(timeout=0.2)
+    assert time.monotonic() - begin < 1.5
+
+
+class StubbornStage(SlowStage):
+    def pre_run(self):
+        # Only killing the worker stops it
+        signal.signal(signal.SIGTERM, signal.SIG_IGN)
+
+
+def test_stop_reaps_the_killed_workers():
+    source = CountingSource(1000)
+    slow = StubbornStage(5.0, StageExecutor.PROCESS)
+    pipeline = Pipeline()
+    pipeline.stages = [source, slow]
+    Pipeline.link_stages(source, slow, "stream")
+
+    pipeline.start()
+    time.sleep(0.05)
+    pipeline.stop(timeout=0.2)
+
+    # Waited on after being killed, not left as a zombie
+    assert slow._worker._popen.returncode == -signal.SIGKILL
+
+
+class KeyedSink(PassStage):
+    def __init__(self):
+        PassStage.__init__(self, StageType.Many2Many)
+        self.received = {}
+
+    def process(self, key: str, payload: Payload | None) -> Payload | None:
+        if payload is not None:
+            self.received[key] = self.received.get(key, 0) + 1
+        return None
+
+
+class TickingSource(PassStage):
+    def process(self, key: str, payload: Payload | None) -> Payload | None:
+        time.sleep(0.001)
+        return Payload()
+
+
+def test_streams_added_and_removed_while_running():
+    pipeline = Pipeline()
+    sink = KeyedSink()
+    stream1, stream10 = TickingSource(), TickingSource()
+    pipeline.add_stream("stream1", [(stream1, sink)])
+    pipeline.add_stream("stream10", [(stream10, sink)])
+    assert pipeline.streams.stages("stream1") == [stream1, sink]
+
+    pipeline.start()
+    try:
+        time.sleep(0.1)
+        pipeline.unlink("stream1")
+        assert stream1 not in pipeline.stages
+        assert not stream1.is_alive()
+        assert list(sink.input_queues) == ["stream10"]
+
+        received = sink.received["stream10"]
+        time.sleep(0.1)
+        assert sink.received["stream10"] > received
+        assert stream10.is_alive()
+
+        stream2 = TickingSource()
+        pipeline.add_stream("stream2", [(stream2, sink)])
+        assert stream2.is_alive()
+        time.sleep(0.1)
+        assert sink.received.get("stream2", 0) > 0
+        assert sink.stats()["inputs"]["stream2"] > 0
+    finally:
+        pipeline.stop()
+
+    assert pipeline.streams.streams() == ["stream10", "stream2"]
+
+
+def test_add_stream_to_a_running_process_stage():
+    pipeline = Pipeline()
+    sink = SlowStage(0.0, StageExecutor.PROCESS)
+    pipeline.add_stream("stream1", [(TickingSource(), sink)])
+
+    pipeline.start()
+    try:
+        source = TickingSource()
+        with pytest.raises(RuntimeError):
+            pipeline.add_stream("stream2", [(source, sink)])
+        assert "stream2" not in pipeline.streams
+        assert source not in pipeline.stages
+        assert list(sink.input_queues) == ["stream1"]
+    finally:
+        pipeline.stop()
+
+
+def test_add_existing_stream():
+    pipeline = Pipeline()
+    pipeline.add_stream("stream", [(TickingSource(), KeyedSink())])
+
+    with pytest.raises(ValueError):
+        pipeline.add_stream("stream", [(TickingSource(), KeyedSink())])
@@ -0,0 +1,101 @@
+# -*- coding: utf-8 -*-
+import multiprocessing as mp
+import os
+import time
+
+import cv2
+import pytest
+
+from computer_vision_design_patterns.pipeline import Payload, Pipeline, Stage
+from computer_vision_design_patterns.pipeline.placement import Placement, assign_cores
+from computer_vision_design_patterns.pipeline.stage import StageExecutor, StageType
+
+
+class PlacedStage(Stage):
+    """Stage reporting the cores and the OpenCV threads its worker has in pre_run()."""
+
+    def __init__(self, stage_executor: StageExecutor = StageExecutor.PROCESS, replicas: int = 1, **kwargs):
+        Stage.__init__(self, stage_type=StageType.Many2Many, stage_executor=stage_executor, replicas=replicas, **kwargs)
+        self.reports = mp.Queue()
+
+    def pre_run(self):
+        self.reports.put((sorted(os.sched_getaffinity(0)), cv2.getNumThreads(), os.environ.get("OMP_NUM_THREADS")))
+
+    def post_run(self):
+        pass
+
+    def process(self, key: str, payload: Payload | None) -> Payload | None:
+        time.sleep(0.01)
+        return None
+
+
+@pytest.mark.skipif(not hasattr(os, "sched_setaffinity"), reason="CPU affinity not supported")
+def test_placement_is_applied_before_pre_run():
+    cpu = min(os.sched_getaffinity(0))
+    stage = PlacedStage(placement=Placement(cpus={cpu}, cv2_threads=1, blas_threads=1))
+    pipeline = Pipeline()
+    pipeline.add_stage(stage)
+
+    pipeline.start()
+    report = stage.reports.get(timeout=5)
+    pipeline.stop(timeout=1)
+
+    assert report == ([cpu], 1, "1")
+
+
+def test_assign_cores_without_overlap():
+    stages = [PlacedStage(replicas=2), PlacedStage(), PlacedStage(placement=Placement(cpus={7}, cv2_threads=4))]
+    assign_cores(stages, set(range(8)))
+
+    assert [stage.placement.cpus for stage in stages] == [{0, 1, 2, 3}, {4, 5}, {7}]
+    assert stages[0].placement.replica_cpus == ({0, 1}, {2, 3})
+    assert [stage.placement.cv2_threads for stage in stages] == [2, 2, 4]
+    assert stages[0].placement.blas_threads == 2
+
+
+def test_assign_cores_shares_them_between_too_many_workers():
+    stages = [PlacedStage() for _ in range(3)]
+    assign_cores(stages, {0, 1})
+
+    assert [stage.placement.cpus for stage in stages] == [{0}, {1}, {0}]
+    assert all(stage.placement.cv2_threads == 1 for stage in stages)
+
+
+def test_replicas_apply_their_own_cores(monkeypatch):
+    applied = []
+    monkeypatch.setattr(os, "sched_setaffinity", lambda pid, cpus: applied.append(cpus), raising=False)
+
+    placement = Placement(cpus={0, 1, 2, 3}, replica_cpus=({0, 1}, {2, 3}))
+    for replica in range(3):
+        placement.apply(replica)
+    Placement(cpus={0, 1}).apply(1)
+
+    assert applied == [{0, 1}, {2, 3}, {0, 1}, {0, 1}]
+
+
+@pytest.mark.skipif(
+    not hasattr(os, "sched_setaffinity") or len(os.sched_getaffinity(0)) < 2, reason="Needs the affinity of 2 cores"
+)
+def test_replicas_run_on_their_own_cores():
+    stage = PlacedStage(replicas=2)
+    pipeline = Pipeline(assign_cores=True)
+    pipeline.add_stage(stage)
+
+    pipeline.start()
+    reports = [stage.reports.get(timeout=5) for _ in range(2)]
+    pipeline.stop(timeout=1)
+
+    cpus = [set(report[0]) for report in reports]
+    assert not cpus[0] & cpus[1]
+    assert cpus[0] | cpus[1] == stage.placement.cpus
+
+
+def test_invalid_placement():
+    with pytest.raises(ValueError):
+        Placement(cpus=set())
+
+    with pytest.raises(ValueError):
+        Placement(cv2_threads=0)
+
+    with pytest.raises(ValueError):
+        Placement(replica_cpus=({0}, set()))
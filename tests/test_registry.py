@@ -0,0 +1,34 @@
+# -*- coding: utf-8 -*-
+from unittest.mock import Mock
+
+from computer_vision_design_patterns.pipeline import Stage
+from computer_vision_design_patterns.pipeline.registry import StreamLink, StreamRegistry
+
+
+def test_registry_indexes_streams_and_stages():
+    source1, source10, switch, sink = (Mock(spec=Stage) for _ in range(4))
+    registry = StreamRegistry()
+    registry.add(StreamLink("stream1", source1, switch, "stream1", "stream1"))
+    registry.add(StreamLink("stream1", switch, sink, "stream1-0", "stream1"))
+    registry.add(StreamLink("stream10", source10, switch, "stream10", "stream10"))
+
+    assert "stream1" in registry
+    assert len(registry) == 2
+    assert registry.stages("stream1") == [source1, switch, sink]
+    assert registry.streams_of(switch) == ["stream1", "stream10"]
+    assert [link.output_key for link in registry.links("stream1")] == ["stream1", "stream1-0"]
+
+
+def test_registry_remove_only_touches_the_stream():
+    source1, source10, sink = (Mock(spec=Stage) for _ in range(3))
+    registry = StreamRegistry()
+    registry.add(StreamLink("stream1", source1, sink, "stream1", "stream1"))
+    registry.add(StreamLink("stream10", source10, sink, "stream10", "stream10"))
+
+    links = registry.remove("stream1")
+
+    assert [link.from_stage for link in links] == [source1]
+    assert registry.streams() == ["stream10"]
+    assert registry.streams_of(source1) == []
+    assert registry.streams_of(sink) == ["stream10"]
+    assert registry.remove("stream1") == []
@@ -0,0 +1,74 @@
+# -*- coding: utf-8 -*-
+import time
+
+from computer_vision_design_patterns.pipeline import Payload
+from computer_vision_design_patterns.pipeline.reorder import LatePolicy, ReorderBuffer, ReorderPolicy
+
+
+def sequences(payloads):
+    return [payload.sequence for payload in payloads]
+
+
+def test_in_order_payloads_are_emitted_immediately():
+    buffer = ReorderBuffer()
+    assert sequences(buffer.push(Payload(sequence=0))) == [0]
+    assert sequences(buffer.push(Payload(sequence=1))) == [1]
+
+
+def test_out_of_order_payloads_are_held():
+    buffer = ReorderBuffer()
+    buffer.push(Payload(sequence=0))
+    assert buffer.push(Payload(sequence=2)) == []
+    assert buffer.push(Payload(sequence=3)) == []
+    assert sequences(buffer.push(Payload(sequence=1))) == [1, 2, 3]
+    assert len(buffer) == 0
+
+
+def test_unsequenced_payloads_pass_through():
+    buffer = ReorderBuffer()
+    payload = Payload()
+    assert buffer.push(payload) == [payload]
+
+
+def test_missing_payload_is_skipped_when_window_is_full():
+    buffer = ReorderBuffer(ReorderPolicy(window=2))
+    buffer.push(Payload(sequence=0))
+    buffer.push(Payload(sequence=2))
+    buffer.push(Payload(sequence=3))
+    assert sequences(buffer.push(Payload(sequence=4))) == [2, 3, 4]
+    assert buffer.skipped == 1
+
+
+def test_missing_payload_is_skipped_after_max_delay():
+    buffer = ReorderBuffer(ReorderPolicy(max_delay=0.01))
+    buffer.push(Payload(sequence=0))
+    buffer.push(Payload(sequence=2))
+    assert buffer.expire() == []
+    time.sleep(0.02)
+    assert sequences(buffer.expire()) == [2]
+    assert buffer.skipped == 1
+
+
+def test_late_payload_is_dropped():
+    buffer = ReorderBuffer(ReorderPolicy(window=1))
+    buffer.push(Payload(sequence=0))
+    buffer.push(Payload(sequence=2))
+    buffer.push(Payload(sequence=3))
+    assert buffer.push(Payload(sequence=1)) == []
+    assert buffer.late == 1
+
+
+def test_late_payload_is_forwarded():
+    buffer = ReorderBuffer(ReorderPolicy(window=1, late_policy=LatePolicy.FORWARD))
+    buffer.push(Payload(sequence=0))
+    buffer.push(Payload(sequence=2))
+    buffer.push(Payload(sequence=3))
+    assert sequences(buffer.push(Payload(sequence=1))) == [1]
+
+
+def test_stream_joined_midway_starts_from_smallest_sequence():
+    buffer = ReorderBuffer(ReorderPolicy(window=2))
+    assert buffer.push(Payload(sequence=11)) == []
+    assert buffer.push(Payload(sequence=10)) == []
+    assert sequences(buffer.push(Payload(sequence=12))) == [10, 11, 12]
+    assert buffer.skipped == 0
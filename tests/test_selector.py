@@ -0,0 +1,57 @@
+# -*- coding: utf-8 -*-
+import multiprocessing as mp
+import threading
+import time
+
+from computer_vision_design_patterns.pipeline import Payload
+from computer_vision_design_patterns.pipeline.selector import InputSelector
+from computer_vision_design_patterns.pipeline.thread_queue import ThreadQueue
+
+
+def test_wait_returns_ready_thread_queues():
+    queues = {"idle": ThreadQueue(), "busy": ThreadQueue()}
+    queues["busy"].put(Payload())
+    assert InputSelector(queues).wait(1.0) == ["busy"]
+
+
+def test_wait_returns_ready_process_queues():
+    queues = {"idle": mp.Queue(), "busy": mp.Queue()}
+    queues["busy"].put(Payload())
+    assert InputSelector(queues).wait(1.0) == ["busy"]
+
+
+def test_wait_returns_ready_mixed_queues():
+    queues = {"thread": ThreadQueue(), "process": mp.Queue()}
+    selector = InputSelector(queues)
+    queues["process"].put(Payload())
+    assert selector.wait(1.0) == ["process"]
+    queues["process"].get()
+    queues["thread"].put(Payload())
+    assert selector.wait(1.0) == ["thread"]
+
+
+def test_wait_times_out_once_on_idle_queues():
+    selector = InputSelector({f"stream{i}": ThreadQueue() for i in range(16)})
+    start = time.monotonic()
+    assert selector.wait(0.05) == []
+    assert time.monotonic() - start < 0.5
+
+
+def test_wait_wakes_up_on_put():
+    queue = ThreadQueue()
+    selector = InputSelector({"stream": queue})
+    ready_keys = []
+
+    thread = threading.Thread(target=lambda: ready_keys.extend(selector.wait(5.0)))
+    thread.start()
+    time.sleep(0.01)
+    queue.put(Payload())
+    thread.join(timeout=1.0)
+    assert ready_keys == ["stream"]
+
+
+def test_close_removes_listeners():
+    queue = ThreadQueue()
+    selector = InputSelector({"stream": queue})
+    selector.close()
+    assert queue._listeners == []
@@ -0,0 +1,192 @@
+# -*- coding: utf-8 -*-
+import gc
+import multiprocessing as mp
+from multiprocessing import resource_tracker
+from queue import Full
+
+import numpy as np
+import pytest
+
+from computer_vision_design_patterns.pipeline import Payload
+from computer_vision_design_patterns.pipeline.sample_stage.SimpleStreamStage import VideoStreamOutput
+from computer_vision_design_patterns.pipeline.shared_memory import FrameRing, SharedFrame, SharedMemoryQueue, _attach
+
+
+@pytest.fixture
+def ring():
+    ring = FrameRing(slots=2)
+    yield ring
+    ring.close()
+
+
+def test_store_replaces_arrays_with_descriptors(ring):
+    payload = VideoStreamOutput(frame=np.ones((4, 4, 3), dtype=np.uint8))
+    stored = ring.store(payload)
+    assert isinstance(stored.frame, SharedFrame)
+    assert stored.timestamp == payload.timestamp
+    assert isinstance(payload.frame, np.ndarray)
+
+
+def test_load_returns_views_on_the_slot(ring):
+    frame = np.arange(48, dtype=np.uint8).reshape((4, 4, 3))
+    loaded = ring.load(ring.store(VideoStreamOutput(frame=frame)))
+    np.testing.assert_array_equal(loaded.frame, frame)
+    assert not loaded.frame.flags.owndata
+
+
+def test_payload_without_arrays_is_untouched(ring):
+    payload = Payload()
+    assert ring.store(payload) is payload
+
+
+def test_slot_is_released_when_view_is_collected(ring):
+    loaded = ring.load(ring.store(VideoStreamOutput(frame=np.zeros((2, 2), dtype=np.uint8))))
+    assert ring.free_slots() == 1
+    del loaded
+    gc.collect()
+    assert ring.free_slots() == 2
+
+
+def test_slot_is_released_by_every_consumer(ring):
+    stored = ring.store(VideoStreamOutput(frame=np.zeros((2, 2), dtype=np.uint8)), consumers=2)
+    ring.release(stored.frame.slot)
+    assert ring.free_slots() == 1
+    ring.release(stored.frame.slot)
+    assert ring.free_slots() == 2
+
+
+def test_queues_sharing_a_ring_store_the_frame_once(ring):
+    queues = [SharedMemoryQueue(ring=ring, shared_ring=True) for _ in range(3)]
+    frame = np.arange(4, dtype=np.uint8).reshape((2, 2))
+    stored = ring.store(VideoStreamOutput(frame=frame))
+    for queue in queues:
+        queue.put(stored)
+    ring.discard(stored)
+    assert ring.free_slots() == 1
+
+    loaded = [queue.get(timeout=1) for queue in queues]
+    for payload in loaded:
+        np.testing.assert_array_equal(payload.frame, frame)
+
+    del loaded, payload
+    gc.collect()
+    assert ring.free_slots() == 2
+
+    queues[0].close()
+    assert ring.retain(ring.store(VideoStreamOutput(frame=frame)))
+
+
+def test_store_raises_full_without_free_slots(ring):
+    ring.store(VideoStreamOutput(frame=np.zeros((2, 2), dtype=np.uint8)))
+    ring.store(VideoStreamOutput(frame=np.zeros((2, 2), dtype=np.uint8)))
+    with pytest.raises(Full):
+        ring.store(VideoStreamOutput(frame=np.zeros((2, 2), dtype=np.uint8)), timeout=0.01)
+
+
+def test_oversized_frame_travels_inline(ring):
+    ring.store(VideoStreamOutput(frame=np.zeros((2, 2), dtype=np.uint8)))
+    stored = ring.store(VideoStreamOutput(frame=np.zeros((4, 4), dtype=np.uint8)))
+    assert isinstance(stored.frame, np.ndarray)
+
+
+def _consume(queue: SharedMemoryQueue, results: mp.Queue, count: int):
+    for _ in range(count):
+        payload = queue.get(timeout=5)
+        results.put(int(payload.frame[0, 0]))
+
+
+def test_queue_between_processes():
+    queue = SharedMemoryQueue(maxsize=1, ring=FrameRing(slots=2))
+    results = mp.Queue()
+    consumer = mp.Process(target=_consume, args=(queue, results, 5))
+    consumer.start()
+
+    for i in range(5):
+        queue.put(VideoStreamOutput(frame=np.full((8, 8), i, dtype=np.uint8)), timeout=5)
+
+    assert [results.get(timeout=5) for _ in range(5)] == [0, 1, 2, 3, 4]
+    consumer.join(timeout=5)
+    assert queue.ring.free_slots() == 2
+    queue.close()
+
+
+def _produce_and_exit(queue: SharedMemoryQueue, count: int):
+    for i in range(count):
+        queue.put(VideoStreamOutput(frame=np.full((8, 8), i, dtype=np.uint8)), timeout=5)
+    # What the worker of a producing stage does when it leaves
+    queue.ring.close()
+
+
+def _produce_with_own_tracker(queue: SharedMemoryQueue, count: int):
+    # A worker forked before its parent used any shared memory starts a resource tracker of its own
+    tracker = resource_tracker.ResourceTracker()
+    resource_tracker.register, resource_tracker.unregister = tracker.register, tracker.unregister
+    _produce_and_exit(queue, count)
+    # Exiting stops the tracker, which unlinks the blocks still registered
+    tracker._stop()
+
+
+def test_frames_outlive_the_resource_tracker_of_the_producer():
+    queue = SharedMemoryQueue(maxsize=8, ring=FrameRing(slots=8))
+    producer = mp.Process(target=_produce_with_own_tracker, args=(queue, 8))
+    producer.start()
+    producer.join(timeout=5)
+    assert producer.exitcode == 0
+
+    loaded = [queue.get(timeout=5) for _ in range(8)]
+    assert [int(payload.frame[0, 0]) for payload in loaded] == list(range(8))
+
+    (name,) = queue.ring._attached
+    del loaded
+    gc.collect()
+    assert queue.ring.free_slots() == 8
+    with pytest.raises(FileNotFoundError):
+        _attach(name)
+    queue.close()
+
+
+def test_late_consumer_reads_the_frames_of_an_exited_producer():
+    queue = SharedMemoryQueue(maxsize=4, ring=FrameRing(slots=4))
+    producer = mp.Process(target=_produce_and_exit, args=(queue, 3))
+    producer.start()
+    producer.join(timeout=5)
+    assert producer.exitcode == 0
+
+    loaded = [queue.get(timeout=5) for _ in range(3)]
+    assert [int(payload.frame[0, 0]) for payload in loaded] == [0, 1, 2]
+
+    # The last frame released unlinks the block the producer left
+    (name,) = queue.ring._attached
+    del loaded
+    gc.collect()
+    assert queue.ring.free_slots() == 4
+    with pytest.raises(FileNotFoundError):
+        _attach(name)
+    queue.close()
+
+
+def test_replicated_producers_leave_their_own_blocks():
+    queue = SharedMemoryQueue(maxsize=4, ring=FrameRing(slots=4))
+    first = mp.Process(target=_produce_and_exit, args=(queue, 1))
+    first.start()
+    first.join(timeout=5)
+    first_payload = queue.get(timeout=5)
+
+    # The block of the first producer outlives the frames of the second one
+    second = mp.Process(target=_produce_and_exit, args=(queue, 1))
+    second.start()
+    second.join(timeout=5)
+    second_payload = queue.get(timeout=5)
+    first_name, second_name = queue.ring._attached
+
+    del second_payload
+    gc.collect()
+    assert int(first_payload.frame[0, 0]) == 0
+    with pytest.raises(FileNotFoundError):
+        _attach(second_name)
+
+    del first_payload
+    gc.collect()
+    with pytest.raises(FileNotFoundError):
+        _attach(first_name)
+    queue.close()
@@ -0,0 +1,98 @@
+# -*- coding: utf-8 -*-
+import time
+
+import numpy as np
+import pytest
+
+from computer_vision_design_patterns.pipeline.sample_stage import SimpleStreamStage
+from computer_vision_design_patterns.pipeline.stage import StageExecutor
+
+
+class FakeCapture:
+    """Camera writing its frame number in every pixel."""
+
+    def __init__(self, source):
+        self.frames = 0
+        self.buffers = set()
+        self.released = False
+
+    def set(self, prop, value):
+        return True
+
+    def read(self, image=None):
+        time.sleep(0.001)
+        self.frames += 1
+        if image is None:
+            image = np.empty((4, 4, 3), dtype=np.uint8)
+        self.buffers.add(id(image))
+        image[...] = self.frames % 256
+        return True, image
+
+    def release(self):
+        self.released = True
+
+
+@pytest.fixture
+def capture(monkeypatch):
+    monkeypatch.setattr("cv2.VideoCapture", FakeCapture)
+
+
+def test_inline_read(capture):
+    stage = SimpleStreamStage(0, StageExecutor.THREAD)
+    stage.pre_run()
+
+    frames = [int(stage.process("a", None).frame[0, 0, 0]) for _ in range(3)]
+    stage.post_run()
+
+    assert frames == [1, 2, 3]
+    assert stage._cap.released
+    # The first frame is allocated by the capture, the next ones are read into the same pool buffer
+    assert len(stage._cap.buffers) == 2
+    assert stage.buffer_pool.stats()["hits"] == 1
+
+
+def test_latest_frame_drops_old_frames(capture):
+    stage = SimpleStreamStage(0, StageExecutor.THREAD, queue_timeout=0.1, latest_frame=True)
+    stage.pre_run()
+
+    first = stage.process("a", None)
+    time.sleep(0.05)
+    before = time.time()
+    second = stage.process("a", None)
+    stage.post_run()
+
+    # Frames read while the stage was not asking are skipped
+    assert int(second.frame[0, 0, 0]) > int(first.frame[0, 0, 0]) + 1
+    assert second.timestamp <= before
+    assert stage._cap.released
+    assert stage._grab_thread is None
+
+
+def test_latest_frame_reuses_buffers(capture):
+    stage = SimpleStreamStage(0, StageExecutor.THREAD, queue_timeout=0.1, latest_frame=True)
+    stage.pre_run()
+
+    frames = []
+    for _ in range(10):
+        frames.append(stage.process("a", None).frame)
+        time.sleep(0.005)
+    stage.post_run()
+
+    assert stage._cap.frames > 10
+    assert len(stage._cap.buffers) <= 3
+    # The emitted frames are copies, the grab thread cannot overwrite them
+    assert not {id(frame) for frame in frames} & stage._cap.buffers
+
+
+def test_fps_pacing(capture):
+    stage = SimpleStreamStage(0, StageExecutor.THREAD, queue_timeout=0.05, fps=40.0)
+    stage.pre_run()
+
+    start = time.monotonic()
+    frames = 0
+    while frames < 5:
+        if stage.process("a", None) is not None:
+            frames += 1
+    stage.post_run()
+
+    assert time.monotonic() - start >= 4 / 40.0 * 0.9
@@ -1,12 +1,22 @@
 # -*- coding: utf-8 -*-
+import gc
 import multiprocessing as mp
+import multiprocessing.queues
 import threading
+import time
 from unittest.mock import MagicMock, patch
 
+import numpy as np
 import pytest
 
 from computer_vision_design_patterns.pipeline import Payload, Stage
-from computer_vision_design_patterns.pipeline.stage import PoisonPill, StageExecutor, StageType
+from computer_vision_design_patterns.pipeline.overflow import OverflowAction, OverflowPolicy
+from computer_vision_design_patterns.pipeline.reorder import ReorderBuffer
+from computer_vision_design_patterns.pipeline.sample_stage import SwitchStage
+from computer_vision_design_patterns.pipeline.sample_stage.SimpleStreamStage import VideoStreamOutput
+from computer_vision_design_patterns.pipeline.shared_memory import SharedMemoryQueue
+from computer_vision_design_patterns.pipeline.stage import PoisonPill, StageExecutor, StageTransport, StageType
+from computer_vision_design_patterns.pipeline.thread_queue import ThreadQueue
 
 
 class MockStage(Stage):
@@ -104,6 +114,82 @@ def test_unlink_stages():
     assert "test_stream_2" in stage._output_queues
 
 
+def test_batches_of_the_ready_inputs_share_one_deadline():
+    source = MockStage(StageType.Many2Many, StageExecutor.THREAD)
+    stage = MockStage(StageType.Many2Many, StageExecutor.THREAD, queue_timeout=0.05, batch_size=4, batch_timeout=0.2)
+    for key in ["a", "b", "c"]:
+        source.link(stage, key)
+        source.put_to_right(key, Payload())
+
+    start = time.monotonic()
+    stage._process_stage()
+
+    # None of the batches fills up, they all stop waiting at the same deadline
+    assert time.monotonic() - start < 0.35
+
+
+def test_unlink_matches_the_exact_stream():
+    source = MockStage(StageType.Many2Many, StageExecutor.THREAD)
+    sink = MockStage(StageType.Many2Many, StageExecutor.THREAD)
+    source.link(sink, "stream1")
+    source.link(sink, "stream10")
+
+    source.unlink("stream1")
+    sink.unlink("stream1")
+
+    assert list(source._output_queues) == ["stream10"]
+    assert list(sink.input_queues) == ["stream10"]
+    assert sink.upstream_stages() == [source]
+
+
+def test_unlink_removes_the_copies_of_a_stream():
+    switch = SwitchStage(StageExecutor.THREAD)
+    sinks = [MockStage(StageType.Many2Many, StageExecutor.THREAD) for _ in range(3)]
+    assert [switch.link(sinks[0], "a"), switch.link(sinks[1], "a"), switch.link(sinks[2], "b")] == ["a-0", "a-1", "b-0"]
+
+    switch.unlink("a")
+    assert list(switch._output_queues) == ["b-0"]
+    assert switch.downstream_stages() == [sinks[2]]
+
+    # Copy numbers are reused once free
+    assert switch.link(sinks[0], "a") == "a-0"
+
+
+def test_fan_out_to_process_queues():
+    switch = SwitchStage(StageExecutor.PROCESS)
+    sinks = [MockStage(StageType.One2One, StageExecutor.THREAD) for _ in range(3)]
+    for sink in sinks:
+        switch.link(sink, "a")
+
+    frame = np.arange(12, dtype=np.uint8).reshape((2, 2, 3))
+    switch._forward("a", VideoStreamOutput(frame=frame), set(switch._output_queues))
+
+    for sink in sinks:
+        np.testing.assert_array_equal(sink.input_queues["a"].get(timeout=1).frame, frame)
+
+
+def test_fan_out_shares_one_shared_memory_slot():
+    switch = SwitchStage(StageExecutor.PROCESS, transport=StageTransport.SHARED_MEMORY)
+    sinks = [MockStage(StageType.One2One, StageExecutor.THREAD) for _ in range(3)]
+    for sink in sinks:
+        switch.link(sink, "a")
+    ring = switch._fanout_ring
+    assert all(queue.ring is ring for queue in switch._output_queues.values())
+
+    frame = np.arange(12, dtype=np.uint8).reshape((2, 2, 3))
+    switch._forward("a", VideoStreamOutput(frame=frame), set(switch._output_queues))
+    assert ring.free_slots() == ring.slots - 1
+
+    payloads = [sink.input_queues["a"].get(timeout=1) for sink in sinks]
+    for payload in payloads:
+        np.testing.assert_array_equal(payload.frame, frame)
+
+    del payloads, payload
+    gc.collect()
+    assert ring.free_slots() == ring.slots
+    switch._release_shared_memory()
+
+
 @patch("threading.Thread.start")
 def test_start_stage(mock_start, mock_stage):
     mock_stage.start()
@@ -118,3 +204,356 @@ def test_stop_and_join_stage(mock_join, mock_stage):
     assert not mock_stage._running.is_set()
     mock_stage.join()
     mock_join.assert_called_once()
+
+
+def test_link_stages_shared_memory_transport():
+    stage1 = MockStage(StageType.One2One, StageExecutor.PROCESS, transport=StageTransport.SHARED_MEMORY)
+    stage2 = MockStage(StageType.One2One, StageExecutor.PROCESS)
+    stage1.link(stage2, "test_key")
+    assert isinstance(stage1._output_queues["test_key"], SharedMemoryQueue)
+    assert stage1._output_queues["test_key"] is stage2.input_queues["test_key"]
+
+
+@pytest.mark.parametrize(
+    "executors, queue_type",
+    [
+        ((StageExecutor.THREAD, StageExecutor.THREAD), ThreadQueue),
+        ((StageExecutor.THREAD, StageExecutor.PROCESS), mp.queues.Queue),
+        ((StageExecutor.PROCESS, StageExecutor.THREAD), mp.queues.Queue),
+    ],
+)
+def test_link_selects_transport(executors, queue_type):
+    stage1 = MockStage(StageType.One2One, executors[0])
+    stage2 = MockStage(StageType.One2One, executors[1])
+    stage1.link(stage2, "test_key")
+    assert isinstance(stage1._output_queues["test_key"], queue_type)
+
+
+def test_put_to_right_drops_oldest_on_thread_queue():
+    stage1 = MockStage(StageType.One2One, StageExecutor.THREAD, output_maxsize=1, queue_timeout=0.01)
+    stage2 = MockStage(StageType.One2One, StageExecutor.THREAD)
+    stage1.link(stage2, "test_key")
+    first, second = Payload(), Payload()
+    stage1.put_to_right("test_key", first)
+    stage1.put_to_right("test_key", second)
+    assert stage2.get_from_left("test_key") is second
+
+
+def test_process_stage_handles_ready_input_without_waiting_on_idle_ones():
+    source = MockStage(StageType.One2One, StageExecutor.THREAD)
+    idle_sources = [MockStage(StageType.One2One, StageExecutor.THREAD) for _ in range(8)]
+    stage = MockStage(StageType.Many2Many, StageExecutor.THREAD, queue_timeout=1.0)
+    stage.process = MagicMock(return_value=None)
+    source.link(stage, "busy")
+    for i, idle_source in enumerate(idle_sources):
+        idle_source.link(stage, f"idle{i}")
+
+    payload = Payload()
+    source.put_to_right("busy", payload)
+    stage._process_stage()
+    stage.process.assert_called_once_with("busy", payload)
+
+
+def test_invalid_batch_size():
+    with pytest.raises(ValueError):
+        MockStage(StageType.One2One, StageExecutor.THREAD, batch_size=0)
+
+
+def test_process_stage_drains_batches():
+    source = MockStage(StageType.One2One, StageExecutor.THREAD)
+    stage = MockStage(StageType.One2One, StageExecutor.THREAD, batch_size=3)
+    stage.process_batch = MagicMock(return_value=[])
+    source.link(stage, "test_key")
+    payloads = [Payload() for _ in range(5)]
+    for payload in payloads:
+        source.put_to_right("test_key", payload)
+
+    stage._process_stage()
+    stage.process_batch.assert_called_once_with("test_key", payloads[:3])
+    stage._process_stage()
+    stage.process_batch.assert_called_with("test_key", payloads[3:])
+
+
+def test_process_batch_defaults_to_process(mock_stage):
+    mock_stage.process = MagicMock(side_effect=lambda key, payload: payload)
+    payloads = [Payload(), Payload()]
+    assert mock_stage.process_batch("test_key", payloads) == payloads
+    assert mock_stage.process.call_count == 2
+
+
+def test_process_stage_stops_on_poison_pill_in_batch():
+    source = MockStage(StageType.One2One, StageExecutor.THREAD)
+    stage = MockStage(StageType.One2One, StageExecutor.THREAD, batch_size=4)
+    stage.process_batch = MagicMock(return_value=[])
+    source.link(stage, "test_key")
+    payload = Payload()
+    source.put_to_right("test_key", payload)
+    source.put_to_right("test_key", PoisonPill())
+
+    stage._running.set()
+    stage._process_stage()
+    stage.process_batch.assert_called_once_with("test_key", [payload])
+    assert not stage._running.is_set()
+
+
+def test_invalid_replicas():
+    with pytest.raises(ValueError):
+        MockStage(StageType.One2One, StageExecutor.THREAD, replicas=0)
+
+
+@pytest.mark.parametrize("stage_executor", [StageExecutor.THREAD, StageExecutor.PROCESS])
+def test_replicas_create_workers(stage_executor):
+    stage = MockStage(StageType.One2One, stage_executor, replicas=3)
+    assert len(stage._workers) == 3
+    assert stage._worker is stage._workers[0]
+
+
+def test_link_replicated_stage_adds_reorder_buffer():
+    stage1 = MockStage(StageType.One2One, StageExecutor.THREAD, replicas=2)
+    stage2 = MockStage(StageType.One2One, StageExecutor.THREAD)
+    stage1.link(stage2, "test_key")
+    assert isinstance(stage2._reorder_buffers["test_key"], ReorderBuffer)
+
+
+class SequenceSource(MockStage):
+    def process(self, key: str, payload: Payload | None) -> Payload | None:
+        return Payload()
+
+
+def test_source_stamps_sequence_numbers():
+    source = SequenceSource(StageType.One2One, StageExecutor.THREAD)
+    sink = MockStage(StageType.One2One, StageExecutor.THREAD)
+    source.link(sink, "test_key")
+    source._process_stage()
+    source._process_stage()
+    assert sink.get_from_left("test_key").sequence == 0
+    assert sink.get_from_left("test_key").sequence == 1
+
+
+class SlowEvenStage(MockStage):
+    def process(self, key: str, payload: Payload | None) -> Payload | None:
+        if payload is None:
+            return None
+        if payload.sequence % 2 == 0:
+            time.sleep(0.02)
+        return Payload()
+
+
+class CollectStage(MockStage):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.sequences = []
+
+    def process(self, key: str, payload: Payload | None) -> Payload | None:
+        if payload is not None:
+            self.sequences.append(payload.sequence)
+        return None
+
+
+def test_replicated_stage_outputs_are_reordered():
+    source = MockStage(StageType.One2One, StageExecutor.THREAD)
+    replicated = SlowEvenStage(StageType.One2One, StageExecutor.THREAD, replicas=2, queue_timeout=0.01)
+    sink = CollectStage(StageType.One2One, StageExecutor.THREAD, queue_timeout=0.01)
+    source.link(replicated, "test_key")
+    replicated.link(sink, "test_key")
+
+    replicated.start()
+    for i in range(10):
+        source.put_to_right("test_key", Payload(sequence=i))
+
+    deadline = time.monotonic() + 5
+    while len(sink.sequences) < 10 and time.monotonic() < deadline:
+        sink._process_stage()
+
+    replicated.stop()
+    replicated.join()
+    assert sink.sequences == list(range(10))
+
+
+class IncrementStage(MockStage):
+    def process(self, key: str, payload: Payload | None) -> Payload | None:
+        if payload is None:
+            return None
+        return Payload(sequence=payload.sequence + 1)
+
+
+def test_fused_stages_skip_the_queue_between_them():
+    source = MockStage(StageType.One2One, StageExecutor.THREAD)
+    head = IncrementStage(StageType.One2One, StageExecutor.THREAD)
+    tail = IncrementStage(StageType.One2One, StageExecutor.THREAD)
+    sink = MockStage(StageType.One2One, StageExecutor.THREAD)
+    source.link(head, "test_key")
+    head.link(tail, "test_key")
+    tail.link(sink, "test_key")
+
+    head.fuse([tail])
+    source.put_to_right("test_key", Payload(sequence=0))
+    head._process_stage()
+
+    assert tail.input_queues["test_key"].empty()
+    assert sink.get_from_left("test_key").sequence == 2
+    assert tail._workers is head._workers
+
+
+def test_fused_chain_runs_pre_and_post_run_of_every_stage():
+    head = IncrementStage(StageType.One2One, StageExecutor.THREAD, queue_timeout=0.01)
+    tail = IncrementStage(StageType.One2One, StageExecutor.THREAD, queue_timeout=0.01)
+    head.link(tail, "test_key")
+    head.fuse([tail])
+
+    tail.start()
+    head.start()
+    assert tail.is_alive()
+
+    tail.stop()
+    head.join()
+    assert head.pre_run_called and tail.pre_run_called
+    assert head.post_run_called and tail.post_run_called
+
+
+@pytest.mark.parametrize(
+    "kwargs",
+    [{"stage_executor": StageExecutor.PROCESS}, {"replicas": 2}, {"batch_size": 2}],
+)
+def test_fuse_rejects_stages_that_cannot_share_a_worker(kwargs):
+    head = MockStage(StageType.One2One, **{"stage_executor": StageExecutor.THREAD, **kwargs})
+    tail = MockStage(StageType.One2One, StageExecutor.THREAD)
+    head.link(tail, "test_key")
+    with pytest.raises(ValueError):
+        head.fuse([tail])
+
+
+def test_link_overrides_overflow_policy():
+    stage1 = MockStage(StageType.One2One, StageExecutor.THREAD, output_maxsize=4, queue_timeout=0.01)
+    stage2 = MockStage(StageType.One2One, StageExecutor.THREAD)
+    stage1.link(stage2, "test_key", overflow_policy=OverflowPolicy(OverflowAction.LATEST_ONLY))
+    assert stage2.input_queues["test_key"].maxsize == 1
+
+    for _ in range(3):
+        stage1.put_to_right("test_key", Payload())
+    assert stage1.dropped() == {"test_key": 2}
+
+
+def test_asyncio_stage_cannot_block_on_output():
+    stage1 = MockStage(StageType.One2One, StageExecutor.ASYNCIO, overflow_policy=OverflowPolicy(OverflowAction.BLOCK))
+    stage2 = MockStage(StageType.One2One, StageExecutor.THREAD)
+    with pytest.raises(ValueError):
+        stage1.link(stage2, "test_key")
+
+
+class FailingStage(MockStage):
+    def process(self, key: str, payload: Payload | None) -> Payload | None:
+        if payload is not None and payload.sequence == 1:
+            raise RuntimeError("failed")
+        return payload
+
+
+def test_stats_count_inputs_outputs_and_errors():
+    source = MockStage(StageType.One2One, StageExecutor.THREAD)
+    stage = FailingStage(StageType.One2One, StageExecutor.THREAD, queue_timeout=0.01)
+    sink = MockStage(StageType.One2One, StageExecutor.THREAD)
+    source.link(stage, "test_key")
+    stage.link(sink, "test_key")
+
+    stage.start()
+    for i in range(3):
+        source.put_to_right("test_key", Payload(sequence=i))
+
+    deadline = time.monotonic() + 5
+    while stage.stats()["inputs"]["test_key"] < 3 and time.monotonic() < deadline:
+        time.sleep(0.01)
+
+    stage.stop()
+    stage.join()
+
+    stats = stage.stats()
+    # The calls without payload while the input is empty are counted as well
+    assert stats["calls"] >= 3
+    assert stats["errors"] == 1
+    assert stats["outputs"] == {"test_key": 2}
+    assert stats["queue_depth"] == {"test_key": 0}
+    assert stats["dropped"] == {"test_key": 0}
+    assert stats["idle_time"] > 0
+
+
+class PassStage(MockStage):
+    def process(self, key: str, payload: Payload | None) -> Payload | None:
+        return payload
+
+
+def test_traced_payloads_record_hops_and_latencies():
+    source = SequenceSource(StageType.One2One, StageExecutor.THREAD, tracing=True)
+    stage = PassStage(StageType.One2One, StageExecutor.THREAD)
+    sink = MockStage(StageType.One2One, StageExecutor.THREAD)
+    source.link(stage, "test_key")
+    stage.link(sink, "test_key")
+    stage._init_metrics()
+
+    source._process_stage()
+    sent = stage.input_queues["test_key"].queue[0]
+    stage._process_stage()
+    received = sink.get_from_left("test_key")
+
+    assert len(sent.trace) == 1
+    assert received is not sent
+    assert len(received.trace) == 2
+    assert received.trace.origin == sent.trace.origin
+    assert stage.stats()["trace"]["test_key"]["end_to_end"]["p50"] > 0
+
+
+def test_payloads_are_not_traced_by_default():
+    source = SequenceSource(StageType.One2One, StageExecutor.THREAD)
+    sink = MockStage(StageType.One2One, StageExecutor.THREAD)
+    source.link(sink, "test_key")
+    source._process_stage()
+    assert sink.get_from_left("test_key").trace is None
+
+
+def test_stage_drains_after_end_of_stream_on_every_input():
+    sources = [MockStage(StageType.One2One, StageExecutor.THREAD) for _ in range(2)]
+    stage = CollectStage(StageType.Many2One, StageExecutor.THREAD, queue_timeout=0.01)
+    for i, source in enumerate(sources):
+        source.link(stage, f"stream-{i}")
+
+    stage._running.set()
+    sources[0].put_to_right("stream-0", PoisonPill())
+    sources[1].put_to_right("stream-1", Payload(sequence=1))
+    stage._process_stage()
+    assert stage._running.is_set()
+
+    sources[0].put_to_right("stream-0", Payload(sequence=2))
+    sources[1].put_to_right("stream-1", PoisonPill())
+    stage._process_stage()
+    stage._process_stage()
+
+    # The input that ended is not read anymore
+    assert stage.sequences == [1]
+    assert not stage._running.is_set()
+
+
+def test_end_of_stream_is_sent_to_every_downstream_replica():
+    stage = MockStage(StageType.One2One, StageExecutor.THREAD)
+    replicated = MockStage(StageType.One2One, StageExecutor.THREAD, replicas=3)
+    stage.link(replicated, "test_key")
+    stage._send_end_of_stream()
+
+    queue = replicated.input_queues["test_key"]
+    assert queue.qsize() == 3
+    assert all(isinstance(queue.get_nowait(), PoisonPill) for _ in range(3))
+
+
+def test_last_replica_forwards_the_end_of_stream():
+    source = MockStage(StageType.One2One, StageExecutor.THREAD)
+    replicated = MockStage(StageType.One2One, StageExecutor.THREAD, replicas=2, queue_timeout=0.01)
+    sink = MockStage(StageType.One2One, StageExecutor.THREAD)
+    source.link(replicated, "test_key")
+    replicated.link(sink, "test_key")
+
+    replicated.start()
+    source._send_end_of_stream()
+    replicated.join(timeout=1.0)
+
+    assert not replicated.is_alive()
+    assert replicated._running.is_set()
+    assert sink.input_queues["test_key"].qsize() == 1
+    assert isinstance(sink.get_from_left("test_key"), PoisonPill)
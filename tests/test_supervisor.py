@@ -0,0 +1,204 @@
+# -*- coding: utf-8 -*-
+import multiprocessing as mp
+import os
+import signal
+import time
+
+import numpy as np
+import pytest
+
+from computer_vision_design_patterns.pipeline import Payload, Pipeline, Stage
+from computer_vision_design_patterns.pipeline.sample_stage.SimpleStreamStage import VideoStreamOutput
+from computer_vision_design_patterns.pipeline.stage import StageExecutor, StageType
+from computer_vision_design_patterns.pipeline.supervisor import RestartPolicy
+
+
+class FaultySource(Stage):
+    """Source whose worker crashes or hangs after a few payloads, in its first 'faulty_runs' runs."""
+
+    def __init__(self, fault: str, faulty_runs: int = 1):
+        Stage.__init__(self, stage_type=StageType.One2One, stage_executor=StageExecutor.PROCESS, queue_timeout=0.05)
+        self.fault = fault
+        self.faulty_runs = faulty_runs
+        self.runs = mp.Value("i", 0)
+        self._produced = 0
+
+    def pre_run(self):
+        with self.runs.get_lock():
+            self.runs.value += 1
+        self._produced = 0
+
+    def post_run(self):
+        pass
+
+    def process(self, key: str, payload: Payload | None) -> Payload | None:
+        time.sleep(0.005)
+        self._produced += 1
+        if self._produced > 3 and self.runs.value <= self.faulty_runs:
+            if self.fault == "crash":
+                os.kill(os.getpid(), signal.SIGKILL)
+            time.sleep(60)
+        return Payload()
+
+
+class CountingSink(Stage):
+    def __init__(self):
+        Stage.__init__(self, stage_type=StageType.Many2Many, stage_executor=StageExecutor.THREAD, queue_timeout=0.05)
+        self.received = 0
+
+    def pre_run(self):
+        pass
+
+    def post_run(self):
+        pass
+
+    def process(self, key: str, payload: Payload | None) -> Payload | None:
+        if payload is not None:
+            self.received += 1
+        return None
+
+
+def run_pipeline(source: Stage, policy: RestartPolicy, until, timeout: float = 10.0) -> tuple[Pipeline, CountingSink]:
+    sink = CountingSink()
+    pipeline = Pipeline(restart_policy=policy)
+    pipeline.stages = [source, sink]
+    Pipeline.link_stages(source, sink, "stream")
+
+    pipeline.start()
+    deadline = time.monotonic() + timeout
+    while not until(sink) and time.monotonic() < deadline:
+        time.sleep(0.01)
+    pipeline.stop(timeout=1)
+    return pipeline, sink
+
+
+def test_crashed_worker_is_restarted():
+    source = FaultySource("crash")
+    _, sink = run_pipeline(source, RestartPolicy(), lambda sink: sink.received >= 10)
+
+    assert sink.received >= 10
+    assert source.runs.value == 2
+    assert source.stats()["restarts"] == 1
+
+
+def test_hung_worker_is_restarted_after_the_deadline():
+    source = FaultySource("hang")
+    _, sink = run_pipeline(source, RestartPolicy(process_deadline=0.2), lambda sink: sink.received >= 10)
+
+    assert sink.received >= 10
+    assert source.stats()["restarts"] == 1
+
+
+class SilentSource(CountingSink):
+    def process(self, key: str, payload: Payload | None) -> Payload | None:
+        time.sleep(0.01)
+        return None
+
+
+class IdleHangingStage(Stage):
+    """Stage whose worker hangs in the process() call made while its input is empty, in its first run."""
+
+    def __init__(self):
+        Stage.__init__(self, stage_type=StageType.One2One, stage_executor=StageExecutor.PROCESS, queue_timeout=0.05)
+        self.runs = mp.Value("i", 0)
+        self.idle_calls = mp.Value("i", 0)
+
+    def pre_run(self):
+        with self.runs.get_lock():
+            self.runs.value += 1
+
+    def post_run(self):
+        pass
+
+    def process(self, key: str, payload: Payload | None) -> Payload | None:
+        if payload is None:
+            if self.runs.value == 1:
+                time.sleep(60)
+            with self.idle_calls.get_lock():
+                self.idle_calls.value += 1
+        return None
+
+
+def test_worker_hung_without_input_is_restarted():
+    source, stage = SilentSource(), IdleHangingStage()
+    pipeline = Pipeline(restart_policy=RestartPolicy(process_deadline=0.2))
+    pipeline.stages = [source, stage]
+    Pipeline.link_stages(source, stage, "stream")
+
+    pipeline.start()
+    deadline = time.monotonic() + 10
+    while stage.idle_calls.value == 0 and time.monotonic() < deadline:
+        time.sleep(0.01)
+    pipeline.stop(timeout=1)
+
+    assert stage.idle_calls.value > 0
+    assert stage.stats()["restarts"] == 1
+
+
+def test_stage_is_stopped_when_the_restarts_are_exhausted():
+    source = FaultySource("crash", faulty_runs=10)
+    pipeline, sink = run_pipeline(source, RestartPolicy(max_restarts=2), lambda sink: not sink.is_alive())
+
+    assert pipeline.supervisor.given_up() == [source]
+    assert source.runs.value == 3
+    # The end of stream has been sent for the dead worker
+    assert not sink.is_alive()
+
+
+def test_invalid_policy():
+    with pytest.raises(ValueError):
+        RestartPolicy(max_restarts=-1)
+
+    with pytest.raises(ValueError):
+        RestartPolicy(process_deadline=0)
+
+
+class LargeFrameSource(Stage):
+    """Source of large payloads whose first worker hangs in process() while they are still being written."""
+
+    def __init__(self):
+        Stage.__init__(self, stage_type=StageType.One2One, stage_executor=StageExecutor.PROCESS, queue_timeout=0.05)
+        self.runs = mp.Value("i", 0)
+        self._produced = 0
+
+    def pre_run(self):
+        with self.runs.get_lock():
+            self.runs.value += 1
+        self._produced = 0
+
+    def post_run(self):
+        pass
+
+    def process(self, key: str, payload: Payload | None) -> Payload | None:
+        self._produced += 1
+        if self._produced > 2 and self.runs.value == 1:
+            time.sleep(60)
+        time.sleep(0.01)
+        return VideoStreamOutput(frame=np.zeros((1024, 1024, 4), dtype=np.uint8))
+
+
+class StalledSink(CountingSink):
+    """Sink that stops reading for a while after the first payload, so the pipe of its queue fills up."""
+
+    def process(self, key: str, payload: Payload | None) -> Payload | None:
+        if payload is not None and self.received == 0:
+            time.sleep(1.0)
+        return CountingSink.process(self, key, payload)
+
+
+def test_killed_worker_gets_new_queues():
+    source = LargeFrameSource()
+    sink = StalledSink()
+    pipeline = Pipeline(restart_policy=RestartPolicy(process_deadline=0.2))
+    pipeline.stages = [source, sink]
+    Pipeline.link_stages(source, sink, "stream")
+
+    pipeline.start()
+    deadline = time.monotonic() + 10
+    while sink.received < 5 and time.monotonic() < deadline:
+        time.sleep(0.01)
+    pipeline.stop(timeout=1)
+
+    # The killed worker was writing the second payload, holding the lock of the queue pipe
+    assert source.stats()["restarts"] == 1
+    assert sink.received >= 5
@@ -0,0 +1,119 @@
+# -*- coding: utf-8 -*-
+import time
+
+import numpy as np
+import pytest
+
+from computer_vision_design_patterns.pipeline import Payload, Pipeline, Stage
+from computer_vision_design_patterns.pipeline.sample_stage import SyntheticStreamStage
+from computer_vision_design_patterns.pipeline.stage import StageExecutor, StageType
+
+
+def started(**kwargs) -> SyntheticStreamStage:
+    stage = SyntheticStreamStage(StageExecutor.THREAD, **kwargs)
+    stage.pre_run()
+    return stage
+
+
+@pytest.mark.parametrize("pattern", ["moving", "noise"])
+def test_frames_shape_and_dtype(pattern):
+    stage = started(resolution=(32, 24), dtype=np.uint16, pattern=pattern, pool_size=4)
+
+    frame = stage.process("a", None).frame
+    assert frame.shape == (24, 32, 3)
+    assert frame.dtype == np.uint16
+    assert frame.max() > 255
+
+
+def test_float_frames_in_unit_range():
+    stage = started(resolution=(16, 8), channels=1, dtype=np.float32, pool_size=2)
+
+    frame = stage.process("a", None).frame
+    assert frame.shape == (8, 16)
+    assert frame.dtype == np.float32
+    assert 0.0 <= frame.min() and frame.max() <= 1.0
+
+
+def test_frames_are_deterministic():
+    first = started(resolution=(16, 16), pattern="noise", pool_size=3, seed=5)
+    second = started(resolution=(16, 16), pattern="noise", pool_size=3, seed=5)
+
+    for _ in range(4):
+        assert np.array_equal(first.process("a", None).frame, second.process("a", None).frame)
+
+
+def test_pool_is_reused_and_read_only():
+    stage = started(resolution=(16, 16), pool_size=3)
+
+    frames = [stage.process("a", None).frame for _ in range(6)]
+    assert frames[0] is frames[3]
+    assert not np.array_equal(frames[0], frames[1])
+    assert not frames[0].flags.writeable
+
+
+def test_streams_start_at_different_frames():
+    stage = started(resolution=(16, 16), pool_size=16)
+
+    assert not np.array_equal(stage.process("a", None).frame, stage.process("b", None).frame)
+
+
+def test_fps_pacing():
+    stage = started(resolution=(8, 8), fps=50.0, queue_timeout=0.05)
+
+    start = time.monotonic()
+    frames = 0
+    while frames < 6:
+        if stage.process("a", None) is not None:
+            frames += 1
+
+    # The first frame is due immediately
+    assert time.monotonic() - start >= 5 / 50.0 * 0.9
+
+
+class FirstFrames(Stage):
+    def __init__(self):
+        Stage.__init__(self, stage_type=StageType.Many2Many, stage_executor=StageExecutor.THREAD, queue_timeout=0.05)
+        self.frames = {}
+
+    def pre_run(self):
+        pass
+
+    def post_run(self):
+        pass
+
+    def process(self, key: str, payload: Payload | None) -> Payload | None:
+        if payload is not None:
+            self.frames.setdefault(key, payload.frame)
+        return None
+
+
+def test_streams_linked_in_a_pipeline():
+    source = SyntheticStreamStage(StageExecutor.THREAD, resolution=(16, 16), fps=100.0, queue_timeout=0.05)
+    sink = FirstFrames()
+    pipeline = Pipeline()
+    pipeline.add_stage(source)
+    pipeline.add_stage(sink)
+    pipeline.link_stages(source, sink, "a")
+    pipeline.link_stages(source, sink, "b")
+
+    pipeline.start()
+    try:
+        deadline = time.monotonic() + 2.0
+        while len(sink.frames) < 2 and time.monotonic() < deadline:
+            time.sleep(0.01)
+    finally:
+        pipeline.stop(timeout=1.0)
+
+    assert set(sink.frames) == {"a", "b"}
+    assert not np.array_equal(sink.frames["a"], sink.frames["b"])
+
+
+def test_invalid_arguments():
+    with pytest.raises(ValueError):
+        SyntheticStreamStage(StageExecutor.THREAD, pattern="stripes")
+
+    with pytest.raises(ValueError):
+        SyntheticStreamStage(StageExecutor.THREAD, fps=0)
+
+    with pytest.raises(ValueError):
+        SyntheticStreamStage(StageExecutor.THREAD, pool_size=0)
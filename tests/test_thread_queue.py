@@ -0,0 +1,39 @@
+# -*- coding: utf-8 -*-
+from queue import Empty, Full
+
+import pytest
+
+from computer_vision_design_patterns.pipeline import Payload
+from computer_vision_design_patterns.pipeline.thread_queue import ThreadQueue
+
+
+def test_payload_is_passed_by_reference():
+    queue = ThreadQueue()
+    payload = Payload()
+    queue.put(payload)
+    assert queue.get(timeout=0.1) is payload
+
+
+def test_get_timeout_raises_empty():
+    queue = ThreadQueue()
+    with pytest.raises(Empty):
+        queue.get(timeout=0.01)
+
+
+def test_put_timeout_raises_full():
+    queue = ThreadQueue(maxsize=1)
+    queue.put(Payload())
+    with pytest.raises(Full):
+        queue.put(Payload(), timeout=0.01)
+    with pytest.raises(Full):
+        queue.put_nowait(Payload())
+
+
+def test_closed_queue_raises_value_error():
+    queue = ThreadQueue()
+    queue.close()
+    queue.join_thread()
+    with pytest.raises(ValueError):
+        queue.put(Payload())
+    with pytest.raises(ValueError):
+        queue.get_nowait()
@@ -0,0 +1,53 @@
+# -*- coding: utf-8 -*-
+import pickle
+
+import pytest
+
+from computer_vision_design_patterns.pipeline import Payload
+from computer_vision_design_patterns.pipeline.trace import MAX_HOPS, Trace
+
+
+def test_add_hop_records_times():
+    trace = Trace()
+    trace.add_hop(1.0, 2.0)
+    trace.mark_enqueued(2.5)
+    trace.add_hop(3.0, 3.5)
+
+    assert len(trace) == 2
+    assert trace.origin == 1.0
+    assert trace.hops() == [(1.0, 2.0, 2.5), (3.0, 3.5, 3.5)]
+    assert trace.latencies() == [(0.0, 1.0), (0.5, 0.5)]
+    assert trace.enqueued == 3.5
+
+
+def test_trace_keeps_a_fixed_size():
+    trace = Trace()
+    for hop in range(MAX_HOPS + 2):
+        trace.add_hop(float(hop), float(hop))
+    assert len(trace) == MAX_HOPS
+
+
+def test_copy_is_independent():
+    trace = Trace()
+    trace.add_hop(1.0, 2.0)
+    copy = trace.copy()
+    copy.add_hop(3.0, 4.0)
+    assert len(trace) == 1
+    assert len(copy) == 2
+
+
+def test_pickled_payload_keeps_the_trace():
+    trace = Trace()
+    trace.add_hop(1.0, 2.0)
+    payload = pickle.loads(pickle.dumps(Payload(trace=trace)))
+
+    assert payload.trace.hops() == [(1.0, 2.0, 2.0)]
+    assert len(pickle.dumps(trace)) < 300
+
+
+@pytest.mark.parametrize("hops", [0, 1])
+def test_enqueued_defaults_to_the_last_hop(hops):
+    trace = Trace()
+    for _ in range(hops):
+        trace.add_hop(1.0, 2.0)
+    assert trace.enqueued == (2.0 if hops else 0.0)
@@ -0,0 +1,101 @@
+# -*- coding: utf-8 -*-
+import time
+
+import cv2
+import numpy as np
+import pytest
+
+from computer_vision_design_patterns.pipeline import Payload, Pipeline, Stage
+from computer_vision_design_patterns.pipeline.sample_stage import VideoFileStage
+from computer_vision_design_patterns.pipeline.stage import StageExecutor, StageType
+
+FRAMES = 20
+
+
+class CollectingSink(Stage):
+    def __init__(self):
+        Stage.__init__(self, stage_type=StageType.Many2Many, stage_executor=StageExecutor.THREAD)
+        self.frames = []
+
+    def pre_run(self):
+        pass
+
+    def post_run(self):
+        pass
+
+    def process(self, key: str, payload: Payload | None) -> Payload | None:
+        if payload is not None:
+            self.frames.append((payload.sequence, payload.frame_index, int(payload.frame[0, 0, 0])))
+        return None
+
+
+@pytest.fixture(scope="module")
+def video(tmp_path_factory):
+    """Lossless video whose frame i has every pixel set to 10 * i."""
+    path = str(tmp_path_factory.mktemp("video") / "frames.avi")
+    writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*"FFV1"), 25, (32, 24))
+    if not writer.isOpened():
+        pytest.skip("FFV1 encoder not available")
+
+    for i in range(FRAMES):
+        writer.write(np.full((24, 32, 3), 10 * i, dtype=np.uint8))
+    writer.release()
+    return path
+
+
+def read_all(stage: VideoFileStage) -> list[tuple[int, int, int]]:
+    stage.pre_run()
+    frames = []
+    deadline = time.monotonic() + 5
+    while not stage._drained() and time.monotonic() < deadline:
+        payload = stage.process("stream", None)
+        if payload is not None:
+            frames.append((payload.sequence, payload.frame_index, int(payload.frame[0, 0, 0])))
+    stage.post_run()
+    return frames
+
+
+def test_range_and_stride(video):
+    stage = VideoFileStage(video, StageExecutor.THREAD, start=2, stop=12, stride=3, prefetch=2)
+
+    assert read_all(stage) == [(0, 2, 20), (1, 5, 50), (2, 8, 80), (3, 11, 110)]
+
+
+def test_reads_until_the_end_of_the_file(video):
+    stage = VideoFileStage(video, StageExecutor.THREAD, start=15)
+
+    assert [index for _, index, _ in read_all(stage)] == list(range(15, FRAMES))
+
+
+def test_chunks_cover_the_range(video):
+    stage = VideoFileStage(video, StageExecutor.THREAD, start=1, stride=2, replicas=3)
+
+    chunks = [stage.chunk(replica) for replica in range(3)]
+    assert [position for chunk in chunks for position in chunk] == list(range(10))
+
+
+def test_chunks_decoded_in_parallel_processes(video):
+    source = VideoFileStage(video, StageExecutor.PROCESS, replicas=2)
+    sink = CollectingSink()
+    pipeline = Pipeline()
+    pipeline.stages = [source, sink]
+    Pipeline.link_stages(source, sink, "stream")
+
+    pipeline.start()
+    deadline = time.monotonic() + 10
+    while sink.is_alive() and time.monotonic() < deadline:
+        time.sleep(0.01)
+    pipeline.stop()
+
+    assert sorted(sink.frames) == [(i, i, 10 * i) for i in range(FRAMES)]
+
+
+def test_invalid_arguments(video):
+    with pytest.raises(ValueError):
+        VideoFileStage(video, StageExecutor.THREAD, start=5, stop=5)
+
+    with pytest.raises(ValueError):
+        VideoFileStage(video, StageExecutor.THREAD, stride=0)
+
+    with pytest.raises(ValueError):
+        VideoFileStage(video, StageExecutor.THREAD, start=FRAMES, replicas=2)